@@ -2,10 +2,18 @@ from .research_agent import ResearchAgent
 from .prompt import (
     SYSTEM_RESEARCH_BASE,
     PLAN_PROMPT,
+    PLAN_DELTA_PROMPT,
     SYNTHESIS_PROMPT,
+    SYNTHESIS_MAP_PROMPT,
+    SYNTHESIS_REDUCE_PROMPT,
     CRITIQUE_PROMPT,
+    CRITIQUE_PATCH_PROMPT,
+    CRITIQUE_SECTIONS_PROMPT,
     MEMORY_SUMMARIZE_PROMPT,
-    RESEARCH_PROMPT
+    RESEARCH_PROMPT,
+    RESEARCH_SKELETON_PROMPT,
+    RESEARCH_SECTION_PROMPT,
+    RESEARCH_REVISION_PROMPT
 )
 
 # 为了向后兼容，也可以导出 prompts 模块本身
@@ -15,9 +23,17 @@ __all__ = [
     "ResearchAgent",
     "SYSTEM_RESEARCH_BASE",
     "PLAN_PROMPT",
+    "PLAN_DELTA_PROMPT",
     "SYNTHESIS_PROMPT",
+    "SYNTHESIS_MAP_PROMPT",
+    "SYNTHESIS_REDUCE_PROMPT",
     "CRITIQUE_PROMPT",
+    "CRITIQUE_PATCH_PROMPT",
+    "CRITIQUE_SECTIONS_PROMPT",
     "MEMORY_SUMMARIZE_PROMPT",
     "RESEARCH_PROMPT",
+    "RESEARCH_SKELETON_PROMPT",
+    "RESEARCH_SECTION_PROMPT",
+    "RESEARCH_REVISION_PROMPT",
     "prompts",
 ]
\ No newline at end of file
@@ -0,0 +1,204 @@
+from typing import Any, Dict, Iterable, List
+from collections import Counter, deque
+from pathlib import Path
+import json
+import os
+import re
+import threading
+import time
+import weakref
+
+from .retrieval import lexical_terms, bm25_from_counters
+from ..config.settings import settings
+
+_SAFE_KEY_RE = re.compile(r"[^A-Za-z0-9_.-]+")
+# 每个进程对同一归档目录只做一次保留清理
+_pruned_dirs: set = set()
+_pruned_lock = threading.Lock()
+# 同一文件在进程内只有一个 MemoryArchive（见 open_archive）；会话都结束后实例随之释放
+_open_archives: "weakref.WeakValueDictionary[Path, MemoryArchive]" = weakref.WeakValueDictionary()
+_open_lock = threading.Lock()
+
+
+def _chunks(text: str, size: int) -> List[str]:
+    """按段落切分，单段过长时再按固定字符数切分。"""
+    out: List[str] = []
+    buf = ""
+    for para in re.split(r"\n\s*\n", text or ""):
+        para = para.strip()
+        if not para:
+            continue
+        while len(para) > size:
+            if buf:
+                out.append(buf)
+                buf = ""
+            out.append(para[:size])
+            para = para[size:]
+        if buf and len(buf) + len(para) + 2 > size:
+            out.append(buf)
+            buf = ""
+        buf = f"{buf}\n\n{para}" if buf else para
+    if buf:
+        out.append(buf)
+    return out
+
+
+def prune_archives(base: Path, max_age_days: float, max_files: int, keep: Path | None = None) -> List[Path]:
+    """
+    按保留策略删除归档文件：最后写入早于 max_age_days 天的文件，以及按最后写入时间排在 max_files 之后的文件。
+    keep 为当前会话正在使用的文件，不会被删除。返回已删除的路径。
+    """
+    files = []
+    for path in base.glob("*.jsonl"):
+        try:
+            files.append((path.stat().st_mtime, path))
+        except OSError:
+            continue
+    files.sort(reverse=True)
+    cutoff = time.time() - max_age_days * 86400 if max_age_days else None
+    removed = []
+    for rank, (mtime, path) in enumerate(files):
+        if path == keep:
+            continue
+        if (cutoff is not None and mtime < cutoff) or (max_files and rank >= max_files):
+            try:
+                path.unlink()
+                removed.append(path)
+            except OSError:
+                continue
+    return removed
+
+
+class MemoryArchive:
+    """
+    长期记忆归档：maybe_compress 淘汰的消息按块写入本地 JSONL 文件，并维护 BM25 倒排统计。
+    每个会话（或用户）一个文件；每行保存块文本及其词频，重启后加载无需重新分词。
+    内存中最多保留 max_chunks 个最新的块（超出时淘汰最旧的块并同步倒排统计），文件行数超过上限两倍时重写为保留的块；
+    首次打开某目录时按 settings.memory_archive_max_age_days / max_files 清理旧的归档文件。
+    同一文件的多个实例各自重写文件会互相覆盖对方追加的块，多个会话共用一个文件（按用户归档）时应经 open_archive 获取。
+    """
+
+    def __init__(self, key: str, base_dir: str | Path | None = None, chunk_chars: int | None = None,
+                 max_chunks: int | None = None):
+        base = Path(base_dir) if base_dir else settings.resolve_archive_dir()
+        base.mkdir(parents=True, exist_ok=True)
+        self.path = base / f"{_SAFE_KEY_RE.sub('_', key) or 'default'}.jsonl"
+        self.chunk_chars = chunk_chars or settings.memory_archive_chunk_chars
+        self.max_chunks = settings.memory_archive_max_chunks if max_chunks is None else max_chunks
+        self._file_lines = 0
+        self._chunks: List[Dict[str, Any]] = []
+        self._tfs: List[Counter] = []
+        self._df: Counter = Counter()
+        self._total_len = 0
+        self._lock = threading.Lock()
+        self._prune(base)
+        self._load()
+
+    def _prune(self, base: Path):
+        with _pruned_lock:
+            if base in _pruned_dirs:
+                return
+            _pruned_dirs.add(base)
+        removed = prune_archives(base, settings.memory_archive_max_age_days, settings.memory_archive_max_files,
+                                 keep=self.path)
+        if removed and settings.debug:
+            print(f"🧹 已清理 {len(removed)} 个过期的记忆归档文件")
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        # 只保留文件末尾最新的 max_chunks 行，旧块不进入内存
+        lines = deque(maxlen=self.max_chunks or None)
+        with self.path.open("r", encoding="utf-8") as f:
+            for line in f:
+                self._file_lines += 1
+                lines.append(line)
+        for line in lines:
+            try:
+                self._index(json.loads(line))
+            except ValueError:
+                continue
+        if self.max_chunks and self._file_lines > self.max_chunks:
+            self._rewrite()
+
+    def _index(self, chunk: Dict[str, Any]):
+        tf = Counter(chunk.get("tf") or {})
+        self._chunks.append(chunk)
+        self._tfs.append(tf)
+        self._df.update(tf.keys())
+        self._total_len += sum(tf.values())
+
+    def _evict(self):
+        """淘汰超出 max_chunks 的最旧块，并从文档频率与总长度中扣除。"""
+        excess = len(self._chunks) - self.max_chunks
+        if not self.max_chunks or excess <= 0:
+            return
+        for tf in self._tfs[:excess]:
+            self._df.subtract(tf.keys())
+            self._total_len -= sum(tf.values())
+        self._df = +self._df  # 去掉计数归零的词
+        del self._chunks[:excess]
+        del self._tfs[:excess]
+
+    def _rewrite(self):
+        """把文件重写为内存中保留的块（先写临时文件再替换）。"""
+        tmp = self.path.with_suffix(f".jsonl.{os.getpid()}.{id(self)}.tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            for chunk in self._chunks:
+                f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+        tmp.replace(self.path)
+        self._file_lines = len(self._chunks)
+
+    def add_messages(self, messages: Iterable[Any]) -> int:
+        """归档一批消息（Message 或 {"role","content"} 映射），返回新增块数。"""
+        new = []
+        now = time.time()
+        for m in messages:
+            for text in _chunks(m["content"], self.chunk_chars):
+                new.append({"role": m["role"], "text": text, "ts": now, "tf": Counter(lexical_terms(text))})
+        if not new:
+            return 0
+        with self._lock:
+            with self.path.open("a", encoding="utf-8") as f:
+                for chunk in new:
+                    f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+                    self._index(chunk)
+            self._file_lines += len(new)
+            self._evict()
+            if self.max_chunks and self._file_lines > 2 * self.max_chunks:
+                self._rewrite()
+        return len(new)
+
+    def search(self, query: str, k: int | None = None) -> List[Dict[str, Any]]:
+        k = k or settings.memory_archive_top_k
+        with self._lock:
+            if not self._chunks:
+                return []
+            scores = bm25_from_counters(
+                lexical_terms(query), self._tfs,
+                df=self._df, avgdl=self._total_len / len(self._chunks) or 1.0,
+            )
+            ranked = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:k]
+            return [
+                {"role": self._chunks[i]["role"], "text": self._chunks[i]["text"], "score": round(scores[i], 3)}
+                for i in ranked if scores[i] > 0
+            ]
+
+    def render(self, query: str, k: int | None = None) -> str:
+        """把召回的归档块渲染为可直接放入提示词的文本；无命中时返回空串。"""
+        hits = self.search(query, k)
+        return "\n".join(f"- [{h['role']}] {h['text']}" for h in hits)
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+
+def open_archive(key: str, base_dir: str | Path | None = None) -> MemoryArchive:
+    """按 key 取得进程内共享的归档实例：同一用户的多个会话共用一个实例（同一把锁、同一份内存索引）。"""
+    base = Path(base_dir) if base_dir else settings.resolve_archive_dir()
+    path = (base / f"{_SAFE_KEY_RE.sub('_', key) or 'default'}.jsonl").resolve()
+    with _open_lock:
+        archive = _open_archives.get(path)
+        if archive is None:
+            archive = _open_archives[path] = MemoryArchive(key, base)
+        return archive
@@ -0,0 +1,282 @@
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Hashable, Iterator, Optional
+import atexit
+import gzip
+import json
+import os
+import threading
+import time
+
+from ..config.settings import settings
+
+
+class CassetteMiss(KeyError):
+    """回放模式下请求不在录制文件中。"""
+
+
+def _read_lines(path: Path) -> Iterator[str]:
+    """
+    逐行读取录制文件。.gz 文件由多个 gzip 成员拼接而成（每条记录一个成员），进程被杀死时最后一个成员可能不完整：
+    此时保留之前的记录，丢弃被截断的最后一条。
+    """
+    if path.suffix != ".gz":
+        with path.open("r", encoding="utf-8") as f:
+            yield from f
+        return
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                yield line
+        except (EOFError, gzip.BadGzipFile, OSError) as e:
+            if settings.debug:
+                print(f"⚠️  录制文件末尾不完整，已忽略最后一条记录: {e}")
+
+
+def _encode_message(msg: Any) -> Dict[str, Any]:
+    return {
+        "content": getattr(msg, "content", msg if isinstance(msg, str) else str(msg)),
+        "usage_metadata": dict(getattr(msg, "usage_metadata", None) or {}) or None,
+    }
+
+
+def _decode_message(data: Dict[str, Any]) -> Any:
+    from langchain_core.messages import AIMessage
+    return AIMessage(content=data.get("content", ""), usage_metadata=data.get("usage_metadata"))
+
+
+class _ReplayedResponse:
+    """回放的 MCP HTTP 响应，只实现 MCPToolClient 用到的 requests.Response 接口。"""
+
+    def __init__(self, status: int, headers: Dict[str, str], body: str, url: str, body_s: float = 0.0):
+        import requests
+        # 读取正文的耗时（录制的总耗时减去首字节耗时），回放时均匀分摊到各块
+        self._body_s = body_s
+        self._resp = requests.Response()
+        self._resp.status_code = status
+        self._resp.headers.update(headers)
+        self._resp._content = body.encode("utf-8")
+        self._resp.encoding = "utf-8"
+        self._resp.url = url
+        # 正文已在内存中：iter_content 直接按块切分 _content
+        self._resp._content_consumed = True
+
+    def iter_content(self, chunk_size: int = 1, decode_unicode: bool = False) -> Iterator[Any]:
+        chunks = list(self._resp.iter_content(chunk_size, decode_unicode))
+        delay = self._body_s / len(chunks) if chunks and self._body_s > 0 else 0.0
+        for chunk in chunks:
+            if delay:
+                time.sleep(delay)
+            yield chunk
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._resp, name)
+
+
+class Cassette:
+    """
+    LLM / MCP 交互的录制与回放。mode="record" 时把每次交互（请求键、响应、首块与总耗时）追加写入 JSONL
+    （路径以 .gz 结尾时每条记录压缩为一个 gzip 成员，异常退出也不会丢失已写入的记录）；mode="replay" 时按请求键
+    依次返回录制的响应，并按 latency_scale 缩放后的原始耗时等待（0 表示不等待）：MCP 响应先等待首字节耗时，
+    其余耗时在读取正文时按块分摊。同一请求键被录制多次时按录制顺序回放，用尽后重复最后一条。
+    请求键：LLM 为 singleflight.prompt_key（模型 + 消息 + max_tokens），MCP 为（工具名, 规范化查询）。
+    strict=False 时，键不匹配的请求（如提示词含召回内容等运行时差异）按录制顺序取同类中下一条未回放的记录。
+    """
+
+    def __init__(self, path: str | Path, mode: str = "replay", latency_scale: float = 1.0, strict: bool = False):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"未知的录制模式: {mode}（可选 record / replay）")
+        self.path = Path(path)
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.strict = strict
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+        self._entries: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+        self._last: Dict[str, Dict[str, Any]] = {}
+        self._order: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+        self.hits = 0
+        self.fallbacks = 0
+        self.misses = 0
+        self.recorded = 0
+        if mode == "replay":
+            if not self.path.exists():
+                raise FileNotFoundError(f"录制文件不存在: {self.path}")
+            for line in _read_lines(self.path):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # 被截断的最后一行
+                    continue
+                self._entries[self._key(entry["kind"], entry["key"])].append(entry)
+                self._order[entry["kind"]].append(entry)
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # .gz 文件每条记录单独压缩为一个 gzip 成员并立即写出：进程异常退出时已写入的记录都能读回
+            self._gzip = self.path.suffix == ".gz"
+            self._file = self.path.open("ab") if self._gzip else self.path.open("a", encoding="utf-8")
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @staticmethod
+    def _key(kind: str, key: Hashable) -> str:
+        return f"{kind}:{json.dumps(key, ensure_ascii=False) if not isinstance(key, str) else key}"
+
+    def _write(self, entry: Dict[str, Any]):
+        with self._lock:
+            entry["t"] = round(time.perf_counter() - self._t0, 4)
+            line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+            self._file.write(gzip.compress(line.encode("utf-8")) if self._gzip else line)
+            self._file.flush()
+            self.recorded += 1
+
+    def _take(self, kind: str, key: Hashable) -> Dict[str, Any]:
+        k = self._key(kind, key)
+        with self._lock:
+            queue = self._entries.get(k)
+            order = self._order[kind]
+            if queue:
+                entry = self._last[k] = queue.popleft()
+                self.hits += 1
+            elif k in self._last:
+                entry = self._last[k]
+                self.hits += 1
+            else:
+                while order and order[0].get("_played"):
+                    order.popleft()
+                if self.strict or not order:
+                    self.misses += 1
+                    raise CassetteMiss(f"录制文件中没有该请求: {k[:120]}")
+                entry = order.popleft()
+                self._entries[self._key(kind, entry["key"])].remove(entry)
+                self.fallbacks += 1
+            entry["_played"] = True
+        return entry
+
+    def _sleep(self, seconds: Optional[float]):
+        if self.latency_scale > 0 and seconds:
+            time.sleep(seconds * self.latency_scale)
+
+    def llm(self, key: Hashable, invoke: Callable[[], Any], stream: Callable[[], Any] | None = None) -> Any:
+        """一次 LLM 调用。录制时若提供 stream，则以流式方式调用以记录首块耗时，再拼接为完整消息。"""
+        if not self.recording:
+            entry = self._take("llm", key)
+            # 回放返回完整消息，调用方看到的是整次调用的耗时
+            self._sleep(entry.get("total_s"))
+            if entry.get("error"):
+                raise RuntimeError(f"(回放) {entry['error']}")
+            return _decode_message(entry["response"])
+
+        t0 = time.perf_counter()
+        ttft, chunks, result = None, 0, None
+        try:
+            if stream is not None:
+                for chunk in stream():
+                    if ttft is None:
+                        ttft = time.perf_counter() - t0
+                    chunks += 1
+                    result = chunk if result is None else result + chunk
+            else:
+                result = invoke()
+        except Exception as e:
+            self._write({"kind": "llm", "key": key, "error": f"{type(e).__name__}: {e}"[:500],
+                         "total_s": round(time.perf_counter() - t0, 4)})
+            raise
+        self._write({"kind": "llm", "key": key, "response": _encode_message(result),
+                     "ttft_s": round(ttft, 4) if ttft is not None else None, "chunks": chunks or None,
+                     "total_s": round(time.perf_counter() - t0, 4)})
+        return result
+
+    def http(self, key: Hashable, send: Callable[[], Any], max_bytes: int = 0) -> Any:
+        """
+        一次 MCP HTTP 交互：录制状态码、Content-Type 与响应正文；请求异常也会被录制并在回放时重新抛出。
+        max_bytes > 0 时正文最多录制该字节数（与调用方流式读取的上限一致），并返回由录制内容构造的响应。
+        """
+        import requests
+        if not self.recording:
+            entry = self._take("mcp", key)
+            total, ttfb = entry.get("total_s") or 0.0, entry.get("ttfb_s")
+            if entry.get("error") or ttfb is None:
+                self._sleep(total)
+            else:
+                # 首字节之前的耗时在返回响应前等待，其余耗时在读取正文时按块分摊
+                self._sleep(min(ttfb, total))
+            if entry.get("error"):
+                raise requests.ConnectionError(f"(回放) {entry['error']}")
+            body_s = max(total - ttfb, 0.0) * self.latency_scale if ttfb is not None else 0.0
+            return _ReplayedResponse(entry["status"], entry.get("headers") or {}, entry.get("body", ""),
+                                     entry.get("url", ""), body_s)
+
+        t0 = time.perf_counter()
+        try:
+            resp = send()
+            if max_bytes:
+                chunks, size = [], 0
+                for chunk in resp.iter_content(chunk_size=16 * 1024):
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size >= max_bytes:
+                        break
+                resp.close()
+                body = b"".join(chunks)[:max_bytes].decode(resp.encoding or "utf-8", errors="ignore")
+            else:
+                body = resp.text
+        except requests.RequestException as e:
+            self._write({"kind": "mcp", "key": key, "error": str(e)[:500], "total_s": round(time.perf_counter() - t0, 4)})
+            raise
+        headers = {k: v for k, v in resp.headers.items() if k.lower() in ("content-type", "mcp-session-id")}
+        self._write({"kind": "mcp", "key": key, "status": resp.status_code, "url": resp.url, "headers": headers,
+                     "body": body, "ttfb_s": round(resp.elapsed.total_seconds(), 4),
+                     "total_s": round(time.perf_counter() - t0, 4)})
+        if max_bytes:
+            return _ReplayedResponse(resp.status_code, headers, body, resp.url)
+        return resp
+
+    def close(self):
+        if self.recording:
+            with self._lock:
+                if not self._file.closed:
+                    self._file.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"mode": self.mode, "path": str(self.path), "recorded": self.recorded,
+                "hits": self.hits, "fallbacks": self.fallbacks, "misses": self.misses}
+
+
+_active: Optional[Cassette] = None
+_loaded = False
+_active_lock = threading.Lock()
+
+
+def active() -> Optional[Cassette]:
+    """
+    当前进程的录制/回放实例：settings.cassette_mode（或环境变量 CASSETTE_MODE）为 record / replay 时按
+    cassette_path（CASSETTE_PATH）创建；未开启时返回 None，调用方直接访问网络。
+    """
+    global _active, _loaded
+    if _loaded:
+        return _active
+    with _active_lock:
+        if not _loaded:
+            mode = os.getenv("CASSETTE_MODE") or settings.cassette_mode
+            if mode:
+                scale = float(os.getenv("CASSETTE_LATENCY_SCALE") or settings.cassette_latency_scale)
+                _active = Cassette(settings.resolve_cassette_path(), mode, scale, settings.cassette_strict)
+                if _active.recording:
+                    atexit.register(_active.close)
+            _loaded = True
+    return _active
+
+
+def use(cassette: Optional[Cassette]) -> Optional[Cassette]:
+    """以编程方式启用（或传 None 关闭）录制/回放，返回之前的实例。"""
+    global _active, _loaded
+    with _active_lock:
+        previous, _active, _loaded = _active, cassette, True
+    if cassette is not None and cassette.recording:
+        atexit.register(cassette.close)
+    return previous
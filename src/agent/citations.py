@@ -0,0 +1,127 @@
+from typing import Any, Dict, List, Optional, Tuple
+import re
+
+from .store import canonical_url
+from ..config.settings import settings
+
+# 引用标注：[3]、[3, 5]、[3，5、7]；连同前导空白一起匹配，删除标注时不留下多余空格
+_MARKER_RE = re.compile(r"([ \t]*)\[(\d+(?:\s*[,，、]\s*\d+)*)\]")
+_SPLIT_RE = re.compile(r"\s*[,，、]\s*")
+# 代码块与行内代码中的 [n] 是下标而不是引用，原样保留
+_CODE_RE = re.compile(r"(```.*?```|`[^`\n]*`)", re.S)
+# 不含引用标注的顶层字段
+SKIP_KEYS = ("references", "mermaid_diagrams")
+
+
+class _Renumberer:
+    """按首次出现顺序把原始编号映射为连续的新编号；同一 URL 的不同编号合并为同一个新编号。"""
+
+    def __init__(self, resolve, known_keys, drop_unverified: bool):
+        self.resolve = resolve
+        self.known_keys = known_keys
+        self.drop_unverified = drop_unverified
+        self.by_key: Dict[str, int] = {}
+        self.refs: List[Dict[str, str]] = []
+        self.mapping: Dict[int, int] = {}
+        self.dropped: Dict[int, None] = {}
+        self.unverified: Dict[int, None] = {}
+
+    def new_number(self, old: int) -> Optional[int]:
+        if old in self.mapping:
+            return self.mapping[old]
+        ref = self.resolve(old)
+        if ref is None:
+            self.dropped.setdefault(old, None)
+            return None
+        key = canonical_url(ref["url"])
+        verified = key in self.known_keys
+        if not verified and self.drop_unverified:
+            self.dropped.setdefault(old, None)
+            return None
+        n = self.by_key.get(key)
+        if n is None:
+            self.refs.append({"title": ref.get("title") or ref["url"], "url": ref["url"]})
+            n = self.by_key[key] = len(self.refs)
+            if not verified:
+                self.unverified.setdefault(n, None)
+        self.mapping[old] = n
+        return n
+
+    def marker(self, m: "re.Match") -> str:
+        numbers: List[int] = []
+        for part in _SPLIT_RE.split(m.group(2)):
+            n = self.new_number(int(part))
+            if n is not None and n not in numbers:
+                numbers.append(n)
+        return m.group(1) + "[" + ", ".join(map(str, numbers)) + "]" if numbers else ""
+
+
+def _rewrite(value: Any, marker) -> Any:
+    """递归改写所有字符串中的引用标注（代码片段除外），marker 为 re.sub 的替换函数。"""
+    if isinstance(value, str):
+        parts = _CODE_RE.split(value)
+        # split 保留分隔组：奇数下标是代码片段
+        return "".join(p if i % 2 else _MARKER_RE.sub(marker, p) for i, p in enumerate(parts))
+    if isinstance(value, dict):
+        return {k: _rewrite(v, marker) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_rewrite(v, marker) for v in value]
+    return value
+
+
+def remap_markers(value: Any, mapping: Dict[int, int], keep_unknown: bool = True) -> Any:
+    """按 mapping 改写正文中的 [n] 编号；不在 mapping 中的编号默认保持不变，keep_unknown=False 时删除。"""
+    def marker(m: "re.Match") -> str:
+        numbers: List[int] = []
+        for part in _SPLIT_RE.split(m.group(2)):
+            n = mapping.get(int(part), int(part) if keep_unknown else None)
+            if n is not None and n not in numbers:
+                numbers.append(n)
+        return m.group(1) + "[" + ", ".join(map(str, numbers)) + "]" if numbers else ""
+
+    return _rewrite(value, marker)
+
+
+def reconcile_citations(report: Dict[str, Any], url_list: Optional[Dict[int, Dict[str, Any]]] = None,
+                        drop_unverified: Optional[bool] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    在本地校对技术方案中的引用，代替提示词里的一致性约束：
+      1. 按字段顺序收集正文中的 [n] 标注（跳过 references / mermaid_diagrams 以及代码片段）；
+      2. 把编号解析为 URL：以 url_list[n] 为准，只有 url_list 中没有该编号时才取模型给出的 references[n-1]；
+      3. 按首次出现顺序重新连续编号，同一 URL 合并为一个编号，无法解析的标注删除；
+      4. 按新编号重建 references，未被引用的条目被裁剪；
+      5. URL 不在 url_list（即调研数据）中的引用标记为 unverified，drop_unverified 时一并删除。
+    url_list 为 {编号: {"url", "title"}}。返回 (新报告, 问题统计)，不修改传入的 report。
+    """
+    url_list = url_list or {}
+    if drop_unverified is None:
+        drop_unverified = settings.citation_drop_unverified
+    model_refs = [r for r in (report.get("references") or [])
+                  if isinstance(r, dict) and isinstance(r.get("url"), str) and r["url"].strip()]
+
+    def resolve(n: int) -> Optional[Dict[str, Any]]:
+        # 正文编号取自调研数据的 URL 列表；模型的 references 可能已自行裁剪重排，只作为补充
+        if n in url_list:
+            return url_list[n]
+        if 1 <= n <= len(model_refs):
+            return model_refs[n - 1]
+        return None
+
+    renum = _Renumberer(resolve, {canonical_url(e["url"]) for e in url_list.values()}, drop_unverified)
+    out: Dict[str, Any] = {}
+    for key, value in report.items():
+        if key == "references":
+            continue
+        out[key] = value if key in SKIP_KEYS else _rewrite(value, renum.marker)
+    out["references"] = renum.refs
+
+    cited_keys = set(renum.by_key)
+    issues = {
+        "cited": len(renum.refs),
+        # 编号发生变化的标注：原编号 -> 新编号
+        "renumbered": {old: new for old, new in renum.mapping.items() if old != new},
+        "dropped_markers": list(renum.dropped),
+        "pruned_references": sum(1 for r in model_refs if canonical_url(r["url"]) not in cited_keys),
+        "unverified": [{"n": n, "url": renum.refs[n - 1]["url"]} for n in renum.unverified],
+    }
+    return out, issues
@@ -0,0 +1,83 @@
+from typing import Any, Dict, List, Tuple
+
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, BaseMessage
+
+from .memory import ConversationMemory, Message
+from .tokens import token_mode
+from .retrieval import bm25_scores
+from ..config.settings import settings
+
+
+def to_langchain(m: Message) -> BaseMessage:
+    if m.role == "user":
+        return HumanMessage(content=m.content)
+    if m.role == "system":
+        return SystemMessage(content=m.content)
+    return AIMessage(content=m.content)
+
+
+class ContextBuilder:
+    """
+    按固定 token 预算组装发给 LLM 的上下文：
+      1. system 消息、压缩上下文、最近 recent_n 条消息必定包含；
+      2. 剩余预算按与新用户消息的本地 BM25 相关度，依次填入更早的消息；
+      3. 最终按原始时间顺序输出，并返回本次组装的 token 统计。
+    token_mode 为 "approx" 时第 2 步按快速估算打包，打包完成后再以精确计数检查预算，超出时按相关度从低到高剔除。
+    """
+
+    def __init__(self, budget_tokens: int, recent_n: int | None = None, token_mode: str | None = None):
+        self.budget_tokens = budget_tokens
+        self.recent_n = recent_n if recent_n is not None else settings.context_recent_messages
+        self.token_mode = token_mode
+
+    def build(self, system_message: SystemMessage, memory: ConversationMemory,
+              user_message: str, recalled: str = "") -> Tuple[List[BaseMessage], Dict[str, Any]]:
+        msgs = list(memory.messages)
+        n_recent = min(len(msgs), max(self.recent_n, 1))
+        older, recent = msgs[:len(msgs) - n_recent], msgs[len(msgs) - n_recent:]
+
+        mode = self.token_mode or token_mode("context")
+        head: List[BaseMessage] = [system_message]
+        fixed = [Message("system", system_message.content)]
+        if memory.compressed_context:
+            ctx = memory._context_message()
+            head.append(to_langchain(ctx))
+            fixed.append(ctx)
+        if recalled:
+            # 从长期记忆归档中召回的片段与压缩上下文一样固定包含
+            archived = Message("system", f"[ARCHIVED_MEMORY]\n{recalled}")
+            head.append(to_langchain(archived))
+            fixed.append(archived)
+        fixed.extend(recent)
+        used = sum(m.token_count(mode) for m in fixed)
+
+        # 用剩余预算挑选相关度最高的早期消息
+        chosen: List[int] = []
+        remaining = self.budget_tokens - used
+        if older and remaining > 0:
+            scores = bm25_scores(user_message, [m.content for m in older])
+            for idx in sorted(range(len(older)), key=lambda i: scores[i], reverse=True):
+                if scores[idx] <= 0:
+                    break
+                cost = older[idx].token_count(mode)
+                if cost <= remaining:
+                    chosen.append(idx)
+                    remaining -= cost
+                    used += cost
+
+        if mode == "approx":
+            # 估算只用于打包，是否超出预算以精确计数为准；chosen 按相关度降序，从末尾剔除
+            used = sum(m.token_count("exact") for m in fixed) + sum(older[i].token_count("exact") for i in chosen)
+            while chosen and used > self.budget_tokens:
+                used -= older[chosen.pop()].token_count("exact")
+
+        body = [older[i] for i in sorted(chosen)] + recent
+        stats = {
+            "tokens": used,
+            "budget": self.budget_tokens,
+            "recent": len(recent),
+            "recalled": len(chosen),
+            "dropped": len(older) - len(chosen),
+            "over_budget": used > self.budget_tokens,
+        }
+        return head + [to_langchain(m) for m in body], stats
@@ -0,0 +1,202 @@
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+import contextvars
+import math
+import threading
+import time
+
+from .scheduler import PriorityExecutor, note_pool_wait
+from ..config.settings import settings
+
+
+class DeadlineExceeded(TimeoutError):
+    """某个阶段在本轮剩余时间内没有完成。"""
+
+
+class CallCancelled(BaseException):
+    """
+    任务已被 map_with_deadline / run_with_deadline 放弃，叶子调用在发出外部请求前检查到取消信号。
+    与 asyncio.CancelledError 一样不继承 Exception：不计入失败统计，合并到它上面的其他调用方（singleflight）
+    会自行重新执行，而不是收到这次取消。
+    """
+
+
+# 当前任务的取消信号（嵌套提交时包含外层任务的信号）与截止时刻（monotonic），由 submit 设置到任务的 contextvars 中
+_cancel: contextvars.ContextVar[Tuple[threading.Event, ...]] = contextvars.ContextVar("deadline_cancel", default=())
+_due: contextvars.ContextVar[float | None] = contextvars.ContextVar("deadline_due", default=None)
+
+
+def cancelled() -> bool:
+    """当前任务是否已被放弃。"""
+    return any(event.is_set() for event in _cancel.get())
+
+
+def check_cancelled():
+    """当前任务已被放弃时抛出 CallCancelled；在发出外部调用（或排队获得槽位）之后、真正请求之前调用。"""
+    if cancelled():
+        raise CallCancelled()
+
+
+def call_timeout(timeout: float | None, floor: float = 1.0) -> float | None:
+    """把单次外部调用的超时收窄到当前任务的剩余时间（不低于 floor）；不在有截止时刻的任务中时原样返回。"""
+    due = _due.get()
+    if due is None:
+        return timeout
+    left = max(floor, due - time.monotonic())
+    return min(timeout, left) if timeout else left
+
+
+class Deadline:
+    """
+    单轮对话的端到端时间预算。各阶段（plan / search / synthesis）从同一个 Deadline 取剩余时间，
+    据此设置调用超时，并用 pressure() 决定是否降级。budget_s 为 None 表示不限时。
+    """
+
+    # 剩余比例低于这些阈值时，压力等级依次为 1/2/3
+    _PRESSURE_STEPS = (0.6, 0.35, 0.15)
+
+    def __init__(self, budget_s: float | None = None):
+        self.budget_s = budget_s if budget_s and budget_s > 0 else None
+        self.start = time.monotonic()
+
+    def due(self) -> float | None:
+        """截止时刻（time.monotonic() 的时间基准）；不限时为 None。"""
+        return None if self.budget_s is None else self.start + self.budget_s
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    def remaining(self) -> float:
+        if self.budget_s is None:
+            return math.inf
+        return self.budget_s - self.elapsed()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, cap: float, floor: float = 1.0) -> float:
+        """给单次外部调用的超时：不超过 cap，也不低于 floor（避免传 0 导致立即失败）。"""
+        return max(floor, min(cap, self.remaining()))
+
+    def pressure(self) -> int:
+        """0 = 宽裕；1 = 减少子问题；2 = 缩短生成长度；3 = 仅做最小化综合。"""
+        if self.budget_s is None:
+            return 0
+        left = max(self.remaining(), 0.0) / self.budget_s
+        return sum(1 for step in self._PRESSURE_STEPS if left < step)
+
+
+_executor: PriorityExecutor | None = None
+_stage_executor: ThreadPoolExecutor | None = None
+
+
+def executor() -> PriorityExecutor:
+    """
+    进程级共享线程池（扇出的叶子调用：搜索、分治综合的 map）。被放弃的调用不阻塞调用方：
+    尚未开始的任务直接取消，已在执行的任务收到取消信号（见 map_with_deadline），其线程最多再占用到该调用自身的超时。
+    任务按提交方的调度类别与会话排队（见 scheduler.PriorityExecutor），交互会话不会排在批处理任务之后。
+    """
+    global _executor
+    if _executor is None:
+        _executor = PriorityExecutor("agent-io", max(settings.search_concurrency * 2, 4), settings.scheduler_class_caps)
+    return _executor
+
+
+def stage_executor() -> ThreadPoolExecutor:
+    """
+    run_with_deadline 使用的阶段线程池。阶段（如综合）内部还会经 map_with_deadline 向 executor() 扇出，
+    两者共用一个池时，并发会话的阶段任务占满全部线程后扇出任务永远排不上，只能等到预算耗尽。
+    """
+    global _stage_executor
+    if _stage_executor is None:
+        _stage_executor = ThreadPoolExecutor(max_workers=max(settings.search_concurrency * 8, 32),
+                                             thread_name_prefix="agent-stage")
+    return _stage_executor
+
+
+def _started(submitted: float, cancel: threading.Event | None, due: float | None,
+             fn: Callable[..., Any], *args, **kwargs) -> Any:
+    note_pool_wait(time.perf_counter() - submitted)
+    if cancel is not None:
+        _cancel.set((*_cancel.get(), cancel))
+    if due is not None:
+        outer = _due.get()
+        _due.set(due if outer is None else min(due, outer))
+    return fn(*args, **kwargs)
+
+
+def submit(fn: Callable[..., Any], *args, pool: Any = None, cancel: threading.Event | None = None,
+           due: float | None = None, **kwargs) -> Future:
+    """
+    提交到共享线程池，并携带调用方的 contextvars（调度类别与会话随任务进入工作线程）。
+    任务在线程池中排队的时间计入其第一次在调度器排队的等待时间，等待指标从提交时算起。
+    cancel / due 为任务的取消信号与截止时刻，任务内的叶子调用经 check_cancelled / call_timeout 读取。
+    """
+    return (pool or executor()).submit(contextvars.copy_context().run, _started, time.perf_counter(), cancel, due,
+                                       fn, *args, **kwargs)
+
+
+def run_with_deadline(fn: Callable[..., Any], deadline: Deadline, *args,
+                      min_timeout: float = 0.0, **kwargs) -> Any:
+    """
+    在阶段线程池中执行 fn，最多等待 max(剩余时间, min_timeout) 秒，超时抛出 DeadlineExceeded。
+    fn 内的外部调用超时被收窄到这一等待时限；超时或等待被中断（Ctrl-C）时向 fn 发出取消信号，尚未发出的调用不再发出。
+    """
+    if deadline.budget_s is None:
+        return fn(*args, **kwargs)
+    limit = max(deadline.remaining(), min_timeout)
+    cancel = threading.Event()
+    fut = submit(fn, *args, pool=stage_executor(), cancel=cancel, due=time.monotonic() + max(limit, 0.0), **kwargs)
+    try:
+        done, _ = wait([fut], timeout=max(limit, 0.0))
+    except BaseException:
+        # Ctrl-C 等中断：阶段任务同样被放弃，不能继续在后台发出调用
+        fut.cancel()
+        cancel.set()
+        raise
+    if not done:
+        fut.cancel()
+        cancel.set()
+        raise DeadlineExceeded(f"{getattr(fn, '__name__', 'call')} 超过时间预算")
+    return fut.result()
+
+
+def map_with_deadline(fn: Callable[[Any], Any], items: Sequence[Any], deadline: Deadline,
+                      max_workers: int | None = None) -> Tuple[Dict[int, Any], List[int], bool]:
+    """
+    以有限并发对 items 逐个执行 fn，直到全部完成或 deadline 到期。
+    返回 ({下标: 结果或异常}, 未完成的下标列表, 是否被 Ctrl-C 中断)；
+    到期或中断时尚未开始的任务被取消，已到达的结果全部保留。正在执行的任务被放弃并收到取消信号：
+    还没发出的外部调用不再发出，读取中的 MCP 响应停止读取并关闭连接；已发出的 LLM 调用无法中途取消，
+    但其超时已被 call_timeout 收窄到 deadline 的剩余时间，线程不会比 deadline 多占用太久。
+    """
+    limit = max_workers or settings.search_concurrency
+    pending_items = list(enumerate(items))
+    running: Dict[Future, int] = {}
+    results: Dict[int, Any] = {}
+    interrupted = False
+    cancel = threading.Event()
+    try:
+        while pending_items or running:
+            while pending_items and len(running) < limit:
+                idx, item = pending_items.pop(0)
+                running[submit(fn, item, cancel=cancel, due=deadline.due())] = idx
+            timeout = None if deadline.budget_s is None else max(deadline.remaining(), 0.0)
+            done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for fut in done:
+                idx = running.pop(fut)
+                try:
+                    results[idx] = fut.result()
+                except Exception as e:
+                    results[idx] = e
+    except KeyboardInterrupt:
+        interrupted = True
+    finally:
+        for fut in running:
+            fut.cancel()
+        if running:
+            cancel.set()
+    unfinished = sorted(list(running.values()) + [idx for idx, _ in pending_items])
+    return results, unfinished, interrupted
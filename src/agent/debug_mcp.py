@@ -1,6 +1,15 @@
-# 调试脚本：检测 MCP 配置加载情况
+# 调试脚本：检测 MCP 配置加载情况，并对各 MCP 服务器做延迟/吞吐探测
+# 用法：python -m src.agent.debug_mcp                      # 打印配置与已注册工具
+#       python -m src.agent.debug_mcp --probe [--calls 20] [--concurrency 4] [--server NAME]
+#                                     [--ramp 1,2,4,8] [--stand-in [--stand-in-rps 20]] [--json]
+#   --probe 对 mcp.json 中每个服务器发起 N 次调用（每次新建连接），分别统计 TCP 建连 / TLS 握手 /
+#   首字节 / 总耗时的分位数、请求与响应大小、错误类别；--ramp 逐级提高并发，找出限流或退化前的可持续 QPS。
+#   --stand-in 把所有服务器指向本地替身 HTTP 服务器（src.bench.fakes.StandInMCPServer），离线可用。
 from pathlib import Path
-import json, yaml, sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlencode, urlsplit
+import argparse, http.client, json, socket, ssl, time, yaml, sys
 from src.config.settings import settings
 from src.agent.tools import MCPToolClient
 
@@ -47,8 +56,259 @@ def debug_mcp_client():
     for k, v in list(tools.items())[:10]:
         print(" -", k, "->", v)
 
+
+# ---------------- 探测 ----------------
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return round(ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo), 4)
+
+
+def _summary(values: List[float]) -> Dict[str, Optional[float]]:
+    return {"p50": _percentile(values, 0.5), "p90": _percentile(values, 0.9),
+            "p99": _percentile(values, 0.99), "max": round(max(values), 4) if values else None}
+
+
+def build_request(client: MCPToolClient, name: str, query: str):
+    """按 MCPToolClient._call 的规则构造请求，返回 (method, endpoint, headers, body)。"""
+    tool, endpoint = client._resolve(name)
+    method = (tool.get("method") or "POST").upper()
+    headers = {**client._headers(tool), "Accept": "application/json, text/event-stream"}
+    params_template = tool.get("params")
+    if params_template and isinstance(params_template, dict):
+        payload = {k: (v.replace("{{query}}", query) if isinstance(v, str) else v) for k, v in params_template.items()}
+        if method == "GET":
+            sep = "&" if "?" in endpoint else "?"
+            return method, f"{endpoint}{sep}{urlencode(payload)}", headers, b""
+    else:
+        payload = {"query": query}
+        if tool.get("server_key"):
+            payload["server"] = tool.get("server_key")
+    headers["Content-Type"] = "application/json"
+    return method, endpoint, headers, json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
+def _classify(exc: BaseException, stage: str) -> str:
+    if isinstance(exc, socket.gaierror):
+        return "dns"
+    if isinstance(exc, (socket.timeout, TimeoutError)):
+        return f"{stage}_timeout"
+    if isinstance(exc, ConnectionRefusedError):
+        return "connect_refused"
+    if isinstance(exc, ssl.SSLError):
+        return "tls"
+    if isinstance(exc, (ConnectionResetError, http.client.RemoteDisconnected)):
+        return "connection_reset"
+    return f"{stage}_error"
+
+
+def probe_once(method: str, url: str, headers: Dict[str, str], body: bytes, timeout: float = 30) -> Dict[str, Any]:
+    """
+    新建连接发起一次请求，分阶段计时（秒）：connect（TCP）、tls（握手）、ttfb（请求发出到响应头）、total。
+    不经过 requests 连接池，因此每次都包含完整的建连开销。
+    """
+    parts = urlsplit(url)
+    https = parts.scheme == "https"
+    port = parts.port or (443 if https else 80)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    rec: Dict[str, Any] = {"ok": False, "status": None, "error": None, "request_bytes": len(body),
+                           "response_bytes": 0, "connect": None, "tls": None, "ttfb": None, "total": None}
+    t0 = time.perf_counter()
+    stage = "connect"
+    sock = None
+    try:
+        sock = socket.create_connection((parts.hostname, port), timeout=timeout)
+        t1 = time.perf_counter()
+        rec["connect"] = t1 - t0
+        if https:
+            stage = "tls"
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=parts.hostname)
+            rec["tls"] = time.perf_counter() - t1
+        stage = "read"
+        conn = http.client.HTTPConnection(parts.hostname, port, timeout=timeout)
+        conn.sock = sock
+        t2 = time.perf_counter()
+        conn.request(method, path, body=body or None, headers=headers)
+        resp = conn.getresponse()
+        rec["ttfb"] = time.perf_counter() - t2
+        data = resp.read()
+        rec["total"] = time.perf_counter() - t0
+        rec["status"] = resp.status
+        rec["response_bytes"] = len(data)
+        if resp.status == 429:
+            rec["error"] = "http_429"
+        elif resp.status >= 500:
+            rec["error"] = "http_5xx"
+        elif resp.status >= 400:
+            rec["error"] = "http_4xx"
+        else:
+            ctype = resp.getheader("Content-Type") or ""
+            if "event-stream" not in ctype:
+                try:
+                    json.loads(data or b"null")
+                except ValueError:
+                    rec["error"] = "parse"
+            rec["ok"] = rec["error"] is None
+        conn.close()
+    except Exception as e:
+        rec["error"] = _classify(e, stage)
+        rec["detail"] = str(e)[:200]
+        rec["total"] = time.perf_counter() - t0
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+    return rec
+
+
+def run_batch(client: MCPToolClient, name: str, calls: int, concurrency: int,
+              query: str = "MCP 探测", timeout: float = 30) -> Dict[str, Any]:
+    """以给定并发对一个服务器发起 calls 次探测，返回分阶段延迟分位数、负载大小、错误类别与实际 QPS。"""
+    method, url, headers, body = build_request(client, name, query)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        records = list(pool.map(lambda _: probe_once(method, url, headers, body, timeout), range(calls)))
+    wall = time.perf_counter() - t0
+    ok = [r for r in records if r["ok"]]
+    errors: Dict[str, int] = {}
+    for r in records:
+        if r["error"]:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+    sizes = [r["response_bytes"] for r in ok]
+    return {
+        "server": name,
+        "url": url,
+        "calls": calls,
+        "concurrency": concurrency,
+        "ok": len(ok),
+        "error_rate": round(1 - len(ok) / calls, 4) if calls else 0.0,
+        "errors": errors,
+        "rps": round(len(ok) / wall, 2) if wall > 0 else 0.0,
+        "wall_seconds": round(wall, 3),
+        "latency": {stage: _summary([r[stage] for r in ok if r[stage] is not None])
+                    for stage in ("connect", "tls", "ttfb", "total")},
+        "request_bytes": len(body),
+        "response_bytes": {"mean": round(sum(sizes) / len(sizes)) if sizes else None,
+                           "max": max(sizes) if sizes else None},
+        "sample_errors": list(dict.fromkeys(r.get("detail") or r["error"] for r in records if r["error"]))[:3],
+    }
+
+
+def find_sustainable_rps(client: MCPToolClient, name: str, levels: List[int], calls: int,
+                         max_error_rate: float = 0.05, max_slowdown: float = 2.0,
+                         timeout: float = 30) -> Dict[str, Any]:
+    """
+    逐级提高并发，每级发起 max(calls, 并发*2) 次调用。出现 429、错误率超过阈值或 p90 总耗时
+    超过首级的 max_slowdown 倍即视为限流/退化并停止；可持续 QPS 取此前各级的最大值。
+    """
+    steps: List[Dict[str, Any]] = []
+    sustainable, stop_reason, baseline = 0.0, None, None
+    for level in levels:
+        step = run_batch(client, name, max(calls, level * 2), level, timeout=timeout)
+        steps.append(step)
+        p90 = step["latency"]["total"]["p90"]
+        if step["errors"].get("http_429"):
+            stop_reason = f"并发 {level} 时被限流（429 × {step['errors']['http_429']}）"
+        elif step["error_rate"] > max_error_rate:
+            stop_reason = f"并发 {level} 时错误率 {step['error_rate']:.0%}"
+        elif baseline and p90 and p90 > baseline * max_slowdown:
+            stop_reason = f"并发 {level} 时 p90 {p90:.3f}s 超过基线 {baseline:.3f}s 的 {max_slowdown} 倍"
+        if stop_reason:
+            break
+        baseline = baseline or p90
+        sustainable = max(sustainable, step["rps"])
+    return {"server": name, "sustainable_rps": sustainable, "stop_reason": stop_reason,
+            "steps": [{k: s[k] for k in ("concurrency", "calls", "ok", "rps", "error_rate", "errors")}
+                      | {"p90_total": s["latency"]["total"]["p90"]} for s in steps]}
+
+
+def _fmt(summary: Dict[str, Optional[float]]) -> str:
+    if summary["p50"] is None:
+        return "-"
+    return f"{summary['p50'] * 1000:.0f}/{summary['p90'] * 1000:.0f}/{summary['p99'] * 1000:.0f}ms"
+
+
+def print_probe(result: Dict[str, Any]):
+    print(f"\n🔌 {result['server']}  {result['url']}")
+    print(f"   调用 {result['calls']} 次（并发 {result['concurrency']}），成功 {result['ok']}，"
+          f"{result['rps']} QPS，耗时 {result['wall_seconds']}s")
+    lat = result["latency"]
+    print(f"   延迟 p50/p90/p99: 建连 {_fmt(lat['connect'])}  TLS {_fmt(lat['tls'])}  "
+          f"首字节 {_fmt(lat['ttfb'])}  总计 {_fmt(lat['total'])}")
+    print(f"   负载: 请求 {result['request_bytes']} B，响应均值 {result['response_bytes']['mean']} B"
+          f"（最大 {result['response_bytes']['max']} B）")
+    if result["errors"]:
+        print(f"   ⚠️  错误: {', '.join(f'{k} × {v}' for k, v in sorted(result['errors'].items()))}")
+        for detail in result["sample_errors"]:
+            print(f"      - {detail}")
+
+
+def print_ramp(ramp: Dict[str, Any]):
+    print(f"\n📈 {ramp['server']} 并发爬坡:")
+    for s in ramp["steps"]:
+        p90 = f"{s['p90_total'] * 1000:.0f}ms" if s["p90_total"] is not None else "-"
+        print(f"   并发 {s['concurrency']:>3}: {s['rps']:>7} QPS  p90 {p90}  错误率 {s['error_rate']:.0%}")
+    print(f"   ✅ 可持续 QPS ≈ {ramp['sustainable_rps']}"
+          + (f"（{ramp['stop_reason']}）" if ramp["stop_reason"] else "（未触发限流）"))
+
+
+def probe(calls: int = 20, concurrency: int = 4, server: Optional[str] = None, ramp: Optional[List[int]] = None,
+          stand_in: bool = False, stand_in_rps: float = 0.0, timeout: float = 30, as_json: bool = False) -> Dict[str, Any]:
+    client = MCPToolClient(settings.mcp_config_path)
+    names = [server] if server else client.list_tools()
+    standin = None
+    if stand_in:
+        from src.bench.fakes import StandInMCPServer
+        standin = StandInMCPServer(rate_limit=stand_in_rps).start()
+        for name in names:
+            client.tools[name] = {**client._resolve(name)[0], "endpoint": standin.url, "params": None}
+    report: Dict[str, Any] = {"stand_in": bool(stand_in), "servers": []}
+    try:
+        for name in names:
+            entry: Dict[str, Any] = {"probe": run_batch(client, name, calls, concurrency, timeout=timeout)}
+            if not as_json:
+                print_probe(entry["probe"])
+            if ramp:
+                entry["ramp"] = find_sustainable_rps(client, name, ramp, calls, timeout=timeout)
+                if not as_json:
+                    print_ramp(entry["ramp"])
+            report["servers"].append(entry)
+    finally:
+        if standin is not None:
+            standin.stop()
+    if as_json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MCP 配置检查与延迟/吞吐探测")
+    parser.add_argument("--probe", action="store_true", help="对各服务器发起探测调用")
+    parser.add_argument("--calls", type=int, default=20, help="每个服务器（每级并发）的调用次数")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--server", help="只探测指定工具名")
+    parser.add_argument("--ramp", help="逐级并发，如 1,2,4,8,16，用于估计限流前的可持续 QPS")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--stand-in", action="store_true", help="使用本地替身服务器（离线）")
+    parser.add_argument("--stand-in-rps", type=float, default=0.0, help="替身服务器的限流 QPS（0 表示不限流）")
+    parser.add_argument("--json", action="store_true", help="输出机器可读 JSON")
+    args = parser.parse_args()
+
+    if not args.probe:
+        print_settings()
+        load_and_print_json(settings.mcp_config_path)
+        debug_mcp_client()
+        return
+    ramp = [int(x) for x in args.ramp.split(",") if x.strip()] if args.ramp else None
+    probe(args.calls, args.concurrency, args.server, ramp, args.stand_in, args.stand_in_rps, args.timeout, args.json)
+
+
 if __name__ == "__main__":
-    print_settings()
-    cfgpath = settings.mcp_config_path
-    load_and_print_json(cfgpath)
-    debug_mcp_client()
\ No newline at end of file
+    main()
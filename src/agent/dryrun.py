@@ -0,0 +1,208 @@
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+import math
+
+from .ledger import ledger, price
+from .prompt import (
+    SYNTHESIS_PROMPT,
+    SYNTHESIS_MAP_PROMPT,
+    SYNTHESIS_REDUCE_PROMPT,
+    RESEARCH_SKELETON_PROMPT,
+    RESEARCH_SECTION_PROMPT,
+)
+from .report import SECTION_SPECS
+from .singleflight import normalize_query
+from .tokens import count_tokens, token_mode
+from ..config.settings import settings
+
+
+@dataclass
+class CallEstimate:
+    stage: str
+    label: str
+    model: str
+    input_tokens: int
+    output_tokens: int
+    latency_s: float
+    cost: float
+    basis: str  # "ledger"：按账本中该阶段的历史调用；"default"：无历史记录，按 settings.dry_run_* 假设；"measured"：已实际执行
+
+
+class LatencyModel:
+    """
+    按阶段预测单次调用的输出 token 数与耗时。账本中有该阶段的成功调用时，输出取历史平均（不超过 max_tokens），
+    耗时按历史平均耗时乘以（预测输出 / 历史平均输出）；没有历史时按 settings.dry_run_output_tokens 与生成速度估算。
+    """
+
+    def __init__(self, pricing: Dict[str, Any] | None = None):
+        self.pricing = pricing or {}
+        self._history: Dict[str, Dict[str, Any]] = {}
+        self._book = ledger()
+
+    def history(self, stage: str) -> Dict[str, Any]:
+        if stage not in self._history:
+            stats: Dict[str, Any] = {"calls": 0}
+            if self._book is not None:
+                try:
+                    stats = self._book.latency_stats(stage)
+                except Exception as e:
+                    print(f"⚠️  读取历史耗时失败: {e}")
+            self._history[stage] = stats
+        return self._history[stage]
+
+    def call(self, stage: str, label: str, model: str, input_tokens: int, max_tokens: int | None) -> CallEstimate:
+        h = self.history(stage)
+        cap = max_tokens or math.inf
+        if h.get("calls") and h.get("avg_output_tokens"):
+            output = int(min(h["avg_output_tokens"], cap))
+            latency = h["avg_latency_s"] * output / h["avg_output_tokens"]
+            basis = "ledger"
+        else:
+            output = int(min(settings.dry_run_output_tokens, cap))
+            latency = output / settings.dry_run_decode_tokens_per_s
+            basis = "default"
+        return CallEstimate(stage, label, model, input_tokens, output, round(latency, 2),
+                            round(price(self.pricing, model, input_tokens, output), 6), basis)
+
+
+class DryRunEstimator:
+    """
+    预估一轮研究（及可选的技术方案生成）的 token、MCP 调用次数、费用与耗时，不发出综合 / 生成调用。
+    已复用的子问题按真实片段计算提示词大小；需要新搜索的子问题按本会话已有结果的平均条数与单条 token 数估算，
+    没有已有结果时使用 settings.dry_run_results_per_subq / dry_run_result_tokens。
+    agent 为 ResearchAgent，提供 system_message、片段格式化、路由与价格配置。
+    """
+
+    def __init__(self, agent: Any):
+        self.agent = agent
+        self.mode = token_mode("dry_run")
+        self.latency = LatencyModel(agent.pricing)
+        self.system_tokens = self._count(agent.system_message.content)
+
+    def _count(self, text: str) -> int:
+        return count_tokens(text, self.mode)
+
+    def _model(self, stage: str | None) -> str:
+        router = self.agent.router
+        if self.agent.budget_level and router.budget_model:
+            return router.budget_model
+        cfg = router.stage(stage)
+        return cfg.model if cfg is not None else router.default_model
+
+    def _max_tokens(self, stage: str | None, max_tokens: int | None) -> int | None:
+        cfg = self.agent.router.stage(stage)
+        caps = [v for v in (max_tokens, cfg.max_tokens if cfg else None) if v]
+        return min(caps) if caps else None
+
+    def _call(self, stage: str | None, label: str, input_tokens: int, max_tokens: int | None = None) -> CallEstimate:
+        # 未指定阶段的调用（如技术方案生成）在账本中记为 default
+        return self.latency.call(stage or "default", label, self._model(stage), input_tokens + self.system_tokens,
+                                 self._max_tokens(stage, max_tokens))
+
+    def _result_size(self, known: List[Dict[str, Any]], max_results: int | None) -> tuple:
+        """新子问题的预计结果条数与单条结果的 token 数：优先取会话中已有结果的平均值。"""
+        agent = self.agent
+        sample = [b for b in [*known, *agent.last_search_data] if b.get("results")]
+        if sample:
+            lines = agent._snippet_lines(sample[:8])
+            per_result = sum(self._count(line) for line in lines) / max(len(lines), 1)
+            per_block = sum(len(b["results"]) for b in sample) / len(sample)
+        else:
+            per_result, per_block = settings.dry_run_result_tokens, settings.dry_run_results_per_subq
+        if max_results:
+            per_block = min(per_block, max_results)
+        return per_block, per_result
+
+    def estimate(self, query: str, plan: List[Dict[str, Any]], reused: Dict[int, Dict[str, Any]],
+                 pending: List[Dict[str, Any]], max_results: int | None = None, report: bool = False,
+                 plan_spent: Optional[Dict[str, float]] = None, plan_source: str = "llm") -> Dict[str, Any]:
+        """
+        plan 为规划结果，reused 为可复用的（计划下标 -> 已有结果块），pending 为需要新搜索的子问题。
+        plan_spent 为本次实际执行规划的用量（input_tokens / output_tokens / cost / seconds），计入预估总量。
+        """
+        agent = self.agent
+        plan_call = None
+        if plan_spent:
+            plan_call = CallEstimate("plan", "plan", self._model("plan"), int(plan_spent["input_tokens"]),
+                                     int(plan_spent["output_tokens"]), round(plan_spent["seconds"], 2),
+                                     round(plan_spent["cost"], 6), "measured")
+        known = [reused[i] for i in sorted(reused)]
+        per_block, per_result = self._result_size(known, max_results)
+        pending_results = round(per_block * len(pending))
+        pending_tokens = int(pending_results * per_result)
+        known_lines = agent._snippet_lines(known)
+        packed_tokens = self._count("\n".join(known_lines)) + pending_tokens
+        blocks = len(known) + len(pending)
+
+        calls: List[CallEstimate] = [plan_call] if plan_call else []
+        # MCP：规范化后相同的子问题在 singleflight 中合并为一次调用
+        mcp_calls = len({normalize_query(sq.get("subq", "")) for sq in pending})
+        search_s = math.ceil(mcp_calls / max(settings.search_concurrency, 1)) * settings.dry_run_mcp_latency_s
+
+        threshold = settings.synthesis_map_reduce_tokens
+        if threshold and blocks > 1 and packed_tokens > threshold:
+            synthesis_mode = "map_reduce"
+            map_overhead = self._count(SYNTHESIS_MAP_PROMPT.format(query=query, subq="", snippets=""))
+            maps = []
+            for block in known:
+                size = self._count("\n".join(agent._snippet_lines([block])))
+                maps.append(self._call("synthesize", f"map: {block.get('subq', '')}", map_overhead + size,
+                                       settings.synthesis_map_max_tokens))
+            for sq in pending:
+                maps.append(self._call("synthesize", f"map: {sq.get('subq', '')}",
+                                       map_overhead + int(per_block * per_result), settings.synthesis_map_max_tokens))
+            reduce_in = self._count(SYNTHESIS_REDUCE_PROMPT.format(query=query, partials="")) + \
+                sum(m.output_tokens for m in maps)
+            reduce_call = self._call("synthesize", "reduce", reduce_in)
+            calls += maps + [reduce_call]
+            waves = math.ceil(len(maps) / max(settings.search_concurrency, 1))
+            synthesis_s = waves * max((m.latency_s for m in maps), default=0.0) + reduce_call.latency_s
+        else:
+            synthesis_mode = "single"
+            prompt = SYNTHESIS_PROMPT.format(query=query, snippets="\n".join(known_lines) or "(无搜索数据)")
+            call = self._call("synthesize", "synthesis", self._count(prompt) + pending_tokens)
+            calls.append(call)
+            synthesis_s = call.latency_s
+
+        report_s = 0.0
+        research_data_tokens = None
+        if report:
+            research_data_tokens = self._count(agent.build_research_data(known)) + pending_tokens
+            skeleton = self._call(None, "report: skeleton", research_data_tokens + self._count(
+                RESEARCH_SKELETON_PROMPT.format(requirement=query, research_data="", previous_plan="(无)",
+                                                instruction="(无)")), settings.report_skeleton_max_tokens)
+            sections = [
+                self._call(None, f"report: {key}", research_data_tokens + skeleton.output_tokens + self._count(
+                    RESEARCH_SECTION_PROMPT.format(requirement=query, skeleton="", research_data="",
+                                                   instruction="(无)", section_key=key, section_spec=spec[1])),
+                    settings.report_section_max_tokens)
+                for key, spec in SECTION_SPECS.items()
+            ]
+            calls += [skeleton, *sections]
+            waves = math.ceil(len(sections) / max(settings.report_workers, 1))
+            report_s = skeleton.latency_s + waves * max((s.latency_s for s in sections), default=0.0)
+
+        plan_s = plan_call.latency_s if plan_call else 0.0
+        wall_s = plan_s + search_s + synthesis_s + report_s
+        return {
+            "query": query,
+            "plan": plan,
+            "plan_source": plan_source,
+            "subquestions": len(plan),
+            "cache_hits": [plan[i].get("subq") for i in sorted(reused)],
+            "to_search": [sq.get("subq") for sq in pending],
+            "mcp_calls": mcp_calls,
+            "expected_results": pending_results + sum(len(b.get("results", [])) for b in known),
+            "packed_snippet_tokens": packed_tokens,
+            "synthesis_mode": synthesis_mode,
+            "research_data_tokens": research_data_tokens,
+            "llm_calls": len(calls),
+            "input_tokens": sum(c.input_tokens for c in calls),
+            "output_tokens": sum(c.output_tokens for c in calls),
+            "cost": round(sum(c.cost for c in calls), 6),
+            "seconds": {"plan": round(plan_s, 2), "search": round(search_s, 2), "synthesis": round(synthesis_s, 2),
+                        "report": round(report_s, 2), "total": round(wall_s, 2)},
+            "over_turn_budget": bool(settings.turn_budget_s and plan_s + search_s + synthesis_s > settings.turn_budget_s),
+            "history_basis": {c.stage: c.basis for c in calls},
+            "calls": [asdict(c) for c in calls],
+        }
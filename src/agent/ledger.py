@@ -0,0 +1,185 @@
+# token 用量账本：逐次记录 LLM 调用的输入/输出 token、耗时与费用（本地 SQLite），按会话 / 用户 / 天汇总
+# 用法：python -m src.main --usage [--session ID] [--user ID] [--days 7] [--json]
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import argparse
+import json
+import sqlite3
+import threading
+import time
+
+from ..config.settings import settings
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS calls (
+    ts REAL NOT NULL,
+    day TEXT NOT NULL,
+    session TEXT NOT NULL,
+    user TEXT,
+    stage TEXT,
+    model TEXT,
+    input_tokens INTEGER NOT NULL,
+    output_tokens INTEGER NOT NULL,
+    latency_s REAL NOT NULL,
+    ok INTEGER NOT NULL,
+    estimated INTEGER NOT NULL DEFAULT 0,
+    cost REAL NOT NULL DEFAULT 0,
+    shared INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS calls_session ON calls (session);
+CREATE INDEX IF NOT EXISTS calls_user_day ON calls (user, day);
+"""
+
+_TOTALS = ("COUNT(*) AS calls, COALESCE(SUM(input_tokens), 0) AS input_tokens, "
+           "COALESCE(SUM(output_tokens), 0) AS output_tokens, COALESCE(SUM(cost), 0) AS cost, "
+           "COALESCE(SUM(latency_s), 0) AS latency_s, COALESCE(SUM(1 - ok), 0) AS errors")
+
+
+def _row(cur: sqlite3.Cursor, row: tuple) -> Dict[str, Any]:
+    d = {c[0]: v for c, v in zip(cur.description, row)}
+    if "input_tokens" in d:
+        d["total_tokens"] = d["input_tokens"] + d["output_tokens"]
+    if "cost" in d:
+        d["cost"] = round(d["cost"], 6)
+    if "latency_s" in d:
+        d["latency_s"] = round(d["latency_s"], 3)
+    return d
+
+
+def price(pricing: Dict[str, Any], model: str, input_tokens: int, output_tokens: int) -> float:
+    """pricing 形如 {模型名: {"input": 每百万输入 token 价格, "output": 每百万输出 token 价格}}；未配置的模型记为 0。"""
+    p = (pricing or {}).get(model) or {}
+    return (input_tokens * float(p.get("input", 0)) + output_tokens * float(p.get("output", 0))) / 1_000_000
+
+
+class UsageLedger:
+    """进程内共享的 SQLite 账本；写入按调用逐条提交，查询均为聚合。"""
+
+    def __init__(self, path: str | Path | None = None):
+        self.path = Path(path) if path else settings.resolve_ledger_path()
+        if str(self.path) != ":memory:":
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        columns = {r[1] for r in self._db.execute("PRAGMA table_info(calls)")}
+        if "shared" not in columns:
+            # 旧版本账本：补上 shared 列
+            self._db.execute("ALTER TABLE calls ADD COLUMN shared INTEGER NOT NULL DEFAULT 0")
+            self._db.commit()
+
+    def record(self, session: str, user: str | None, stage: str | None, model: str,
+               input_tokens: int, output_tokens: int, latency_s: float, ok: bool = True,
+               estimated: bool = False, cost: float = 0.0, shared: bool = False):
+        """shared 表示该会话合并到了其他会话发起的同一调用：用量照常计入本会话，但不参与耗时统计。"""
+        ts = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO calls (ts, day, session, user, stage, model, input_tokens, output_tokens, latency_s, "
+                "ok, estimated, cost, shared) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (ts, time.strftime("%Y-%m-%d", time.localtime(ts)), session, user, stage or "default", model,
+                 int(input_tokens), int(output_tokens), float(latency_s), int(ok), int(estimated), float(cost),
+                 int(shared)),
+            )
+            self._db.commit()
+
+    def _query(self, sql: str, args: tuple = ()) -> List[Dict[str, Any]]:
+        with self._lock:
+            cur = self._db.execute(sql, args)
+            return [_row(cur, r) for r in cur.fetchall()]
+
+    @staticmethod
+    def _where(session: str | None = None, user: str | None = None, day: str | None = None,
+               since_day: str | None = None) -> tuple:
+        clauses, args = [], []
+        for col, op, val in (("session", "=", session), ("user", "=", user), ("day", "=", day), ("day", ">=", since_day)):
+            if val is not None:
+                clauses.append(f"{col} {op} ?")
+                args.append(val)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", tuple(args)
+
+    def totals(self, session: str | None = None, user: str | None = None, day: str | None = None) -> Dict[str, Any]:
+        where, args = self._where(session, user, day)
+        return self._query(f"SELECT {_TOTALS} FROM calls{where}", args)[0]
+
+    def by(self, column: str, session: str | None = None, user: str | None = None,
+           since_day: str | None = None) -> List[Dict[str, Any]]:
+        """按 session / user / day / stage / model 分组汇总。"""
+        if column not in ("session", "user", "day", "stage", "model"):
+            raise ValueError(f"不支持的分组列: {column}")
+        where, args = self._where(session, user, since_day=since_day)
+        return self._query(f"SELECT {column}, {_TOTALS} FROM calls{where} GROUP BY {column} ORDER BY {column}", args)
+
+    def latency_stats(self, stage: str | None = None) -> Dict[str, Any]:
+        """成功调用的平均耗时与平均 token 数（按阶段），供耗时与成本预估使用。"""
+        # 合并调用的跟随方记录的是等待时间而不是调用耗时，不参与统计
+        where, args = " WHERE ok = 1 AND shared = 0", ()
+        if stage:
+            where, args = where + " AND stage = ?", (stage,)
+        return self._query("SELECT COUNT(*) AS calls, AVG(latency_s) AS avg_latency_s, "
+                           "AVG(input_tokens) AS avg_input_tokens, AVG(output_tokens) AS avg_output_tokens "
+                           f"FROM calls{where}", args)[0]
+
+
+def budget_level(book: UsageLedger, session: str, user: str | None = None, day: str | None = None) -> int:
+    """
+    按账本中的累计用量计算预算等级：0 正常 / 1 降级（达到 budget_downgrade_ratio）/ 2 拒绝（达到 100%）。
+    会话预算看该会话的全部用量，用户预算只看 day（默认今天）当天的用量；取两者中较高的比例。
+    """
+    ratios = []
+    if settings.budget_session_tokens:
+        ratios.append(book.totals(session=session)["total_tokens"] / settings.budget_session_tokens)
+    if settings.budget_user_daily_tokens and user:
+        day = day or time.strftime("%Y-%m-%d")
+        ratios.append(book.totals(user=user, day=day)["total_tokens"] / settings.budget_user_daily_tokens)
+    used = max(ratios, default=0.0)
+    return 2 if used >= 1 else 1 if used >= settings.budget_downgrade_ratio else 0
+
+
+_ledger: UsageLedger | None = None
+_ledger_lock = threading.Lock()
+
+
+def ledger() -> Optional[UsageLedger]:
+    """进程级共享账本；settings.ledger_enabled 为 False 或数据库不可用时返回 None。"""
+    global _ledger
+    if not settings.ledger_enabled:
+        return None
+    with _ledger_lock:
+        if _ledger is None:
+            try:
+                _ledger = UsageLedger()
+            except (sqlite3.Error, OSError) as e:
+                print(f"⚠️  用量账本不可用: {e}")
+                settings.ledger_enabled = False
+                return None
+        return _ledger
+
+
+def main(argv: List[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m src.main --usage", description="token 用量账本汇总")
+    parser.add_argument("--session")
+    parser.add_argument("--user")
+    parser.add_argument("--days", type=int, default=7, help="按天汇总的天数")
+    parser.add_argument("--json", action="store_true", help="输出机器可读 JSON")
+    args = parser.parse_args(argv)
+
+    book = UsageLedger()
+    since = time.strftime("%Y-%m-%d", time.localtime(time.time() - (args.days - 1) * 86400))
+    report = {
+        "totals": book.totals(args.session, args.user),
+        "by_day": book.by("day", args.session, args.user, since_day=since),
+        "by_stage": book.by("stage", args.session, args.user),
+        "by_session": book.by("session", args.session, args.user, since_day=since),
+    }
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    t = report["totals"]
+    print(f"🧾 共 {t['calls']} 次调用，输入 {t['input_tokens']} / 输出 {t['output_tokens']} tokens，"
+          f"费用 {t['cost']:.4f}，失败 {t['errors']} 次")
+    for title, key, col in (("按天", "by_day", "day"), ("按阶段", "by_stage", "stage"), ("按会话", "by_session", "session")):
+        print(f"\n📊 {title}:")
+        for r in report[key]:
+            print(f"   {r[col] or '-':<24} {r['calls']:>5} 次  {r['total_tokens']:>9} tokens  费用 {r['cost']:.4f}")
+
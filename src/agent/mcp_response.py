@@ -0,0 +1,263 @@
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+import codecs
+import json
+
+# 字典形式的返回中，按此顺序查找结果列表
+RESULT_KEYS: Tuple[str, ...] = ("results", "data", "items")
+_WS = " \t\r\n"
+_JSON_START = set('[{"-0123456789tfn')
+# 提前停止时，剩余正文不超过该字节数则读完，让连接回到连接池；否则直接关闭连接
+_DRAIN_BYTES = 64 * 1024
+
+
+class _Reader:
+    """按块读取响应正文并增量解码为文本，累计读取的字节数不超过 max_bytes；cancel() 为真时停止读取并关闭连接。"""
+
+    def __init__(self, resp: Any, max_bytes: int, chunk_size: int = 16 * 1024,
+                 cancel: Callable[[], bool] | None = None):
+        self.resp = resp
+        self.max_bytes = max_bytes
+        self.cancel = cancel
+        self.bytes_read = 0
+        self.buf = ""
+        self.pos = 0
+        self.exhausted = False  # 正文已读完
+        self.capped = False     # 因达到字节上限而停止读取
+        self.cancelled = False  # 调用方已放弃，停止读取
+        try:
+            self._decoder = codecs.getincrementaldecoder(resp.encoding or "utf-8")(errors="replace")
+        except LookupError:
+            self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._chunks: Iterator[bytes] = resp.iter_content(chunk_size=chunk_size)
+
+    @property
+    def done(self) -> bool:
+        return self.exhausted or self.capped or self.cancelled
+
+    def fill(self) -> bool:
+        """再读一块；没有更多数据（读完、达到上限或已取消）时返回 False。"""
+        if self.done:
+            return False
+        if self.cancel is not None and self.cancel():
+            self.cancelled = True
+            self.resp.close()
+            return False
+        for chunk in self._chunks:
+            if not chunk:
+                continue
+            if self.max_bytes and self.bytes_read + len(chunk) >= self.max_bytes:
+                chunk = chunk[:self.max_bytes - self.bytes_read]
+                self.capped = True
+            self.bytes_read += len(chunk)
+            self.buf += self._decoder.decode(chunk, final=self.capped)
+            return True
+        self.exhausted = True
+        self.buf += self._decoder.decode(b"", final=True)
+        return False
+
+    def skip_ws(self) -> bool:
+        """跳过空白；缓冲区内没有更多非空白字符且无法继续读取时返回 False。"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WS:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return True
+            if not self.fill():
+                return False
+
+    def peek(self) -> str:
+        return self.buf[self.pos] if self.skip_ws() else ""
+
+    def decode(self, decoder: json.JSONDecoder) -> Any:
+        """从当前位置解码一个完整的 JSON 值；数据不完整时继续读取，读不到更多数据仍失败则抛出 ValueError。"""
+        self.skip_ws()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                # 至少读入与待解析部分等量的新数据再重试，超大的单个元素不会被反复从头解析
+                pending = len(self.buf) - self.pos
+                if not self.fill():
+                    raise
+                while len(self.buf) - self.pos < 2 * pending and self.fill():
+                    pass
+                continue
+            if end == len(self.buf) and isinstance(value, (int, float)) and self.fill():
+                # 数字恰好位于缓冲区末尾，可能还没读全
+                continue
+            self.pos = end
+            return value
+
+    def compact(self):
+        if self.pos > 256 * 1024:
+            # 已解析的部分不再需要，避免缓冲区随正文增长
+            self.buf, self.pos = self.buf[self.pos:], 0
+
+    def finish(self):
+        if self.exhausted or self.cancelled:
+            return
+        drained = 0
+        for chunk in self._chunks:
+            drained += len(chunk)
+            if drained > _DRAIN_BYTES:
+                break
+        else:
+            self.exhausted = True
+            return
+        self.resp.close()
+
+
+def _truncate(item: Any, snippet_chars: int) -> Any:
+    if not snippet_chars:
+        return item
+    if isinstance(item, str):
+        return item[:snippet_chars]
+    if isinstance(item, dict):
+        for key in ("snippet", "content", "text"):
+            value = item.get(key)
+            if isinstance(value, str) and len(value) > snippet_chars:
+                item[key] = value[:snippet_chars] + "…"
+    return item
+
+
+def _array(reader: _Reader, decoder: json.JSONDecoder, max_results: int, snippet_chars: int,
+           stats: Dict[str, Any]) -> List[Any]:
+    """读取到 '[' 之后逐个解码数组元素；数组结束、取满 max_results 或数据读尽时停止。"""
+    items: List[Any] = []
+    while not max_results or len(items) < max_results:
+        ch = reader.peek()
+        if ch == ",":
+            reader.pos += 1
+            continue
+        if ch in ("]", ""):
+            # 数组没有闭合说明正文不完整
+            stats["partial"] = stats["partial"] or ch == ""
+            return items
+        try:
+            items.append(_truncate(reader.decode(decoder), snippet_chars))
+            reader.compact()
+        except ValueError:
+            if not items and not reader.capped:
+                raise
+            # 正文在元素中途被截断（达到字节上限）或格式损坏：保留已解析的元素
+            stats["partial"] = True
+            return items
+    stats["early_stop"] = True
+    return items
+
+
+def _skip_array(reader: _Reader, decoder: json.JSONDecoder) -> bool:
+    """跳过数组剩余的元素并越过 ']'；正文在数组结束前读尽时返回 False。"""
+    while True:
+        ch = reader.peek()
+        if ch == ",":
+            reader.pos += 1
+            continue
+        if ch == "]":
+            reader.pos += 1
+            return True
+        if ch == "":
+            return False
+        reader.decode(decoder)
+        reader.compact()
+
+
+def _member(reader: _Reader, decoder: json.JSONDecoder, max_results: int, snippet_chars: int,
+            stats: Dict[str, Any], data: Dict[str, Any], found: Dict[str, List[Any]]) -> bool:
+    """读取对象的下一个成员，结果列表存入 found、其余存入 data；对象结束（或正文读尽）时返回 False。"""
+    ch = reader.peek()
+    if ch == ",":
+        reader.pos += 1
+        return True
+    if ch == "}" or (ch == "" and found):
+        return False
+    key = reader.decode(decoder)
+    if reader.peek() != ":" or not isinstance(key, str):
+        raise ValueError("无效的 JSON 对象")
+    reader.pos += 1
+    if key in RESULT_KEYS and key not in found and reader.peek() == "[":
+        reader.pos += 1
+        found[key] = _array(reader, decoder, max_results, snippet_chars, stats)
+        if key == RESULT_KEYS[0]:
+            # 优先级最高的键：不再需要对象的其余部分
+            return True
+        if not _skip_array(reader, decoder):
+            return False
+        # 该数组已完整读过，不算提前停止
+        stats["early_stop"] = False
+        return True
+    data[key] = reader.decode(decoder)
+    return True
+
+
+def read_results(resp: Any, endpoint: str, max_bytes: int = 0, max_results: int = 0,
+                 snippet_chars: int = 0, cancel: Callable[[], bool] | None = None
+                 ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    流式解析 MCP 响应：按块读取正文（最多 max_bytes 字节，0 表示不限），增量解析 JSON，
+    遇到结果列表（顶层数组，或字典中的 results / data / items）后逐条解码，取满 max_results 条即停止读取，
+    每条结果的 snippet / content / text 在解析时截断到 snippet_chars 个字符。
+    字典中的列表按 RESULT_KEYS 的优先级选取，与整体解析时一致：results 一出现即提前停止；
+    先出现的 data / items 只暂存前 max_results 条，继续读完该对象以确认后面没有 results。
+    其余返回形式也与整体解析时一致：字典包装为单条结果，非 JSON 响应取前 500 个字符。
+    cancel 在每读一块之前调用，返回真时关闭连接并按已读到的部分返回（统计中 cancelled 为 True）。
+    返回 (结果列表, 统计)，统计包含读取字节数、是否达到字节上限、是否提前停止。
+    """
+    reader = _Reader(resp, max_bytes, cancel=cancel)
+    decoder = json.JSONDecoder()
+    stats: Dict[str, Any] = {"bytes": 0, "capped": False, "early_stop": False, "partial": False}
+    try:
+        results = _parse(reader, decoder, endpoint, max_results, snippet_chars, stats)
+    finally:
+        reader.finish()
+        stats["bytes"] = reader.bytes_read
+        stats["capped"] = reader.capped
+        stats["cancelled"] = reader.cancelled
+    return results, stats
+
+
+def _parse(reader: _Reader, decoder: json.JSONDecoder, endpoint: str, max_results: int, snippet_chars: int,
+           stats: Dict[str, Any]) -> List[Dict[str, Any]]:
+    first = reader.peek()
+    start = reader.pos
+    try:
+        if first not in _JSON_START:
+            # 明显不是 JSON（如 HTML 错误页），不必继续读取
+            raise ValueError("非 JSON 响应")
+        if first == "[":
+            reader.pos += 1
+            return _array(reader, decoder, max_results, snippet_chars, stats)
+        if first == "{":
+            reader.pos += 1
+            data: Dict[str, Any] = {}
+            # 已读到的低优先级列表（data / items）：键 -> 前 max_results 条
+            found: Dict[str, List[Any]] = {}
+            while True:
+                try:
+                    if not _member(reader, decoder, max_results, snippet_chars, stats, data, found):
+                        break
+                except ValueError:
+                    if not found:
+                        raise
+                    # 已暂存列表之后的内容损坏或被截断：用已暂存的列表
+                    stats["partial"] = True
+                    break
+                if RESULT_KEYS[0] in found:
+                    return found[RESULT_KEYS[0]]
+            for key in RESULT_KEYS:
+                if key in found:
+                    return found[key]
+            # 如果字典中没有列表，返回包装后的结果
+            return [_truncate({"title": str(data.get("title", "MCP 响应")),
+                               "snippet": str(data.get("content", data.get("message", str(data)))),
+                               "url": endpoint}, snippet_chars)]
+        # 其他 JSON 类型（字符串、数字等）包装成列表
+        data = reader.decode(decoder)
+        if reader.peek():
+            raise ValueError("JSON 之后还有多余内容")
+        return [_truncate({"title": "MCP 响应", "snippet": str(data), "url": endpoint}, snippet_chars)]
+    except ValueError:
+        # JSON 解析失败：只需要正文开头的 500 个字符
+        while len(reader.buf) - start < 500 and reader.fill():
+            pass
+        return [{"title": "(非 JSON 响应)", "snippet": reader.buf[start:start + 500], "url": endpoint}]
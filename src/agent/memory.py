@@ -1,67 +1,257 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Sequence
+from collections import deque
 from dataclasses import dataclass, field
-import tiktoken
+import itertools
+import sys
+import time
+from . import cassette
 from .prompt import MEMORY_SUMMARIZE_PROMPT
+from .deadline import submit
+from .scheduler import llm_scheduler, scheduling
+from .singleflight import prompt_key
+from .tokens import count_tokens, token_mode
 from ..config.settings import settings
 
-@dataclass
+
 class Message:
-    role: str
-    content: str
+    """
+    紧凑的消息对象：使用 __slots__ 避免每条消息携带 __dict__。
+    role 经过 sys.intern 驻留，成千上万个会话共享同一份 "user"/"assistant" 字符串；
+    content 只保存对原字符串的引用（不复制），tokens 在首次需要精确计数时计算并缓存。
+    同时支持 m["role"] / dict(m) 的映射式访问，便于直接作为 {"role", "content"} 视图使用。
+    """
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(self, role: str, content: str, tokens: int | None = None):
+        self.role = sys.intern(role)
+        self.content = content
+        self.tokens = tokens
+
+    def token_count(self, mode: str | None = None) -> int:
+        if self.tokens is None:
+            if (mode or settings.token_count_mode) == "approx":
+                # 估算值不缓存：tokens 只保存精确计数，供最终的预算检查复用
+                return count_tokens(self.content, "approx")
+            self.tokens = count_tokens(self.content, "exact")
+        return self.tokens
+
+    def keys(self):
+        return ("role", "content")
+
+    def __getitem__(self, key: str) -> str:
+        if key == "role":
+            return self.role
+        if key == "content":
+            return self.content
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __repr__(self) -> str:
+        return f"Message(role={self.role!r}, content={self.content[:30]!r}, tokens={self.tokens})"
+
+
+class MessagesView(Sequence):
+    """
+    as_list() 返回的只读视图：不重建 dict 列表，按需把压缩上下文拼在最前面。
+    每个元素都是 Message（支持 m["role"] / m["content"]）。
+    """
+    __slots__ = ("_memory",)
+
+    def __init__(self, memory: "ConversationMemory"):
+        self._memory = memory
+
+    def _head(self) -> List[Message]:
+        ctx = self._memory.compressed_context
+        if not ctx:
+            return []
+        return [self._memory._context_message()]
+
+    def __len__(self) -> int:
+        return len(self._memory.messages) + (1 if self._memory.compressed_context else 0)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        head = self._head()
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError(index)
+        if index < len(head):
+            return head[index]
+        return self._memory.messages[index - len(head)]
+
+    def __iter__(self) -> Iterator[Message]:
+        yield from self._head()
+        yield from self._memory.messages
+
+
+def _new_buffer() -> deque:
+    # 环形缓冲：超过 memory_max_turns 条消息时自动丢弃最旧的消息，保证单会话内存有上界
+    return deque(maxlen=max(settings.memory_max_turns, settings.memory_keep_last_n + 1))
+
+
+_warned_buffer_cap = False
+
 
 @dataclass
 class ConversationMemory:
-    messages: List[Message] = field(default_factory=list)
+    messages: deque = field(default_factory=_new_buffer)
     compressed_context: str | None = None
+    # 压缩提示词（需含 {history} 占位符）与保留/触发条数；为 None 时使用默认提示词和 settings 中的值
+    summarize_prompt: str | None = None
+    keep_last_n: int | None = None
+    compress_after: int | None = None
     summarizer_llm = None  # 将由外部注入（LangChain LLM）
+    # 摘要函数 prompt -> 响应，由外部注入（ResearchAgent 经 _invoke 路由、排队与记账）；设置后优先于 summarizer_llm
+    summarizer = None
+    archive = None  # 长期记忆归档（MemoryArchive），由外部注入；为 None 时淘汰的消息直接丢弃
+    usage_hook = None  # 压缩调用完成后的回调 (prompt, response, seconds)，由外部注入用于记账
+    # token 计数方式（"exact" / "approx"）；为 None 时使用 settings.token_count_modes["memory"]
+    token_mode: str | None = None
+    _ctx_cache: Message | None = field(default=None, init=False, repr=False)
+    # 最近一次压缩的统计：被压缩的消息数、压缩提示词与摘要的 token 数、耗时
+    last_compression: Dict[str, Any] | None = field(default=None, init=False, repr=False)
+    # 后台压缩：(摘要任务, 被压缩的消息, 压缩提示词)，结果在会话自己的线程里应用（见 _collect）
+    _pending: tuple | None = field(default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        # 缓冲上限小于压缩触发条数时，消息会在压缩前被静默挤掉：把上限提升到触发条数并提示一次
+        global _warned_buffer_cap
+        compress_after = settings.memory_compress_after if self.compress_after is None else self.compress_after
+        cap = self.messages.maxlen
+        if cap is not None and cap < compress_after:
+            if not _warned_buffer_cap:
+                _warned_buffer_cap = True
+                print(f"⚠️  memory_max_turns={cap} 小于压缩触发条数 {compress_after}，"
+                      f"环形缓冲上限提升为 {compress_after}，避免消息在压缩前被丢弃")
+            self.messages = deque(self.messages, maxlen=compress_after)
 
     def add(self, role: str, content: str):
-        self.messages.append(Message(role=role, content=content))
+        self._collect()
+        if self.archive is not None and len(self.messages) == self.messages.maxlen:
+            # 环形缓冲即将挤掉最旧的消息，先归档
+            self.archive.add_messages([self.messages[0]])
+        self.messages.append(Message(role, content))
 
-    def as_list(self) -> List[Dict[str, str]]:
-        result = []
-        if self.compressed_context:
-            result.append({"role": "system", "content": f"[COMPRESSED_CONTEXT]\n{self.compressed_context}"})
-        for m in self.messages:
-            result.append({"role": m.role, "content": m.content})
-        return result
+    def _context_message(self) -> Message:
+        # 压缩上下文对应的 system 消息只在 compressed_context 变化时重建
+        content = f"[COMPRESSED_CONTEXT]\n{self.compressed_context}"
+        if self._ctx_cache is None or self._ctx_cache.content != content:
+            self._ctx_cache = Message("system", content)
+        return self._ctx_cache
 
-    def token_length(self) -> int:
-        # 简单估算 token 数 (针对 OpenAI GPT 风格)
-        enc = tiktoken.get_encoding("cl100k_base")
+    def as_list(self) -> Sequence[Message]:
+        return MessagesView(self)
+
+    def token_length(self, mode: str | None = None) -> int:
+        # 简单估算 token 数 (针对 OpenAI GPT 风格)，每条消息的精确计数会被缓存
+        mode = mode or self.token_mode or token_mode("memory")
         total = 0
         for m in self.messages:
-            total += len(enc.encode(m.content))
+            total += m.token_count(mode)
         if self.compressed_context:
-            total += len(enc.encode(self.compressed_context))
+            total += count_tokens(self.compressed_context, mode)
         return total
 
-    def maybe_compress(self):
-        if len(self.messages) < settings.memory_compress_after:
+    def _summarize(self, prompt: str) -> Any:
+        """
+        调用 summarizer_llm 生成摘要：经 llm_scheduler 按调用方的优先级类别排队（后台压缩时为 background），
+        回放 / 录制时经 cassette。
+        """
+        from langchain_core.prompts import PromptTemplate
+        chain = PromptTemplate(template="{text}", input_variables=["text"]).pipe(self.summarizer_llm)
+
+        def invoke():
+            return chain.invoke({"text": prompt})
+
+        tape = cassette.active()
+        if tape is None:
+            return llm_scheduler.run(invoke)
+        model = str(getattr(self.summarizer_llm, "model_name", "") or getattr(self.summarizer_llm, "model", ""))
+        return llm_scheduler.run(lambda: tape.llm(prompt_key(model, [prompt], stage="summarize"), invoke))
+
+    def _summary_of(self, prompt: str) -> tuple:
+        """生成摘要并记账，返回 (摘要文本, 耗时)。"""
+        t0 = time.perf_counter()
+        if self.summarizer is not None:
+            summary = self.summarizer(prompt)
+            return getattr(summary, "content", str(summary)), time.perf_counter() - t0
+        if self.summarizer_llm is None:
+            # 避免异常，直接粗略压缩
+            return "(未使用LLM压缩) 摘要：用户研究目标可能与之前消息相关。", time.perf_counter() - t0
+        summary = self._summarize(prompt)
+        if self.usage_hook is not None:
+            self.usage_hook(prompt, summary, time.perf_counter() - t0)
+        text = summary if isinstance(summary, str) else getattr(summary, "content", str(summary))
+        return text, time.perf_counter() - t0
+
+    def _apply(self, old: List[Message], prompt: str, summary: str, seconds: float):
+        self.compressed_context = summary
+        mode = self.token_mode or token_mode("memory")
+        self.last_compression = {
+            "messages": len(old),
+            "prompt_tokens": count_tokens(prompt, mode),
+            "summary_tokens": count_tokens(summary, mode),
+            "seconds": round(seconds, 4),
+        }
+        # 删除被压缩的历史（原地弹出，不重建缓冲区）；后台压缩期间已被环形缓冲挤掉的消息在 add 时已归档
+        ids = {id(m) for m in old}
+        removed = []
+        while self.messages and id(self.messages[0]) in ids:
+            removed.append(self.messages.popleft())
+        if self.archive is not None and removed:
+            self.archive.add_messages(removed)
+
+    def _collect(self, wait: bool = False):
+        """应用已完成的后台压缩结果；wait=True 时等待进行中的压缩完成。失败的压缩只提示，不影响对话。"""
+        if self._pending is None or not (wait or self._pending[0].done()):
+            return
+        fut, old, prompt = self._pending
+        self._pending = None
+        try:
+            summary, seconds = fut.result()
+        except Exception as e:
+            print(f"⚠️  后台记忆压缩失败: {e}")
+            return
+        self._apply(old, prompt, summary, seconds)
+
+    def flush(self):
+        """等待并应用进行中的后台压缩（导出状态、测量前调用）。"""
+        self._collect(wait=True)
+
+    def maybe_compress(self, background: bool = False):
+        """
+        消息数达到触发条数时把较早的消息压缩为摘要。background=True 时摘要以 background 类别在共享线程池中生成，
+        不占用本轮的等待时间，也让位于交互请求；结果在下一次 add / maybe_compress 时应用，同一时间只有一个后台压缩。
+        """
+        self._collect()
+        if self._pending is not None:
+            return
+        compress_after = settings.memory_compress_after if self.compress_after is None else self.compress_after
+        if len(self.messages) < compress_after:
             return
 
         # 保留最近 N 条，其余压缩
-        keep_last_n = settings.memory_keep_last_n
-        old = self.messages[:-keep_last_n]
-        if not old:
+        keep_last_n = settings.memory_keep_last_n if self.keep_last_n is None else self.keep_last_n
+        n_old = len(self.messages) - keep_last_n
+        if n_old <= 0:
             return
+        old = list(itertools.islice(self.messages, n_old))
 
         history_text = ""
         for idx, msg in enumerate(old, 1):
             history_text += f"{idx}. [{msg.role}] {msg.content}\n"
 
-        prompt = MEMORY_SUMMARIZE_PROMPT.format(history=history_text)
-        if self.summarizer_llm is None:
-            # 避免异常，直接粗略压缩
-            self.compressed_context = "(未使用LLM压缩) 摘要：用户研究目标可能与之前消息相关。"
-        else:
-            from langchain_core.prompts import PromptTemplate
-            chain = PromptTemplate(template="{text}", input_variables=["text"]).pipe(self.summarizer_llm)
-            summary = chain.invoke({"text": prompt})
-            if isinstance(summary, str):
-                self.compressed_context = summary
-            else:
-                self.compressed_context = getattr(summary, "content", str(summary))
-
-        # 删除被压缩的历史
-        self.messages = self.messages[-keep_last_n:]
\ No newline at end of file
+        prompt = (self.summarize_prompt or MEMORY_SUMMARIZE_PROMPT).format(history=history_text)
+        if background and (self.summarizer is not None or self.summarizer_llm is not None):
+            with scheduling("background"):
+                self._pending = (submit(self._summary_of, prompt), old, prompt)
+            return
+        summary, seconds = self._summary_of(prompt)
+        self._apply(old, prompt, summary, seconds)
@@ -0,0 +1,379 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import copy
+import json
+import re
+import time
+
+from langchain_core.messages import HumanMessage
+
+from .citations import SKIP_KEYS, reconcile_citations, remap_markers
+from .prompt import RESEARCH_REVISION_PROMPT
+from .report import REPORT_ORDER, SECTION_SPECS, parse_json_object, validate_section
+from .retrieval import bm25_scores
+from .store import ReferenceRegistry
+from .tokens import count_tokens
+from ..config.settings import settings
+
+# 骨架字段的期望类型（章节字段的类型见 SECTION_SPECS）
+SKELETON_TYPES: Dict[str, type] = {
+    "project_name": str, "description": str, "keywords": list, "tech_stack": dict, "architecture": dict,
+}
+
+# 反馈中常见的说法 -> 对应的方案字段，用于在本地判断反馈涉及哪些章节
+SECTION_ALIASES: Dict[str, Tuple[str, ...]] = {
+    "project_name": ("项目名", "名称"),
+    "description": ("描述", "简介", "概述"),
+    "keywords": ("关键词",),
+    "tech_stack": ("技术栈", "选型", "框架", "版本", "语言"),
+    "design_philosophy": ("设计理念", "选型理由", "权衡"),
+    "architecture": ("架构模式", "分层"),
+    "non_functional_requirements": ("非功能", "性能指标", "可用性", "扩展性", "并发"),
+    "security_design": ("安全", "认证", "鉴权", "权限", "登录", "加密"),
+    "module_implementation": ("模块", "功能实现"),
+    "architecture_details": ("架构详解", "系统架构", "前后端分离"),
+    "api_design": ("api", "接口", "路由", "请求", "响应"),
+    "database_design": ("数据库", "表结构", "建表", "索引", "sql", "字段"),
+    "error_handling": ("错误", "异常", "错误码"),
+    "testing_strategy": ("测试", "单元测试", "覆盖率"),
+    "performance_optimization": ("性能优化", "缓存", "优化"),
+    "deployment_config": ("部署", "docker", "nginx", "环境变量", "上线"),
+    "mermaid_diagrams": ("架构图", "流程图", "er 图", "er图", "mermaid", "图表"),
+    "implementation_steps": ("实施步骤", "步骤", "计划"),
+    "key_features": ("功能特性", "核心功能", "特性"),
+}
+
+
+def _summary(value: Any, width: int) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, str):
+        text = " ".join(value.split())
+        return f"字符串 {len(value)} 字：{text[:width]}{'…' if len(text) > width else ''}"
+    if isinstance(value, dict):
+        return f"对象，字段 {', '.join(map(str, value))}"
+    if isinstance(value, list):
+        head = " ".join(str(value[0]).split())[:width] if value else ""
+        return f"数组 {len(value)} 项" + (f"，首项：{head}" if head else "")
+    return json.dumps(value, ensure_ascii=False)
+
+
+def plan_outline(plan: Dict[str, Any], width: int = 60) -> str:
+    """方案大纲：每个字段一行，只给出类型与开头摘要，供模型了解未发送章节的内容。"""
+    lines = [f"- {k}: {_summary(v, width)}" for k, v in plan.items() if k != "references"]
+    if "references" in plan:
+        lines.append(f"- references: {len(plan.get('references') or [])} 条（由程序维护）")
+    return "\n".join(lines)
+
+
+def touched_sections(plan: Dict[str, Any], feedback: str, max_sections: Optional[int] = None) -> List[str]:
+    """
+    在本地判断反馈涉及的章节：反馈中直接出现字段名或常见说法的章节优先，
+    其余按反馈与章节正文的 BM25 相关度补充。最多返回 max_sections 个。
+    """
+    max_sections = max_sections or settings.report_revision_max_sections
+    keys = [k for k in plan if k != "references"]
+    if not keys:
+        return []
+    lowered = (feedback or "").lower()
+    scores = {k: 0.0 for k in keys}
+    for k in keys:
+        if k in lowered or any(a in lowered for a in SECTION_ALIASES.get(k, ())):
+            scores[k] += 1.0
+    lexical = bm25_scores(feedback, [json.dumps(plan[k], ensure_ascii=False) for k in keys])
+    top = max(lexical, default=0.0)
+    if top > 0:
+        for k, s in zip(keys, lexical):
+            scores[k] += 0.5 * s / top
+    ranked = sorted((k for k in keys if scores[k] >= 0.3), key=lambda k: -scores[k])
+    return ranked[:max_sections] or [max(keys, key=lambda k: scores[k])]
+
+
+def _pointer(path: Any) -> List[str]:
+    if not isinstance(path, str) or not path.startswith("/"):
+        raise ValueError("path 必须是以 / 开头的 JSON Pointer")
+    return [p.replace("~1", "/").replace("~0", "~") for p in path[1:].split("/")]
+
+
+def _apply_op(doc: Dict[str, Any], op: Dict[str, Any]):
+    """在 doc 上原地应用一个 JSON Patch 操作（add / replace / remove）。"""
+    kind = op.get("op")
+    if kind not in ("add", "replace", "remove"):
+        raise ValueError(f"不支持的操作 {kind}")
+    if kind != "remove" and "value" not in op:
+        raise ValueError("缺少 value")
+    parts = _pointer(op.get("path"))
+    parent: Any = doc
+    for p in parts[:-1]:
+        parent = parent[int(p)] if isinstance(parent, list) else parent[p]
+    last = parts[-1]
+    if isinstance(parent, dict):
+        if kind != "add" and last not in parent:
+            raise KeyError(f"字段 {last} 不存在")
+        if kind == "remove":
+            del parent[last]
+        else:
+            parent[last] = op["value"]
+    elif isinstance(parent, list):
+        if kind == "add" and last == "-":
+            parent.append(op["value"])
+            return
+        idx = int(last)
+        if not 0 <= idx < len(parent) + (kind == "add"):
+            raise IndexError(f"下标 {idx} 越界")
+        if kind == "add":
+            parent.insert(idx, op["value"])
+        elif kind == "replace":
+            parent[idx] = op["value"]
+        else:
+            del parent[idx]
+    else:
+        raise TypeError(f"{'/'.join(parts[:-1]) or '/'} 不是对象或数组")
+
+
+def validate_field(key: str, value: Any) -> str:
+    """校验修订后的顶层字段，返回错误信息；空串表示通过。章节字段允许为 null。"""
+    if key in SECTION_SPECS:
+        return "" if value is None else validate_section(key, {key: value})[1]
+    expected = SKELETON_TYPES.get(key)
+    if expected is not None and not isinstance(value, expected):
+        return f"字段类型错误: 期望 {expected.__name__}，实际 {type(value).__name__}"
+    return ""
+
+
+def apply_patch(plan: Dict[str, Any], ops: List[Any]) -> Tuple[Dict[str, Any], List[str], List[str]]:
+    """
+    逐个应用 JSON Patch 操作并校验所改字段：单个操作失败或校验不通过时只丢弃该操作，不影响其他操作。
+    references 由程序维护，不允许修改；删除整个章节等价于将其设为 null。
+    返回 (新方案, 已应用的 path 列表, 错误列表)，不修改传入的 plan。
+    """
+    doc = copy.deepcopy(plan)
+    applied: List[str] = []
+    errors: List[str] = []
+    for op in ops:
+        if not isinstance(op, dict):
+            errors.append(f"无效操作: {str(op)[:80]}")
+            continue
+        path = op.get("path")
+        try:
+            parts = _pointer(path)
+        except ValueError as e:
+            errors.append(f"{path}: {e}")
+            continue
+        top = parts[0]
+        if top not in REPORT_ORDER or top == "references":
+            errors.append(f"{path}: 不允许修改字段 {top}")
+            continue
+        # 在单字段副本上试应用，校验通过后再写回
+        sandbox = {top: copy.deepcopy(doc[top])} if top in doc else {}
+        try:
+            if len(parts) == 1 and op.get("op") == "remove":
+                if top not in SECTION_SPECS:
+                    raise ValueError("骨架字段不能删除")
+                sandbox[top] = None
+            else:
+                _apply_op(sandbox, op)
+        except (KeyError, IndexError, ValueError, TypeError) as e:
+            errors.append(f"{path}: {e}")
+            continue
+        err = validate_field(top, sandbox.get(top))
+        if err:
+            errors.append(f"{path}: {err}")
+            continue
+        doc[top] = sandbox[top]
+        applied.append(path)
+    return doc, applied, errors
+
+
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+
+
+def _norm_title(title: str) -> str:
+    return re.sub(r"\s+", "", (title or "").strip().strip("#")).lower()
+
+
+def split_sections(markdown: str) -> List[Dict[str, Any]]:
+    """
+    按最高层级的标题把 Markdown 切分为章节（代码块内的 # 不算标题），下级标题留在所属章节内。
+    文档以唯一的最高层级标题开头（如 "# 标题" 后接若干 "## 章节"）时，该标题视为文档标题，按下一级标题切分。
+    第一个章节标题之前的内容（含文档标题）作为 title 为空的开头章节。每个章节为 {"title", "level", "text"}，text 含标题行。
+    """
+    lines = (markdown or "").split("\n")
+    headings: List[Tuple[int, int, str]] = []
+    fenced = False
+    for i, line in enumerate(lines):
+        if line.lstrip().startswith("```"):
+            fenced = not fenced
+        elif not fenced and (m := _HEADING_RE.match(line)):
+            headings.append((i, len(m.group(1)), m.group(2)))
+    if not headings:
+        return [{"title": "", "level": 0, "text": markdown or ""}]
+    top = min(level for _, level, _ in headings)
+    if len(headings) > 1 and headings[0][1] == top and all(level > top for _, level, _ in headings[1:]):
+        # 唯一的文档标题不算章节，归入开头部分
+        headings = headings[1:]
+        top = min(level for _, level, _ in headings)
+    starts = [(i, level, title) for i, level, title in headings if level == top]
+    sections = []
+    if starts[0][0] > 0:
+        sections.append({"title": "", "level": 0, "text": "\n".join(lines[:starts[0][0]])})
+    for k, (i, level, title) in enumerate(starts):
+        end = starts[k + 1][0] if k + 1 < len(starts) else len(lines)
+        sections.append({"title": title, "level": level, "text": "\n".join(lines[i:end])})
+    return sections
+
+
+def markdown_outline(markdown: str, width: int = 60) -> str:
+    """Markdown 章节大纲：每个章节一行，给出标题与正文开头。"""
+    out = []
+    for sec in split_sections(markdown):
+        body = " ".join(sec["text"].split("\n", 1)[-1].split()) if sec["title"] else " ".join(sec["text"].split())
+        out.append(f"- {sec['title'] or '(开头)'}: {body[:width]}{'…' if len(body) > width else ''}")
+    return "\n".join(out)
+
+
+def _find_section(sections: List[Dict[str, Any]], title: str) -> int:
+    key = _norm_title(title)
+    if not key:
+        return -1
+    for i, sec in enumerate(sections):
+        if _norm_title(sec["title"]) == key:
+            return i
+    for i, sec in enumerate(sections):
+        if sec["title"] and (key in _norm_title(sec["title"]) or _norm_title(sec["title"]) in key):
+            return i
+    return -1
+
+
+def section_text(markdown: str, title: str) -> str:
+    """按标题取出章节全文（含标题行），不存在时返回空串。"""
+    sections = split_sections(markdown)
+    idx = _find_section(sections, title)
+    return sections[idx]["text"] if idx >= 0 else ""
+
+
+def apply_section_edits(markdown: str, edits: List[Any]) -> Tuple[str, List[str], List[str]]:
+    """
+    把按章节给出的修改应用到 Markdown 文档：
+      {"action": "replace", "section": 标题, "content": 新内容}  替换章节（content 不含标题行时沿用原标题）
+      {"action": "add", "section": 标题, "after": 标题, "content": ...}  新增章节（找不到 after 时追加到末尾）
+      {"action": "remove", "section": 标题}  删除章节
+    replace / remove 的章节不存在时记为错误，不改动文档。返回 (新文档, 已应用的章节标题, 错误列表)。
+    """
+    sections = split_sections(markdown)
+    level = max((s["level"] for s in sections), default=0) or 2
+    applied: List[str] = []
+    errors: List[str] = []
+
+    def render(title: str, content: str) -> str:
+        content = (content or "").strip()
+        return content if _HEADING_RE.match(content.split("\n", 1)[0]) else f"{'#' * level} {title}\n{content}"
+
+    for edit in edits:
+        if not isinstance(edit, dict) or not str(edit.get("section") or "").strip():
+            errors.append(f"无效修改: {str(edit)[:80]}")
+            continue
+        action, title = edit.get("action", "replace"), str(edit["section"]).strip()
+        idx = _find_section(sections, title)
+        if action in ("replace", "remove") and idx < 0:
+            errors.append(f"{title}: 章节不存在")
+            continue
+        if action == "remove":
+            sections.pop(idx)
+        elif action in ("replace", "add"):
+            if not str(edit.get("content") or "").strip():
+                errors.append(f"{title}: 缺少 content")
+                continue
+            if action == "replace":
+                sections[idx] = {**sections[idx], "text": render(sections[idx]["title"], edit["content"])}
+            else:
+                after = _find_section(sections, str(edit.get("after") or ""))
+                pos = after + 1 if after >= 0 else len(sections)
+                sections.insert(pos, {"title": title, "level": level, "text": render(title, edit["content"])})
+        else:
+            errors.append(f"{title}: 不支持的操作 {action}")
+            continue
+        applied.append(title)
+    return "\n\n".join(s["text"].strip("\n") for s in sections if s["text"].strip()), applied, errors
+
+
+class PatchReviser:
+    """
+    增量修订技术方案：只发送方案大纲 + 反馈涉及章节的完整内容，模型返回 JSON Patch，
+    在本地应用、逐项校验并重新校对引用。全部操作都失败时带上错误信息重试，仍失败则抛出 ValueError，
+    由调用方回退到整份重新生成。
+    invoke(messages, max_tokens) 的约定与 SectionedReportGenerator 相同。
+    """
+
+    def __init__(self, invoke: Callable[[List[Any], Optional[int]], str],
+                 max_sections: int | None = None, max_retries: int | None = None):
+        self.invoke = invoke
+        self.max_sections = max_sections or settings.report_revision_max_sections
+        self.max_retries = settings.report_section_retries if max_retries is None else max_retries
+        self.last_stats: Dict[str, Any] = {}
+
+    def revise(self, requirement: str, plan: Dict[str, Any], feedback: str, research_data: str = "",
+               url_list: Optional[Dict[int, Dict[str, Any]]] = None,
+               registry: Optional[ReferenceRegistry] = None) -> Dict[str, Any]:
+        """
+        url_list / research_data 为补充调研（可为空），编号来自 registry。
+        原方案 references 中的 URL 也登记到 registry，正文编号随之改写，使新旧引用共用同一套编号。
+        """
+        t0 = time.perf_counter()
+        registry = registry or ReferenceRegistry()
+        mapping = {
+            i: registry.register(r["url"], r.get("title") or "")
+            for i, r in enumerate(plan.get("references") or [], 1)
+            if isinstance(r, dict) and isinstance(r.get("url"), str) and r["url"].strip()
+        }
+        base = {k: v if k in SKIP_KEYS else remap_markers(v, mapping)
+                for k, v in plan.items() if k != "references"}
+        known = {n: registry.get(n) for n in mapping.values()}
+        known.update(url_list or {})
+
+        sections = touched_sections(base, feedback, self.max_sections)
+        prompt = RESEARCH_REVISION_PROMPT.format(
+            requirement=requirement,
+            outline=plan_outline(base) + "\n\n现有引用：\n" + (registry.render(list(mapping.values())) or "(无)"),
+            sections=json.dumps({k: base[k] for k in sections}, ensure_ascii=False, indent=2),
+            research_data=research_data or "(无)",
+            instruction=feedback,
+        )
+
+        attempts = 0
+        applied: List[str] = []
+        errors: List[str] = []
+        revised = base
+        message = prompt
+        for _ in range(self.max_retries + 1):
+            attempts += 1
+            data = parse_json_object(self.invoke([HumanMessage(content=message)], settings.report_revision_max_tokens))
+            ops = data.get("patch") if data else None
+            if not isinstance(ops, list):
+                errors = ["补丁 JSON 解析失败"]
+            else:
+                revised, applied, errors = apply_patch(base, ops)
+                if applied or not ops:
+                    break
+            message = prompt + "\n\n上一次输出的补丁无法应用：\n" + "\n".join(errors[:10]) + "\n请修正后重新输出。"
+        else:
+            raise ValueError(f"技术方案补丁应用失败: {'; '.join(errors[:3])}")
+
+        report, citation_issues = reconcile_citations(revised, known)
+        ordered = {k: report[k] for k in REPORT_ORDER if k in report}
+        ordered.update({k: v for k, v in report.items() if k not in ordered})
+
+        full_tokens = count_tokens(json.dumps(plan, ensure_ascii=False))
+        prompt_tokens = count_tokens(prompt)
+        self.last_stats = {
+            "mode": "patch",
+            "sections": sections,
+            "attempts": attempts,
+            "applied": applied,
+            "rejected": errors,
+            # 与整份重发 previous_plan 的对比
+            "prompt_tokens": prompt_tokens,
+            "previous_plan_tokens": full_tokens,
+            "wall_seconds": round(time.perf_counter() - t0, 3),
+            "citations": citation_issues,
+        }
+        return ordered
@@ -0,0 +1,178 @@
+from typing import Any, Dict, List, Optional, Tuple
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+import math
+import re
+import threading
+
+from .retrieval import lexical_terms
+from .singleflight import normalize_query
+from ..config.settings import settings
+
+# 技术实体：带大写/数字/点号的拉丁词组（Spring Boot、MySQL 8.0、Vue3），以及引号/书名号内的词
+_ENTITY_RE = re.compile(r"[A-Z][A-Za-z0-9.+#-]*(?:\s+[A-Z][A-Za-z0-9.+#-]*)*|[A-Za-z]+\d[\w.]*|[「“\"《]([^」”\"》]{1,30})[」”\"》]")
+_CJK_RE = re.compile(r"[㐀-鿿]")
+_LATIN_WORD_RE = re.compile(r"[A-Za-z0-9]+")
+# 表示“面广”的提示词：并列、对比、方案设计类问题
+_BREADTH_MARKERS = ("和", "与", "及", "以及", "对比", "比较", "vs", "优缺点", "方案", "架构", "设计",
+                    "实现", "系统", "全面", "调研", "选型", "流程", "步骤")
+# 表示“追问”的指代词
+_FOLLOWUP_MARKERS = ("它", "这个", "那个", "上面", "刚才", "之前", "继续", "还有", "那么")
+
+
+@dataclass
+class FanoutDecision:
+    complexity: float
+    subquestions: int
+    results_per_subq: int
+    skip_plan: bool
+    reason: str
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def estimate_complexity(query: str, is_followup: bool = False) -> Dict[str, Any]:
+    """本地估计问题复杂度（0~1）：长度、实体数、面广提示词、多问句，追问打折。"""
+    query = query or ""
+    units = len(_CJK_RE.findall(query)) + len(_LATIN_WORD_RE.findall(query))
+    entities = len(_ENTITY_RE.findall(query))
+    lowered = query.lower()
+    breadth = sum(lowered.count(m) for m in _BREADTH_MARKERS)
+    questions = max(query.count("?") + query.count("？"), 1)
+    followup = is_followup or any(m in query[:12] for m in _FOLLOWUP_MARKERS)
+
+    score = (0.35 * min(1.0, units / 60)
+             + 0.35 * min(1.0, entities / 6)
+             + 0.3 * min(1.0, (breadth + questions - 1) / 4))
+    if followup:
+        score *= 0.7
+    return {
+        "score": round(min(score, 1.0), 3),
+        "units": units,
+        "entities": entities,
+        "breadth_markers": breadth,
+        "questions": questions,
+        "followup": followup,
+    }
+
+
+def choose_fanout(query: str, is_followup: bool = False, queue_depth: int = 0,
+                  remaining_s: float = math.inf) -> FanoutDecision:
+    """
+    根据复杂度、当前排队深度和剩余时间预算决定子问题数与每个子问题保留的结果数。
+    简单查询跳过规划调用，直接用原问题搜索一次。
+    """
+    est = estimate_complexity(query, is_followup)
+    score = est["score"]
+    max_n = max(1, settings.max_subquestions)
+    n = 1 + round(score * (max_n - 1))
+    reasons = [f"复杂度 {score}"]
+
+    skip_plan = score < settings.adaptive_simple_threshold and est["questions"] == 1
+    if skip_plan:
+        n = 1
+        reasons.append("简单查询，跳过规划")
+
+    # 负载高时收窄扇出，把并发留给其他会话
+    if queue_depth > settings.adaptive_queue_high and n > 1:
+        n = max(1, n - math.ceil(queue_depth / max(settings.adaptive_queue_high, 1)))
+        reasons.append(f"排队深度 {queue_depth}")
+
+    # 剩余时间不足以跑完整轮时减半
+    if remaining_s < settings.adaptive_min_budget_s and n > 1:
+        n = max(1, n // 2)
+        reasons.append(f"剩余预算 {remaining_s:.0f}s")
+
+    # 子问题越少，每个子问题保留的结果越多；总结果数大致在 8~20 之间
+    per = max(3, min(8, round(8 - 4 * (n - 1) / max(max_n - 1, 1))))
+    if queue_depth > settings.adaptive_queue_high:
+        per = max(3, per - 1)
+
+    return FanoutDecision(
+        complexity=score,
+        subquestions=n,
+        results_per_subq=per,
+        skip_plan=skip_plan,
+        reason="；".join(reasons),
+    )
+
+
+class SubquestionRegistry:
+    """
+    会话级的已回答子问题登记表：子问题 -> 该子问题的搜索结果（句柄形式，正文在 ContentStore 中）。
+    追问时把已覆盖的主题告诉规划器，并直接复用与新子问题等价的旧结果，只为真正的新子问题发起搜索。
+    按最近使用淘汰，最多保留 max_entries 个子问题。
+    """
+
+    def __init__(self, max_entries: int | None = None, threshold: float | None = None):
+        self.max_entries = max_entries or settings.subq_registry_size
+        self.threshold = settings.subq_reuse_threshold if threshold is None else threshold
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, blocks: List[Dict[str, Any]]):
+        """登记搜索成功的子问题块（无结果或出错的不登记，下次仍会重新搜索）。"""
+        with self._lock:
+            for block in blocks:
+                if block.get("error") or not block.get("results") or block.get("reused"):
+                    continue
+                key = normalize_query(block.get("subq", ""))
+                self._entries[key] = {"block": block, "terms": frozenset(lexical_terms(key))}
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def covered(self, limit: int = 20) -> List[str]:
+        """最近登记的子问题原文（新的在前），用于提示规划器。"""
+        with self._lock:
+            return [e["block"]["subq"] for e in list(self._entries.values())[::-1][:limit]]
+
+    def match(self, subq: str, touch: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        查找与 subq 等价的已登记子问题：规范化后完全相同，或词项 Jaccard 相似度不低于阈值。
+        touch=False 时只查询，不更新最近使用顺序与命中统计（供预估使用）。
+        """
+        key = normalize_query(subq)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                terms = frozenset(lexical_terms(key))
+                best = 0.0
+                for e in self._entries.values():
+                    union = len(terms | e["terms"])
+                    score = len(terms & e["terms"]) / union if union else 0.0
+                    if score > best:
+                        best, entry = score, e
+                if best < self.threshold:
+                    entry = None
+            if not touch:
+                return entry["block"] if entry is not None else None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(normalize_query(entry["block"]["subq"]))
+            self.hits += 1
+            return entry["block"]
+
+    def split(self, plan: List[Dict[str, Any]],
+              touch: bool = True) -> Tuple[Dict[int, Dict[str, Any]], List[int]]:
+        """把规划结果分为可复用的（计划下标 -> 旧结果块）与需要新搜索的（计划下标列表）。"""
+        reused: Dict[int, Dict[str, Any]] = {}
+        fresh: List[int] = []
+        for i, sq in enumerate(plan):
+            block = self.match(sq.get("subq", ""), touch)
+            if block is None:
+                fresh.append(i)
+            else:
+                reused[i] = {**block, "subq": sq.get("subq", block["subq"]), "reused": True,
+                             "reason": sq.get("reason") or block.get("reason", "")}
+        return reused, fresh
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,130 @@
+from typing import Any, Callable, Dict, List
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+import sys
+import time
+import tracemalloc
+
+from ..config.settings import settings
+
+
+def _module_of(filename: str) -> str:
+    """把源文件路径归并为模块名（按 sys.path 最长前缀截取），用于按模块统计分配增长。"""
+    path = Path(filename)
+    best = ""
+    for entry in sys.path:
+        if entry and filename.startswith(entry) and len(entry) > len(best):
+            best = entry
+    rel = Path(filename[len(best):].lstrip("/\\")) if best else path
+    parts = [p for p in rel.with_suffix("").parts if p not in ("site-packages", "dist-packages")]
+    if parts and parts[-1] == "__init__":
+        parts = parts[:-1]
+    # 第三方包只保留顶层包名，项目内模块保留到 src.agent.xxx 级别
+    depth = 3 if parts and parts[0] == "src" else 1
+    return ".".join(parts[:depth]) or filename
+
+
+class TurnProfiler:
+    """
+    逐轮内存剖析：每个 ask/critique/continue_dialog 轮次前后各取一次 tracemalloc 快照，
+    按模块归并分配增长，并在最近 window 轮的驻留内存持续单调上升时标记疑似泄漏。
+    仅在 settings.debug 且 settings.profile_memory 时启用（快照本身有明显开销）。
+    quiet=True 时照常记录，但不在每轮结束后打印摘要（浸泡测试等只看汇总报告的场景）。
+    """
+
+    def __init__(self, window: int | None = None, top_n: int = 8, frames: int = 1, quiet: bool = False):
+        self.window = window or settings.profile_growth_window
+        self.top_n = top_n
+        self.frames = frames
+        self.quiet = quiet
+        self.turns: List[Dict[str, Any]] = []
+
+    @staticmethod
+    def enabled() -> bool:
+        return bool(settings.debug and settings.profile_memory)
+
+    @contextmanager
+    def turn(self, kind: str):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        before = tracemalloc.take_snapshot()
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t0
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            self._record(kind, before, after, current, peak, elapsed)
+
+    def _record(self, kind: str, before, after, current: int, peak: int, elapsed: float):
+        by_module: Dict[str, int] = {}
+        for stat in after.compare_to(before, "filename"):
+            mod = _module_of(stat.traceback[0].filename)
+            by_module[mod] = by_module.get(mod, 0) + stat.size_diff
+        top = sorted(by_module.items(), key=lambda kv: kv[1], reverse=True)[: self.top_n]
+        record = {
+            "turn": len(self.turns) + 1,
+            "kind": kind,
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "delta_bytes": sum(by_module.values()),
+            "top_modules": [{"module": m, "delta_bytes": d} for m, d in top],
+            "seconds": round(elapsed, 4),
+        }
+        self.turns.append(record)
+        record["monotonic_growth"] = self.monotonic_growth()
+
+    def monotonic_growth(self) -> bool:
+        """最近 window 轮的 traced_bytes 是否严格递增（轮数不足时为 False）。"""
+        if len(self.turns) < self.window:
+            return False
+        recent = [t["traced_bytes"] for t in self.turns[-self.window:]]
+        return all(b > a for a, b in zip(recent, recent[1:]))
+
+    def growth_by_module(self) -> Dict[str, int]:
+        """全部轮次累计的按模块增长，用于定位长期增长的来源。"""
+        total: Dict[str, int] = {}
+        for t in self.turns:
+            for item in t["top_modules"]:
+                total[item["module"]] = total.get(item["module"], 0) + item["delta_bytes"]
+        return dict(sorted(total.items(), key=lambda kv: kv[1], reverse=True))
+
+    def report(self) -> Dict[str, Any]:
+        first = self.turns[0]["traced_bytes"] if self.turns else 0
+        last = self.turns[-1]["traced_bytes"] if self.turns else 0
+        return {
+            "turns": len(self.turns),
+            "traced_bytes_first": first,
+            "traced_bytes_last": last,
+            "growth_bytes": last - first,
+            "growth_per_turn": (last - first) // max(len(self.turns) - 1, 1),
+            "monotonic_growth": self.monotonic_growth(),
+            "growth_by_module": self.growth_by_module(),
+        }
+
+    def summary_line(self) -> str:
+        t = self.turns[-1]
+        top = ", ".join(f"{m['module']} {m['delta_bytes'] / 1024:+.1f}KiB" for m in t["top_modules"][:3])
+        line = f"🧠 内存[{t['kind']}]: {t['traced_bytes'] / 1024:.0f}KiB ({t['delta_bytes'] / 1024:+.1f}KiB) 主要增长: {top}"
+        if t["monotonic_growth"]:
+            line += f"\n⚠️  最近 {self.window} 轮内存持续增长，疑似泄漏"
+        return line
+
+
+def profiled(kind: str) -> Callable:
+    """ResearchAgent 方法装饰器：在剖析模式下把整轮调用包进 TurnProfiler.turn。"""
+    def decorator(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            profiler = getattr(self, "profiler", None)
+            if profiler is None or not profiler.enabled():
+                return fn(self, *args, **kwargs)
+            with profiler.turn(kind):
+                result = fn(self, *args, **kwargs)
+            if not profiler.quiet:
+                print(profiler.summary_line())
+            return result
+        return wrapper
+    return decorator
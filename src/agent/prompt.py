@@ -31,6 +31,29 @@ PLAN_PROMPT = """
 只返回 JSON 数组，不要包含其他文本。
 """
 
+# 追问时的增量规划：列出本会话已检索过的子问题，只为新的信息需求生成子问题
+PLAN_DELTA_PROMPT = """
+基于用户的问题："{query}"
+
+本会话中以下子问题已经检索过，其结果会被直接复用：
+{covered}
+
+请制定一个信息检索计划，分解为最多 {max_subquestions} 个子问题。
+每个子问题应该：
+1. 具体且可搜索
+2. 相互补充，避免重复
+3. 能够帮助全面回答用户的问题
+4. 不要重复已检索过的主题；如果回答需要用到某个已检索的子问题，原样写出该子问题即可复用其结果
+
+请以 JSON 数组格式返回，格式如下：
+[
+  {{"subq": "具体的子问题1", "reason": "为什么要搜索这个问题"}},
+  {{"subq": "具体的子问题2", "reason": "为什么要搜索这个问题"}}
+]
+
+只返回 JSON 数组，不要包含其他文本。
+"""
+
 SYNTHESIS_PROMPT = """
 基于用户的问题："{query}"
 
@@ -45,6 +68,33 @@ SYNTHESIS_PROMPT = """
 4. 如果信息不足，明确说明
 """
 
+# 结果较多时的分治综合：先按子问题各自综合（map），再合并为完整回答（reduce）
+SYNTHESIS_MAP_PROMPT = """
+基于用户的问题："{query}"
+
+当前子问题："{subq}"
+
+以下是该子问题搜索到的信息片段：
+{snippets}
+
+请只根据这些片段，写出该子问题相关的要点（300字以内），用 [n] 标注每个要点的来源片段编号。
+不要编造片段中没有的信息；片段与问题无关时，直接说明“无相关信息”。
+"""
+
+SYNTHESIS_REDUCE_PROMPT = """
+基于用户的问题："{query}"
+
+以下是按子问题分别整理的要点，其中的 [n] 是引用编号：
+{partials}
+
+请综合这些要点，撰写一个完整、准确的回答。
+要求：
+1. 直接回答用户的问题
+2. 保留要点中的引用标注 [n]，编号原样使用，不要改写或新增编号
+3. 合并重复内容，保持逻辑清晰，结构合理
+4. 如果信息不足，明确说明
+"""
+
 CRITIQUE_PROMPT = """
 用户对之前的回答提出了反馈："{feedback}"
 
@@ -63,6 +113,45 @@ CRITIQUE_PROMPT = """
 如果不需要新搜索，new_subquestions 设为空数组。
 """
 
+# 增量质疑：只点名需要修改的章节并给出替换内容，由程序在本地修补回答
+CRITIQUE_PATCH_PROMPT = """
+用户对之前的回答提出了反馈："{feedback}"
+
+当前回答的章节大纲：
+{outline}
+
+当前回答全文：
+{answer}
+
+请判断是否需要新的搜索来补充信息，并只修改需要变化的章节，不要重写整篇回答。
+请以 JSON 格式返回：
+{{
+  "need_new_search": true/false,
+  "new_subquestions": ["新搜索问题1", "新搜索问题2"] （如果需要新搜索）,
+  "edits": [
+    {{"action": "replace", "section": "要修改的章节标题", "content": "该章节修改后的完整内容"}},
+    {{"action": "add", "section": "新章节标题", "after": "插入到哪个章节之后（可选）", "content": "新章节内容"}},
+    {{"action": "remove", "section": "要删除的章节标题"}}
+  ]
+}}
+
+如果不需要新搜索，new_subquestions 设为空数组。
+如果需要新搜索，edits 中给出要修改或新增的章节标题即可（content 可以留空），补充资料到达后会再请你写出这些章节。
+"""
+
+CRITIQUE_SECTIONS_PROMPT = """
+用户对之前的回答提出了反馈："{feedback}"
+
+需要修改或新增的章节（当前内容）：
+{sections}
+
+可用资料（包含本轮补充搜索与之前的搜索结果，[n] 为引用编号）：
+{snippets}
+
+请结合资料写出这些章节修改后的内容，用 [n] 标注引用。只输出 JSON：
+{{"edits": [{{"action": "replace 或 add", "section": "章节标题", "after": "新增章节插入位置（可选）", "content": "章节内容"}}]}}
+"""
+
 MEMORY_SUMMARIZE_PROMPT = """
 以下是对话历史记录，请将其压缩为一段简洁的摘要，保留关键信息和上下文。
 
@@ -106,4 +195,111 @@ RESEARCH_PROMPT = PromptTemplate(
 确保技术选型具体（例如指明具体的 Python 库或版本），不要输出 ```json 代码块标记，直接输出 JSON 字符串。
 """,
     template_format="f-string"
-)
\ No newline at end of file
+)
+
+# 分段并行生成技术方案：先生成骨架，再按章节并发生成，最后在本地组装为完整 JSON
+RESEARCH_SKELETON_PROMPT = PromptTemplate(
+    input_variables=["requirement", "research_data", "previous_plan", "instruction"],
+    template="""
+你是一位高级系统架构师。基于以下调研数据，先确定技术方案的骨架。
+
+---用户需求---
+{requirement}
+
+--- 之前的方案/记录---
+{previous_plan}
+
+---调研数据---
+{research_data}
+
+---重要说明---
+{instruction}
+
+---输出要求---
+只输出严格的 JSON 对象（不要输出任何多余文本或代码块标记），包含以下字段：
+{{
+  "project_name": "项目名称（简洁明了）",
+  "description": "项目的详细描述，包括项目目标、核心功能、应用场景等（200-500字）",
+  "keywords": ["关键词1", "关键词2"],
+  "tech_stack": {{
+    "language": "主要编程语言及版本",
+    "backend": {{"framework": "...或null", "orm": "...或null", "authentication": "...或null", "api": "...或null", "other": []}},
+    "frontend": {{"framework": "...或null", "ui_library": "...或null", "state_management": "...或null", "build_tool": "...或null", "other": []}},
+    "database": {{"primary": "...或null", "cache": "...或null", "other": []}},
+    "devops": {{"container": "...或null", "ci_cd": "...或null", "monitoring": "...或null", "other": []}},
+    "other": []
+  }},
+  "architecture": {{
+    "pattern": "架构模式",
+    "pattern_reason": "选择理由",
+    "layers": {{"presentation": "...", "business": "...", "data": "..."}},
+    "deployment": "部署架构描述",
+    "diagram_description": "各组件之间的关系和数据流向"
+  }}
+}}
+
+技术选型要具体到库和版本；项目不需要的技术设为 null 或空数组，不要强行添加。
+""",
+    template_format="f-string"
+)
+
+RESEARCH_SECTION_PROMPT = PromptTemplate(
+    input_variables=["requirement", "skeleton", "research_data", "instruction", "section_key", "section_spec"],
+    template="""
+你是一位高级系统架构师，正在撰写技术方案中的一个章节。方案骨架已经确定，本章节必须与骨架中的技术选型保持一致。
+
+---用户需求---
+{requirement}
+
+---方案骨架（已确定，不要修改）---
+{skeleton}
+
+---调研数据---
+{research_data}
+
+---重要说明---
+{instruction}
+
+---本章节---
+字段名：{section_key}
+要求：{section_spec}
+
+引用规则：在正文中用 [n] 标注引用，n 只能取调研数据开头URL列表中的编号；不要输出 references 字段。
+所有代码、方法名、API路径、类名、配置项、技术术语都用反引号包裹。
+
+只输出严格的 JSON 对象 {{"{section_key}": ...}}，不要输出任何多余文本或代码块标记。
+""",
+    template_format="f-string"
+)
+
+# 增量修订技术方案：只发送方案大纲和反馈涉及的章节，模型返回 JSON Patch，由程序在本地应用和校验
+RESEARCH_REVISION_PROMPT = PromptTemplate(
+    input_variables=["requirement", "outline", "sections", "research_data", "instruction"],
+    template="""
+你是一位高级系统架构师，正在按用户反馈修订一份已有的技术方案。只修改反馈涉及的部分，其余内容保持不变。
+
+---用户需求---
+{requirement}
+
+---现有方案大纲（每个字段的类型与摘要）---
+{outline}
+
+---需要修订的章节（完整内容）---
+{sections}
+
+---补充调研数据---
+{research_data}
+
+---修订要求---
+{instruction}
+
+---输出要求---
+只输出严格的 JSON 对象（不要输出任何多余文本或代码块标记），格式为 JSON Patch（RFC 6902 的子集）：
+{{"patch": [{{"op": "replace", "path": "/database_design", "value": "..."}}]}}
+- op 只能是 replace、add、remove；path 使用 JSON Pointer，例如 /tech_stack/database/cache、/key_features/-（追加）
+- 只修改需要变化的字段，尽量使用最小粒度的 path；不要修改 references，引用编号由程序在本地校对
+- 引用标注 [n] 只能使用大纲中“现有引用”的编号或补充调研数据开头URL列表中的编号
+- 字段类型必须与原方案一致（字符串仍为字符串，对象仍为对象）
+""",
+    template_format="f-string"
+)
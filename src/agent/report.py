@@ -0,0 +1,195 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import json
+import re
+import time
+
+from langchain_core.messages import HumanMessage
+
+from .citations import reconcile_citations
+from .prompt import RESEARCH_SKELETON_PROMPT, RESEARCH_SECTION_PROMPT
+from ..config.settings import settings
+
+# 骨架字段（第一步生成，后续各章节以此为准）
+SKELETON_KEYS = ("project_name", "description", "keywords", "tech_stack", "architecture")
+
+# 可并发生成的独立章节：字段名 -> (期望类型, 要求)。要求摘自 RESEARCH_PROMPT 中对应字段的说明
+SECTION_SPECS: Dict[str, Tuple[type, str]] = {
+    "design_philosophy": (str, "核心架构与设计理念（800-1200字）：架构模式选择的原因、每个主要技术选型的理由、"
+                               "性能/可维护性/开发效率/成本的权衡，采用'首先...其次...再次...最后...'的结构。"),
+    "non_functional_requirements": (dict, "对象，包含 performance、scalability、availability、maintainability、"
+                                          "reliability、usability 六个字段，每个字段给出具体指标与实现手段。"),
+    "security_design": (dict, "对象，包含 authentication、authorization、data_security、api_security、"
+                              "infrastructure_security、compliance；项目不需要的项设为 null 并说明原因。"),
+    "module_implementation": (str, "核心功能模块实现（800-1500字）：各模块的实现方式、技术细节、关键代码思路。"),
+    "architecture_details": (str, "系统架构详解（600-1500字）：前后端分离、数据存储、部署架构的设计思路与实现细节。"),
+    "api_design": (str, "API 接口详细设计（600-1000字）：路径、方法、参数、响应格式、状态码、错误处理与校验规则。"),
+    "database_design": (str, "数据库详细设计（800-1200字）：表结构、字段说明、索引设计、表间关系、数据字典，"
+                             "必须包含完整的建表 SQL 示例；不使用数据库时说明原因。"),
+    "error_handling": (str, "错误处理与异常设计（600-1000字）：全局异常处理、异常分类、错误码规范、"
+                            "统一错误响应格式示例、常见错误场景处理、日志策略。"),
+    "testing_strategy": (str, "测试策略（400-600字）：单元/集成/端到端测试、框架选择、覆盖率要求、Mock 策略。"),
+    "performance_optimization": (str, "性能优化方案（400-600字）：数据库查询、缓存、前端与资源加载优化及指标。"),
+    "deployment_config": (str, "部署配置详解（400-600字）：生产环境配置、环境变量、Docker/Nginx 配置示例。"),
+    "mermaid_diagrams": (dict, "对象，包含 architecture、data_flow、deployment、database_er 四个 Mermaid 代码字段，"
+                               "不适用的设为 null；图中只能出现骨架 tech_stack 中实际采用的组件；"
+                               "ER 图字段写成'类型 字段名'，禁止使用 PK/FK/UK 标记。"),
+    "implementation_steps": (list, "字符串数组，按顺序给出可执行的实施步骤（环境搭建、数据库、后端、前端、联调测试、部署）。"),
+    "key_features": (list, "字符串数组，列出核心功能特性并详细描述。"),
+}
+
+# 最终 JSON 的字段顺序，与 RESEARCH_PROMPT 保持一致
+REPORT_ORDER = ("project_name", "description", "keywords", "tech_stack", "design_philosophy",
+                "architecture", "non_functional_requirements",
+                "security_design", "module_implementation", "architecture_details", "api_design",
+                "database_design", "error_handling", "testing_strategy", "performance_optimization",
+                "deployment_config", "mermaid_diagrams", "implementation_steps", "key_features", "references")
+
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.M)
+
+
+def parse_json_object(text: str) -> Optional[Dict[str, Any]]:
+    """解析模型输出的 JSON 对象：容忍代码块标记和前后多余文本。"""
+    text = _FENCE_RE.sub("", (text or "").strip())
+    try:
+        data = json.loads(text)
+        return data if isinstance(data, dict) else None
+    except ValueError:
+        pass
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1 and end > start:
+        try:
+            data = json.loads(text[start:end + 1])
+            return data if isinstance(data, dict) else None
+        except ValueError:
+            return None
+    return None
+
+
+def validate_section(key: str, data: Optional[Dict[str, Any]]) -> Tuple[Any, str]:
+    """校验单个章节的输出，返回 (值, 错误信息)；错误信息为空表示通过。"""
+    if data is None:
+        return None, "JSON 解析失败"
+    if key not in data:
+        # 模型偶尔直接输出章节内容本身而不是 {key: ...}
+        if len(data) == 1:
+            data = {key: next(iter(data.values()))}
+        else:
+            return None, f"缺少字段 {key}"
+    expected, _ = SECTION_SPECS[key]
+    value = data[key]
+    if not isinstance(value, expected):
+        return None, f"字段类型错误: 期望 {expected.__name__}，实际 {type(value).__name__}"
+    if expected is str and len(value.strip()) < 20:
+        return None, "内容过短"
+    if expected is list and not value:
+        return None, "数组为空"
+    return value, ""
+
+
+class SectionedReportGenerator:
+    """
+    分段并行生成 RESEARCH_PROMPT 定义的技术方案：
+      1. 先生成骨架（project_name / description / keywords / tech_stack / architecture）；
+      2. 以有界线程池并发生成各独立章节，每个章节单独校验；
+      3. 只重试校验失败的章节（最多 max_retries 轮）；
+      4. 在本地按 REPORT_ORDER 组装最终 JSON，引用编号与 references 由 reconcile_citations 校对生成。
+    invoke(messages, max_tokens) 负责调用 LLM 并返回文本，一般传入 ResearchAgent 的 _invoke 封装。
+    """
+
+    def __init__(self, invoke: Callable[[List[Any], Optional[int]], str],
+                 max_workers: int | None = None, max_retries: int | None = None):
+        self.invoke = invoke
+        self.max_workers = max_workers or settings.report_workers
+        self.max_retries = settings.report_section_retries if max_retries is None else max_retries
+        self.last_stats: Dict[str, Any] = {}
+
+    def _skeleton(self, requirement: str, research_data: str, previous_plan: str, instruction: str) -> Dict[str, Any]:
+        prompt = RESEARCH_SKELETON_PROMPT.format(
+            requirement=requirement, research_data=research_data,
+            previous_plan=previous_plan or "(无)", instruction=instruction or "(无)",
+        )
+        last_error = ""
+        for _ in range(self.max_retries + 1):
+            data = parse_json_object(self.invoke([HumanMessage(content=prompt)], settings.report_skeleton_max_tokens))
+            if data is not None and all(k in data for k in SKELETON_KEYS):
+                return {k: data[k] for k in SKELETON_KEYS}
+            last_error = "骨架 JSON 解析失败" if data is None else f"骨架缺少字段 {[k for k in SKELETON_KEYS if k not in data]}"
+        raise ValueError(f"技术方案骨架生成失败: {last_error}")
+
+    def _section(self, key: str, requirement: str, skeleton_text: str,
+                 research_data: str, instruction: str) -> Tuple[str, Any, str, float]:
+        prompt = RESEARCH_SECTION_PROMPT.format(
+            requirement=requirement, skeleton=skeleton_text, research_data=research_data,
+            instruction=instruction or "(无)", section_key=key, section_spec=SECTION_SPECS[key][1],
+        )
+        t0 = time.perf_counter()
+        try:
+            text = self.invoke([HumanMessage(content=prompt)], settings.report_section_max_tokens)
+            value, err = validate_section(key, parse_json_object(text))
+        except Exception as e:
+            value, err = None, f"调用失败: {e}"
+        return key, value, err, time.perf_counter() - t0
+
+    def generate(self, requirement: str, research_data: str, previous_plan: str = "",
+                 instruction: str = "", url_list: Optional[Dict[int, Dict[str, str]]] = None,
+                 sections: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        生成完整技术方案 JSON。url_list 为 {编号: {"url", "title"}}，用于组装 references；
+        sections 可限定只生成部分章节（默认全部）。
+        """
+        t0 = time.perf_counter()
+        skeleton = self._skeleton(requirement, research_data, previous_plan, instruction)
+        skeleton_s = time.perf_counter() - t0
+        skeleton_text = json.dumps(skeleton, ensure_ascii=False, indent=2)
+
+        pending = list(sections or SECTION_SPECS)
+        values: Dict[str, Any] = {}
+        errors: Dict[str, str] = {}
+        attempts: Dict[str, int] = {k: 0 for k in pending}
+        serial_s = 0.0
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="report") as pool:
+            for _ in range(self.max_retries + 1):
+                if not pending:
+                    break
+                # 各章节携带调用方的 contextvars，LLM 调用仍按原会话与类别排队
+                futures = [pool.submit(contextvars.copy_context().run, self._section,
+                                       k, requirement, skeleton_text, research_data, instruction)
+                           for k in pending]
+                pending = []
+                for fut in futures:
+                    key, value, err, secs = fut.result()
+                    attempts[key] += 1
+                    serial_s += secs
+                    if err:
+                        errors[key] = err
+                        pending.append(key)
+                    else:
+                        values[key] = value
+                        errors.pop(key, None)
+
+        report: Dict[str, Any] = {}
+        merged = {**skeleton, **values}
+        for key in REPORT_ORDER:
+            if key == "references":
+                continue
+            if key in merged:
+                report[key] = merged[key]
+            elif key in SECTION_SPECS:
+                report[key] = None
+        # 引用编号在本地统一校对：连续重编号、按引用顺序生成 references、标记调研数据之外的 URL
+        report, citation_issues = reconcile_citations(report, url_list)
+
+        wall_s = time.perf_counter() - t0
+        self.last_stats = {
+            "skeleton_seconds": round(skeleton_s, 3),
+            "wall_seconds": round(wall_s, 3),
+            # 各章节串行执行所需时间之和，用于估计并行带来的加速
+            "sections_serial_seconds": round(serial_s, 3),
+            "speedup": round((skeleton_s + serial_s) / wall_s, 2) if wall_s else 1.0,
+            "attempts": attempts,
+            "failed_sections": errors,
+            "citations": citation_issues,
+        }
+        return report
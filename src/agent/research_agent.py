@@ -1,16 +1,42 @@
+from collections import OrderedDict
 from typing import List, Dict, Any
+import threading
+import time
+import uuid
 
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+from langchain_core.messages import SystemMessage, HumanMessage
 from langchain_openai import ChatOpenAI
 
 from .prompt import (
     SYSTEM_RESEARCH_BASE,
     PLAN_PROMPT,
+    PLAN_DELTA_PROMPT,
     SYNTHESIS_PROMPT,
-    CRITIQUE_PROMPT
+    SYNTHESIS_MAP_PROMPT,
+    SYNTHESIS_REDUCE_PROMPT,
+    CRITIQUE_PROMPT,
+    CRITIQUE_PATCH_PROMPT,
+    CRITIQUE_SECTIONS_PROMPT
 )
 from .memory import ConversationMemory
+from .tokens import count_tokens, token_mode
+from .context import ContextBuilder
+from .archive import open_archive
+from .deadline import Deadline, DeadlineExceeded, call_timeout, check_cancelled, run_with_deadline, map_with_deadline
 from .tools import MCPToolClient, WebSearchTool
+from .store import ContentStore, ReferenceRegistry
+from .singleflight import llm_flight, normalize_query, prompt_key
+from .scheduler import current, llm_scheduler, prioritized, queue_depth
+from .router import ModelRouter, StageConfig
+from .ledger import budget_level, ledger, price
+from . import cassette
+from .planner import SubquestionRegistry, choose_fanout
+from .dryrun import DryRunEstimator
+from .report import SectionedReportGenerator, parse_json_object
+from .citations import remap_markers
+from .patching import PatchReviser, apply_section_edits, markdown_outline, section_text
+from .profiling import TurnProfiler, profiled
+from .warmup import WarmUp
 from ..config.settings import settings
 
 class ResearchAgent:
@@ -18,7 +44,8 @@ class ResearchAgent:
     单用户多轮 Research Agent。
     使用 agents.yaml 的 research 配置来初始化模型，并从 MCP 的 agent_tools 映射中选取优先工具。
     """
-    def __init__(self, agent_key: str = "research"):
+    def __init__(self, agent_key: str = "research", session_id: str | None = None, user_id: str | None = None,
+                 warm_up: bool | None = None, priority: str = "interactive"):
         # 主 LLM（仍然使用配置文件里指定的 agent 配置）
         try:
             cfg = settings.get_agent_config(agent_key)
@@ -31,23 +58,70 @@ class ResearchAgent:
             )
         except Exception:
             # 回退到默认（若没有 agents.yaml 或配置不完整）
+            cfg = {}
             self.llm = ChatOpenAI(model=settings.__dict__.get("default_model", "gpt-4o-mini"))
 
+        # 分阶段模型路由：agents.yaml 的 stages 为 plan / synthesize / critique / summarize / continue 指定模型与参数，
+        # 非默认模型的客户端由 llm_factory 按需创建并缓存
+        self.router = ModelRouter(cfg)
+        self.llm_factory = lambda model: ChatOpenAI(
+            model=model,
+            api_key=cfg.get("api_key"),
+            base_url=cfg.get("base_url"),
+            temperature=cfg.get("temperature", 0.3),
+            max_tokens=cfg.get("max_tokens", 2048),
+        )
+        self._stage_llms: Dict[str, Any] = {}
+
+        # 用量记账：每次调用写入共享账本（ledger），本轮累计见 last_turn_usage；
+        # pricing 为 {模型: {input, output}}（每百万 token 价格），budget_level 为 0 正常 / 1 降级 / 2 拒绝
+        self.pricing: Dict[str, Any] = cfg.get("pricing") or {}
+        self.budget_level = 0
+        self.last_turn_usage: Dict[str, Any] = {}
+        self._usage_lock = threading.Lock()
+
         # 记忆管理
+        self.session_id = session_id or uuid.uuid4().hex[:12]
+        self.user_id = user_id
+        # 调度类别：交互会话为 interactive（质疑降为 critique）；批处理任务传 "batch"，其所有调用都让位于交互用户
+        self.priority = priority
         self.memory = ConversationMemory()
 
-        # 压缩记忆 LLM（可以与主模型相同）
+        # 长期记忆归档：按用户（若提供）或会话分文件，压缩淘汰的消息可被后续轮次召回
+        if settings.memory_archive_enabled:
+            try:
+                self.memory.archive = open_archive(f"user-{user_id}" if user_id else f"session-{self.session_id}")
+            except Exception as e:
+                print(f"⚠️  长期记忆归档不可用: {e}")
+
+        # 按 agent 配置的固定 token 预算组装 continue_dialog 的上下文
         try:
-            summary_model = cfg.get("memory_summary_model", cfg.get("model"))
-            self.memory.summarizer_llm = ChatOpenAI(
-                model=summary_model,
-                api_key=cfg.get("api_key"),
-                base_url=cfg.get("base_url"),
-                temperature=0.2,
-                max_tokens=1024
-            )
+            budget = int(cfg.get("context_budget_tokens", settings.context_budget_tokens))
         except Exception:
-            self.memory.summarizer_llm = None
+            budget = settings.context_budget_tokens
+        self.context_builder = ContextBuilder(budget)
+        self.last_context_stats: Dict[str, Any] = {}
+        self.last_synthesis_stats: Dict[str, Any] = {}
+
+        # 会话级内容寻址存储与参考文献登记表：搜索片段只存一份，引用编号跨轮次稳定
+        self.store = ContentStore()
+        self.references = ReferenceRegistry()
+        # 最近一轮的回答与搜索结果：增量质疑在此基础上修补回答、合并新搜索
+        self.last_answer = ""
+        self.last_search_data: List[Dict[str, Any]] = []
+        # 已回答子问题登记表：追问时复用等价子问题的搜索结果
+        self.subq_registry = SubquestionRegistry()
+        # dry_run 生成的计划：同一问题（及相同的已覆盖子问题）的下一次 ask 直接复用，按当时的子问题上限截取，不再调用规划
+        self._plan_cache: "OrderedDict[tuple, List[Dict[str, str]]]" = OrderedDict()
+
+        # 记忆压缩经 _invoke(stage="summarize")：与其他阶段一样走路由（延迟/错误回退、预算降级）、合并、排队与记账。
+        # 未配置 stages.summarize 时按 memory_summary_model（缺省为主模型）、max_tokens 1024 补一个阶段配置
+        if self.router.stage("summarize") is None:
+            self.router.stages["summarize"] = StageConfig(
+                stage="summarize", model=str(cfg.get("memory_summary_model") or self.router.default_model),
+                max_tokens=1024,
+            )
+        self.memory.summarizer = lambda prompt: self._invoke([HumanMessage(content=prompt)], stage="summarize")
 
         # 工具初始化：从 MCP 配置中读取 agent_tools 映射作为 preferred list
         self.tools: Dict[str, Any] = {}
@@ -91,103 +165,692 @@ class ResearchAgent:
 
         self.system_message = SystemMessage(content=SYSTEM_RESEARCH_BASE)
 
-    def _plan(self, query: str) -> List[Dict[str, str]]:
-        plan_prompt = PLAN_PROMPT.format(
-            query=query,
-            max_subquestions=getattr(settings, "max_subquestions", 5)
-        )
-        response = self.llm.invoke([self.system_message, HumanMessage(content=plan_prompt)])
+        # 逐轮内存剖析（settings.debug 且 settings.profile_memory 时生效）
+        self.profiler = TurnProfiler()
+
+        # 后台预热：用户输入第一个问题期间加载编码器、建立连接、执行 MCP initialize
+        self.warmup = WarmUp(self._warmup_steps())
+        if settings.warmup_enabled if warm_up is None else warm_up:
+            self.warmup.start()
+
+    def _warmup_steps(self) -> List[Any]:
+        steps: List[Any] = [
+            ("tiktoken", lambda: count_tokens("warm up", "exact")),
+            ("langchain", self._warm_imports),
+        ]
+        search_tool = self.tools.get("web_search")
+        if search_tool is not None:
+            names = [search_tool._choose_tool_name(), *search_tool.preferred]
+            for name in dict.fromkeys(n for n in names if n in search_tool.client.tools):
+                steps.append((f"mcp:{name}", lambda n=name: self._warm_mcp(search_tool.client, n)))
+        steps.append(("llm_connect", self._warm_llm_connection))
+        if settings.warmup_probe:
+            steps.append(("llm_probe", lambda: self._invoke([HumanMessage(content="ping")], max_tokens=1)))
+        return steps
+
+    @staticmethod
+    def _warm_imports():
+        # 记忆压缩路径上延迟导入的模块
+        from langchain_core.prompts import PromptTemplate  # noqa: F401
+
+    @staticmethod
+    def _warm_mcp(client: Any, name: str):
+        timings = client.warm_up(name, initialize=settings.warmup_mcp_initialize)
+        if timings.get("error"):
+            raise RuntimeError(timings["error"])
+
+    def _warm_llm_connection(self):
+        # 通过一次轻量的 /models 请求建立到推理端点的 TLS 连接（进入 openai 客户端的连接池）
+        client = getattr(self.llm, "root_client", None)
+        if client is None:
+            return
+        client.with_options(timeout=10, max_retries=0).models.list()
+
+    def _llm_for(self, model: str) -> Any:
+        """阶段路由选中的模型对应的客户端；默认模型直接使用 self.llm。"""
+        if not model or model == self.router.default_model:
+            return self.llm
+        llm = self._stage_llms.get(model)
+        if llm is None:
+            llm = self._stage_llms[model] = self.llm_factory(model)
+        return llm
+
+    def _invoke(self, messages: List[Any], max_tokens: int | None = None, timeout: float | None = None,
+                stage: str | None = None) -> Any:
+        """
+        所有 LLM 调用的统一入口。相同模型、相同提示词（及 max_tokens）、相同优先级类别的并发请求经 llm_flight
+        合并为一次调用，实际发出的调用经 llm_scheduler 按当前会话与优先级类别排队（排队最长等待 timeout 秒）。
+        合并到其他会话调用上的请求同样按结果的用量记入本会话（ledger 中标记为 shared），预算照常生效。
+        stage 指定阶段时由 self.router 选择模型，并与阶段配置的 max_tokens / timeout 取较小值。
+        在有截止时刻的任务中（run_with_deadline / map_with_deadline）timeout 还会收窄到任务的剩余时间，
+        任务被放弃后排队中的调用不再发出；已发出的调用无法中途取消，最多持续到该超时。
+        """
+        cfg = self.router.stage(stage)
+        model = self.router.choose(stage, downgrade=self.budget_level > 0)
+        if cfg is not None:
+            max_tokens = min(v for v in (max_tokens, cfg.max_tokens) if v) if (max_tokens or cfg.max_tokens) else None
+            timeout = min(v for v in (timeout, cfg.timeout) if v) if (timeout or cfg.timeout) else None
+            if settings.debug and model != cfg.model:
+                if self.budget_level > 0 and model == self.router.budget_model:
+                    print(f"🔀 接近用量预算，阶段 {stage} 改用 {model}")
+                else:
+                    print(f"🔀 阶段 {stage} 的主模型 {cfg.model} 延迟或错误率超标，改用 {model}")
+        timeout = call_timeout(timeout)
+        base = self._llm_for(model)
+        llm = base
+        overrides = {k: v for k, v in (("max_tokens", max_tokens), ("timeout", timeout)) if v}
+        if overrides:
+            llm = llm.bind(**overrides)
+        model_name = self._model_name(base)
+        key = prompt_key(model_name, messages, max_tokens=max_tokens)
+
+        def call():
+            check_cancelled()
+            t0 = time.perf_counter()
+            tape = cassette.active()
+            try:
+                if tape is None:
+                    result = llm.invoke(messages)
+                else:
+                    # 录制时以流式调用记录首块耗时；回放时直接返回录制的响应
+                    stream = (lambda: llm.stream(messages, stream_usage=True)) if isinstance(base, ChatOpenAI) else None
+                    result = tape.llm(key, lambda: llm.invoke(messages), stream)
+            except Exception:
+                self.router.record(stage, model, time.perf_counter() - t0, ok=False)
+                self._record_usage(stage, model_name, messages, None, time.perf_counter() - t0, ok=False)
+                raise
+            self.router.record(stage, model, time.perf_counter() - t0, ok=True)
+            self._record_usage(stage, model_name, messages, result, time.perf_counter() - t0)
+            return result
+
+        def shared(result):
+            self._record_usage(stage, model_name, messages, result, time.perf_counter() - t_wait, shared=True)
+
+        t_wait = time.perf_counter()
+        # 类别计入合并键：交互请求不会跟在批处理请求后面按批处理的优先级排队；
+        # 跟随方最多等待发起方的排队与调用各 timeout 秒
+        return llm_flight.do((key, current()[0]), lambda: llm_scheduler.run(call, timeout=timeout),
+                             timeout=2 * timeout if timeout else None, on_shared=shared)
+
+    @staticmethod
+    def _model_name(llm: Any) -> str:
+        return str(getattr(llm, "model_name", "") or getattr(llm, "model", ""))
+
+    def _record_usage(self, stage: str | None, model: str, messages: List[Any], response: Any,
+                      latency_s: float, ok: bool = True, shared: bool = False):
+        """
+        记录一次调用的用量：优先使用响应的 usage_metadata，缺失时按 token_count_modes["usage"] 估算；失败的调用记为 0 token。
+        shared 表示结果来自其他会话发起的合并调用（见 _invoke）。
+        """
+        usage = getattr(response, "usage_metadata", None) or {}
+        estimated = ok and not usage
+        if not ok:
+            input_tokens = output_tokens = 0
+        elif usage:
+            input_tokens, output_tokens = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+        else:
+            mode = token_mode("usage")
+            input_tokens = sum(count_tokens(str(getattr(m, "content", m)), mode) for m in messages)
+            output_tokens = count_tokens(str(getattr(response, "content", response)), mode)
+        cost = price(self.pricing, model, input_tokens, output_tokens)
+        with self._usage_lock:
+            turn = self.last_turn_usage
+            turn["calls"] = turn.get("calls", 0) + 1
+            turn["input_tokens"] = turn.get("input_tokens", 0) + input_tokens
+            turn["output_tokens"] = turn.get("output_tokens", 0) + output_tokens
+            turn["cost"] = turn.get("cost", 0.0) + cost
+            turn["estimated"] = turn.get("estimated", False) or estimated
+        book = ledger()
+        if book is not None:
+            try:
+                book.record(self.session_id, self.user_id, stage, model, input_tokens, output_tokens,
+                            latency_s, ok=ok, estimated=estimated, cost=cost, shared=shared)
+            except Exception as e:
+                print(f"⚠️  用量记账失败: {e}")
+
+    def _begin_turn(self) -> int:
+        """新一轮开始：清零本轮用量，并按账本中的累计用量确定预算等级。"""
+        with self._usage_lock:
+            self.last_turn_usage = {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cost": 0.0, "estimated": False}
+        self.budget_level = self._budget_level()
+        return self.budget_level
+
+    def _budget_level(self) -> int:
+        """按账本中的累计用量计算预算等级（0 正常 / 1 降级 / 2 拒绝），不修改本轮状态。"""
+        book = ledger()
+        return 0 if book is None else budget_level(book, self.session_id, self.user_id)
+
+    @staticmethod
+    def _budget_refusal() -> str:
+        return "⛔ 已用完 token 预算，本轮未调用模型。请稍后再试或联系管理员调整预算。"
+
+    def usage_line(self) -> str:
+        """本轮与会话累计用量的一行摘要（供 CLI 打印）。"""
+        u = self.last_turn_usage or {}
+        line = (f"🧾 本轮用量: {u.get('calls', 0)} 次模型调用，输入 {u.get('input_tokens', 0)} / "
+                f"输出 {u.get('output_tokens', 0)} tokens")
+        if u.get("cost"):
+            line += f"，费用 {u['cost']:.4f}"
+        book = ledger()
+        if book is not None:
+            total = book.totals(session=self.session_id)
+            line += f"；会话累计 {total['total_tokens']} tokens"
+            if settings.budget_session_tokens:
+                line += f"（预算 {settings.budget_session_tokens}）"
+        if u.get("estimated"):
+            line += "（部分为估算）"
+        if self.budget_level == 1:
+            line += "；⚠️ 接近预算，已降级"
+        return line
+
+    def _plan(self, query: str, timeout: float | None = None,
+              max_subquestions: int | None = None, covered: List[str] | None = None) -> List[Dict[str, str]]:
+        max_subquestions = max_subquestions or getattr(settings, "max_subquestions", 5)
+        if covered:
+            # 追问：告诉规划器已覆盖的子问题，只为新的信息需求生成子问题
+            plan_prompt = PLAN_DELTA_PROMPT.format(
+                query=query,
+                covered="\n".join(f"- {c}" for c in covered),
+                max_subquestions=max_subquestions
+            )
+        else:
+            plan_prompt = PLAN_PROMPT.format(
+                query=query,
+                max_subquestions=max_subquestions
+            )
+        response = self._invoke([self.system_message, HumanMessage(content=plan_prompt)], timeout=timeout, stage="plan")
         text = response.content.strip()
         try:
             import json
             data = json.loads(text)
             if isinstance(data, list):
-                return data[: getattr(settings, "max_subquestions", 5)]
+                return data[:max_subquestions]
         except Exception:
             return [{"subq": query, "reason": "原始问题（JSON解析失败回退）"}]
         return [{"subq": query, "reason": "原始问题（未识别结构）"}]
 
-    def _search(self, subquestions: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+    def _search_one(self, sq: Dict[str, str], timeout: float | None = None,
+                    max_results: int | None = None) -> Dict[str, Any]:
+        search_tool = self.tools.get("web_search")
+        query = sq["subq"]
+        chosen_tool = None
+        try:
+            # 在此处可以打印实际选用的 MCP 工具名，便于调试
+            if hasattr(search_tool, "_choose_tool_name"):
+                chosen_tool = search_tool._choose_tool_name()
+                print(f"Using MCP tool '{chosen_tool}' for query: {query}")
+            results = search_tool.search(query, timeout=timeout)
+            # 检查返回结果格式
+            if results is None:
+                results = []
+                err = "MCP 返回 None"
+            elif not isinstance(results, list):
+                results = []
+                err = f"MCP 返回格式错误: 期望 list，实际 {type(results).__name__}"
+            elif len(results) == 0:
+                err = "MCP 返回空结果列表"
+            else:
+                err = ""
+                results = self._compact_results(results[:max_results] if max_results else results)
+                print(f"  ✅ 获取到 {len(results)} 条结果")
+        except Exception as e:
+            results = []
+            err = f"MCP 调用异常: {str(e)}"
+            print(f"  ❌ MCP 调用失败: {err}")
+
+        return {
+            "subq": query,
+            "reason": sq.get("reason", ""),
+            "results": results or [],
+            "error": err,
+            "mcp_tool_used": chosen_tool  # 记录使用的 MCP 工具
+        }
+
+    def _search(self, subquestions: List[Dict[str, str]], deadline: Deadline | None = None,
+                cut: Dict[str, Any] | None = None, max_results: int | None = None) -> List[Dict[str, Any]]:
+        """
+        并发执行各子问题的搜索（并发度 settings.search_concurrency）。
+        deadline 到期或 Ctrl-C 时，未完成的子问题记为已取消，并在 cut 中记录被截断的部分。
+        """
         search_tool = self.tools.get("web_search")
         if not search_tool:
             return [{"subq": sq["subq"], "results": [], "error": "搜索工具未启用"} for sq in subquestions]
 
+        deadline = deadline or Deadline(None)
+        timeout = None if deadline.budget_s is None else deadline.timeout(settings.search_timeout_s)
+        done, unfinished, interrupted = map_with_deadline(
+            lambda sq: self._search_one(sq, timeout=timeout, max_results=max_results), subquestions, deadline
+        )
+
         aggregated = []
-        for sq in subquestions:
-            query = sq["subq"]
-            chosen_tool = None
-            try:
-                # 在此处可以打印实际选用的 MCP 工具名，便于调试
-                if hasattr(search_tool, "_choose_tool_name"):
-                    chosen_tool = search_tool._choose_tool_name()
-                    print(f"Using MCP tool '{chosen_tool}' for query: {query}")
-                results = search_tool.run(query)
-                # 检查返回结果格式
-                if results is None:
-                    results = []
-                    err = "MCP 返回 None"
-                elif not isinstance(results, list):
-                    results = []
-                    err = f"MCP 返回格式错误: 期望 list，实际 {type(results).__name__}"
-                elif len(results) == 0:
-                    err = "MCP 返回空结果列表"
-                else:
-                    err = ""
-                    print(f"  ✅ 获取到 {len(results)} 条结果")
-            except Exception as e:
-                results = []
-                err = f"MCP 调用异常: {str(e)}"
-                print(f"  ❌ MCP 调用失败: {err}")
-            
+        for idx, sq in enumerate(subquestions):
+            block = done.get(idx)
+            if isinstance(block, dict):
+                aggregated.append(block)
+                continue
+            reason = "用户中断" if interrupted else "超过时间预算，已取消"
+            if isinstance(block, Exception):
+                reason = f"MCP 调用异常: {block}"
             aggregated.append({
-                "subq": query,
-                "reason": sq.get("reason", ""),
-                "results": results or [],
-                "error": err,
-                "mcp_tool_used": chosen_tool  # 记录使用的 MCP 工具
+                "subq": sq["subq"], "reason": sq.get("reason", ""),
+                "results": [], "error": reason, "mcp_tool_used": None,
             })
+        if cut is not None and unfinished:
+            cut["search"] = [subquestions[i]["subq"] for i in unfinished]
+        if cut is not None and interrupted:
+            cut["interrupted"] = True
         return aggregated
 
-    def _synthesize(self, query: str, search_data: List[Dict[str, Any]]) -> str:
+    def _is_followup(self) -> bool:
+        """本会话之前是否已有回答（用于判断当前问题是否为追问）。"""
+        return bool(self.memory.compressed_context) or any(m.role == "assistant" for m in self.memory.messages)
+
+    @staticmethod
+    def _queue_depth() -> int:
+        """进程内排队中与在途的外部调用数（见 scheduler），作为当前负载的近似。"""
+        return queue_depth()
+
+    def _recall(self, query: str) -> str:
+        """从长期记忆归档中取回与 query 相关的少量片段（无归档或无命中时返回空串）。"""
+        archive = self.memory.archive
+        if archive is None or not len(archive):
+            return ""
+        try:
+            return archive.render(query)
+        except Exception:
+            return ""
+
+    def _recall_messages(self, query: str) -> List[SystemMessage]:
+        recalled = self._recall(query)
+        return [SystemMessage(content=f"[ARCHIVED_MEMORY]\n{recalled}")] if recalled else []
+
+    def _compact_results(self, results: List[Any]) -> List[Dict[str, Any]]:
+        """
+        把 MCP 原始结果压缩为句柄形式：正文进入 self.store，URL 在 self.references 中登记引用编号。
+        返回的每条结果只保留 title/url/ref/snippet_ref，正文用 self.store.get(snippet_ref) 取回。
+        """
+        compact = []
+        for r in results:
+            if not isinstance(r, dict):
+                r = {"snippet": str(r)}
+            text = r.get("snippet") or r.get("content") or r.get("text") or ""
+            handle = self.store.put(str(text))
+            title = str(r.get("title", "") or "")
+            url = str(r.get("url", "") or "")
+            ref = self.references.register(url or f"content:{handle}", title)
+            compact.append({"title": title, "url": url, "ref": ref, "snippet_ref": handle})
+        return compact
+
+    def snippet(self, result: Dict[str, Any]) -> str:
+        """取回单条结果的正文（兼容未压缩的原始结果）。"""
+        if "snippet_ref" in result:
+            return self.store.get(result["snippet_ref"])
+        return str(result.get("snippet", ""))
+
+    def _snippet_lines(self, search_data: List[Dict[str, Any]]) -> List[str]:
         snippets_lines = []
-        idx = 1
         for block in search_data:
             results = block.get("results", [])
             if not results:
-                snippets_lines.append(f"[{idx}] (无结果) {block['subq']}")
-                idx += 1
+                snippets_lines.append(f"[-] (无结果) {block['subq']}")
                 continue
             for r in results:
-                line = f"[{idx}] {r.get('title','(无标题)')} | {r.get('snippet','')} | {r.get('url','')}"
+                # 引用编号来自会话级登记表，同一 URL 在各轮次中编号一致
+                line = f"[{r.get('ref', '-')}] {r.get('title') or '(无标题)'} | {self.snippet(r)} | {r.get('url','')}"
                 snippets_lines.append(line)
-                idx += 1
+        return snippets_lines
+
+    def _synthesize(self, query: str, search_data: List[Dict[str, Any]],
+                    max_tokens: int | None = None, timeout: float | None = None) -> str:
+        snippets_lines = self._snippet_lines(search_data)
+        packed = "\n".join(snippets_lines)
+
+        # 片段过多时一次性综合既慢（预填充随输入增长）又可能超出上下文窗口，改为分治综合
+        threshold = settings.synthesis_map_reduce_tokens
+        blocks = [b for b in search_data if b.get("results")]
+        if threshold and len(blocks) > 1:
+            packed_tokens = count_tokens(packed, token_mode("synthesis"))
+            if packed_tokens > threshold:
+                return self._synthesize_map_reduce(query, blocks, packed_tokens, max_tokens, timeout)
+        self.last_synthesis_stats = {"mode": "single", "blocks": len(blocks)}
 
         synth_prompt = SYNTHESIS_PROMPT.format(
             query=query,
-            snippets="\n".join(snippets_lines) if snippets_lines else "(无搜索数据)"
+            snippets=packed if snippets_lines else "(无搜索数据)"
         )
 
-        response = self.llm.invoke([self.system_message, HumanMessage(content=synth_prompt)])
+        response = self._invoke(
+            [self.system_message, *self._recall_messages(query), HumanMessage(content=synth_prompt)],
+            max_tokens=max_tokens, timeout=timeout, stage="synthesize",
+        )
         return response.content
 
-    def ask(self, query: str) -> Dict[str, Any]:
+    def _synthesize_map_reduce(self, query: str, blocks: List[Dict[str, Any]], packed_tokens: int,
+                               max_tokens: int | None = None, timeout: float | None = None) -> str:
+        """
+        分治综合：每个子问题的结果块并发做局部综合（map），再把各局部要点合并为完整回答（reduce）。
+        map 阶段片段使用块内局部编号 [1..k]，输出后在本地映射回会话级引用编号；
+        reduce 输出中不属于本轮资料的编号会被删除。map 阶段最多占用 timeout 的 60%，未完成的块以原始片段代替。
+        """
+        t0 = time.perf_counter()
+
+        def map_one(block: Dict[str, Any]) -> str:
+            local: Dict[int, int] = {}
+            lines = []
+            for i, r in enumerate(block["results"], 1):
+                if isinstance(r.get("ref"), int):
+                    local[i] = r["ref"]
+                lines.append(f"[{i}] {r.get('title') or '(无标题)'} | {self.snippet(r)} | {r.get('url', '')}")
+            prompt = SYNTHESIS_MAP_PROMPT.format(query=query, subq=block.get("subq", ""), snippets="\n".join(lines))
+            text = self._invoke([self.system_message, HumanMessage(content=prompt)],
+                                max_tokens=settings.synthesis_map_max_tokens, timeout=timeout,
+                                stage="synthesize").content
+            return remap_markers(text, local, keep_unknown=False)
+
+        done, unfinished, interrupted = map_with_deadline(map_one, blocks, Deadline(timeout * 0.6 if timeout else None))
+        if interrupted:
+            raise KeyboardInterrupt
+        partials = []
+        failed = 0
+        for idx, block in enumerate(blocks):
+            part = done.get(idx)
+            if not isinstance(part, str):
+                # 局部综合失败或超时：退回该块的原始片段
+                failed += 1
+                part = "\n".join(self._snippet_lines([block]))
+            partials.append(f"### {block.get('subq', '')}\n{part.strip()}")
+        map_s = time.perf_counter() - t0
+
+        reduce_prompt = SYNTHESIS_REDUCE_PROMPT.format(query=query, partials="\n\n".join(partials))
+        response = self._invoke(
+            [self.system_message, *self._recall_messages(query), HumanMessage(content=reduce_prompt)],
+            max_tokens=max_tokens, timeout=timeout, stage="synthesize",
+        )
+        known = {r["ref"]: r["ref"] for b in blocks for r in b["results"] if isinstance(r.get("ref"), int)}
+        answer = remap_markers(response.content, known, keep_unknown=False)
+
+        self.last_synthesis_stats = {
+            "mode": "map_reduce",
+            "blocks": len(blocks),
+            "packed_tokens": packed_tokens,
+            "reduce_tokens": count_tokens(reduce_prompt),
+            "failed_blocks": failed,
+            "map_seconds": round(map_s, 3),
+            "reduce_seconds": round(time.perf_counter() - t0 - map_s, 3),
+        }
+        if settings.debug:
+            s = self.last_synthesis_stats
+            print(f"🧩 分治综合: {s['blocks']} 个子问题，片段 {packed_tokens} → 合并输入 {s['reduce_tokens']} tokens，"
+                  f"map {s['map_seconds']}s + reduce {s['reduce_seconds']}s")
+        return answer
+
+    def _fallback_answer(self, query: str, search_data: List[Dict[str, Any]], why: str) -> str:
+        """综合阶段未能完成时，直接用已到达的搜索结果给出本地拼装的部分答案。"""
+        lines = [f"⚠️ {why}，以下为已获取到的资料（未经模型综合）：", "", f"## {query}"]
+        for block in search_data:
+            for r in block.get("results", []):
+                lines.append(f"- [{r.get('ref', '-')}] {r.get('title') or '(无标题)'}: "
+                             f"{self.snippet(r)[:200]} {r.get('url', '')}")
+        if len(lines) == 3:
+            lines.append("(暂无可用资料)")
+        return "\n".join(lines)
+
+    def build_research_data(self, search_data: List[Dict[str, Any]]) -> str:
+        """
+        生成 RESEARCH_PROMPT 的 {research_data}：开头是本次用到的带编号 URL 列表，
+        随后按子问题列出片段，片段以 [n] 引用编号指向该列表，不再重复嵌入 URL。
+        """
+        numbers = [r["ref"] for b in search_data for r in b.get("results", []) if "ref" in r]
+        lines = ["参考文献URL列表：", self.references.render(numbers) or "(无)", ""]
+        for block in search_data:
+            lines.append(f"## {block.get('subq', '')}")
+            for r in block.get("results", []):
+                lines.append(f"[{r.get('ref', '-')}] {r.get('title') or '(无标题)'}: {self.snippet(r)}")
+            lines.append("")
+        return "\n".join(lines)
+
+    def url_list(self, search_data: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+        """search_data 中出现过的带编号 URL（即 build_research_data 开头列出的那些）。"""
+        numbers = [r["ref"] for b in search_data for r in b.get("results", []) if "ref" in r]
+        return {
+            e["n"]: e for e in self.references.entries(numbers)
+            if e["url"].lower().startswith(("http://", "https://"))
+        }
+
+    @prioritized("interactive")
+    def generate_report(self, requirement: str, search_data: List[Dict[str, Any]],
+                        previous_plan: str = "", instruction: str = "") -> Dict[str, Any]:
+        """
+        基于调研结果生成 RESEARCH_PROMPT 格式的技术方案：骨架先行，各章节并发生成、失败章节单独重试，
+        最后在本地组装 JSON。生成统计见 self.last_report_stats。
+        """
+        generator = SectionedReportGenerator(
+            lambda msgs, max_tokens: self._invoke([self.system_message, *msgs], max_tokens=max_tokens).content
+        )
+        report = generator.generate(
+            requirement, self.build_research_data(search_data),
+            previous_plan=previous_plan, instruction=instruction, url_list=self.url_list(search_data),
+        )
+        self.last_report_stats = generator.last_stats
+        return report
+
+    @prioritized("critique")
+    def revise_report(self, requirement: str, previous_plan: Dict[str, Any] | str, feedback: str,
+                      search_data: List[Dict[str, Any]] | None = None) -> Dict[str, Any]:
+        """
+        按反馈增量修订已有技术方案：只发送大纲和涉及的章节，模型返回 JSON Patch 并在本地应用。
+        search_data 为可选的补充调研结果。补丁无法应用时回退到整份重新生成。
+        """
+        plan = parse_json_object(previous_plan) if isinstance(previous_plan, str) else previous_plan
+        if plan:
+            reviser = PatchReviser(
+                lambda msgs, max_tokens: self._invoke([self.system_message, *msgs], max_tokens=max_tokens).content
+            )
+            try:
+                report = reviser.revise(
+                    requirement, plan, feedback,
+                    research_data=self.build_research_data(search_data) if search_data else "",
+                    url_list=self.url_list(search_data) if search_data else None,
+                    registry=self.references,
+                )
+                self.last_report_stats = reviser.last_stats
+                return report
+            except ValueError as e:
+                print(f"⚠️  增量修订失败（{e}），改为整份重新生成")
+        import json
+        previous_text = previous_plan if isinstance(previous_plan, str) else json.dumps(previous_plan, ensure_ascii=False)
+        return self.generate_report(requirement, search_data or [], previous_plan=previous_text, instruction=feedback)
+
+    def _budget_subquestions(self, planned: int | None) -> int | None:
+        """接近预算时子问题数减半。"""
+        if not self.budget_level:
+            return planned
+        return max(1, (planned or getattr(settings, "max_subquestions", 5)) // 2)
+
+    @profiled("ask")
+    @prioritized("interactive")
+    def ask(self, query: str, budget_s: float | None = None) -> Dict[str, Any]:
+        """
+        单轮研究。budget_s（默认 settings.turn_budget_s）是整轮的时间预算，逐级传给 plan / search / synthesis：
+        时间紧张时减少子问题、缩短生成长度；到期时取消未完成的调用，并用已到达的结果完成综合。
+        返回值中的 cut 字段标明哪些部分被截断（为空表示完整执行）。
+        """
+        self.warmup.mark_first_query()
+        if self._begin_turn() >= 2:
+            return {"plan": [], "search_raw": [], "answer_markdown": self._budget_refusal(),
+                    "cut": {"budget": "refused"}, "elapsed_s": 0.0, "fanout": None}
+        deadline = Deadline(budget_s if budget_s is not None else settings.turn_budget_s)
+        cut: Dict[str, Any] = {}
+        if self.budget_level:
+            cut["budget"] = "downgraded"
+
+        # 自适应扇出：按问题复杂度、当前负载和剩余预算决定子问题数与每个子问题的结果数
+        fanout = None
+        if settings.planner_mode == "adaptive":
+            fanout = choose_fanout(query, is_followup=self._is_followup(), queue_depth=self._queue_depth(),
+                                   remaining_s=deadline.remaining())
+            if settings.debug:
+                print(f"🧭 自适应规划: {fanout.subquestions} 个子问题 × {fanout.results_per_subq} 条结果（{fanout.reason}）")
         self.memory.add("user", query)
-        plan = self._plan(query)
-        search_data = self._search(plan)
-        answer_markdown = self._synthesize(query, search_data)
+
+        try:
+            if fanout is not None and fanout.skip_plan:
+                plan = [{"subq": query, "reason": "原始问题（简单查询，跳过规划）"}]
+            else:
+                max_subquestions = self._budget_subquestions(fanout.subquestions if fanout else None)
+                covered = self.subq_registry.covered() if settings.delta_planning else None
+                cached = self._plan_cache.pop(self._plan_key(query, covered), None)
+                if cached is not None:
+                    plan = cached[:max_subquestions] if max_subquestions else cached
+                else:
+                    plan = run_with_deadline(
+                        self._plan, deadline, query,
+                        timeout=None if deadline.budget_s is None else deadline.timeout(deadline.remaining()),
+                        max_subquestions=max_subquestions, covered=covered,
+                    )
+        except DeadlineExceeded:
+            plan = [{"subq": query, "reason": "原始问题（规划超时回退）"}]
+            cut["plan"] = True
+        except KeyboardInterrupt:
+            plan = [{"subq": query, "reason": "原始问题（规划被中断）"}]
+            cut["plan"] = True
+            cut["interrupted"] = True
+
+        search_data: List[Dict[str, Any]] = []
+        if not cut.get("interrupted"):
+            # 增量规划：与已回答子问题等价的直接复用旧结果，只搜索新的子问题
+            reused: Dict[int, Dict[str, Any]] = {}
+            pending = plan
+            if settings.delta_planning:
+                reused, fresh = self.subq_registry.split(plan)
+                pending = [plan[i] for i in fresh]
+                if reused and settings.debug:
+                    print(f"♻️  复用 {len(reused)} 个已检索子问题，新搜索 {len(pending)} 个")
+            if deadline.pressure() >= 1 and len(pending) > 1:
+                keep = max(1, len(pending) // 2)
+                cut["subquestions"] = [sq.get("subq") for sq in pending[keep:]]
+                pending = pending[:keep]
+            max_results = fanout.results_per_subq if fanout else None
+            if self.budget_level:
+                max_results = min(max_results or settings.budget_downgrade_results, settings.budget_downgrade_results)
+            fresh_data = self._search(pending, deadline, cut, max_results=max_results) if pending else []
+            if settings.delta_planning:
+                self.subq_registry.record(fresh_data)
+            plan = [plan[i] for i in sorted(reused)] + pending
+            search_data = [reused[i] for i in sorted(reused)] + fresh_data
+
+        if cut.get("interrupted"):
+            answer_markdown = self._fallback_answer(query, search_data, "本轮已被用户中断")
+        else:
+            level = deadline.pressure()
+            max_tokens = None
+            if level >= 2:
+                max_tokens = settings.degraded_max_tokens // (2 if level >= 3 else 1)
+                cut["max_tokens"] = max_tokens
+            try:
+                answer_markdown = run_with_deadline(
+                    self._synthesize, deadline, query, search_data,
+                    max_tokens=max_tokens,
+                    timeout=None if deadline.budget_s is None else max(deadline.remaining(), settings.synthesis_grace_s),
+                    min_timeout=settings.synthesis_grace_s,
+                )
+            except DeadlineExceeded:
+                cut["synthesis"] = True
+                answer_markdown = self._fallback_answer(query, search_data, "综合阶段超过时间预算")
+            except KeyboardInterrupt:
+                cut["synthesis"] = True
+                cut["interrupted"] = True
+                answer_markdown = self._fallback_answer(query, search_data, "综合阶段被用户中断")
+
         self.memory.add("assistant", answer_markdown)
-        self.memory.maybe_compress()
+        self.last_answer, self.last_search_data = answer_markdown, search_data
+        if not cut.get("interrupted"):
+            self.memory.maybe_compress(background=settings.memory_compress_background)
 
         return {
             "plan": plan,
             "search_raw": search_data,
-            "answer_markdown": answer_markdown
+            "answer_markdown": answer_markdown,
+            "cut": cut,
+            "elapsed_s": round(deadline.elapsed(), 2),
+            "fanout": fanout.to_dict() if fanout else None,
         }
 
+    @staticmethod
+    def _plan_key(query: str, covered: List[str] | None) -> tuple:
+        # 不含子问题上限：上限随负载与剩余预算变化，dry_run 按不受负载影响的上限规划，ask 复用时再截取
+        return normalize_query(query), tuple(covered or ())
+
+    @prioritized("interactive")
+    def dry_run(self, query: str, report: bool = False, plan: List[Dict[str, str]] | None = None) -> Dict[str, Any]:
+        """
+        预估 ask(query)（report=True 时再加 generate_report）的 token、MCP 调用次数、费用与耗时。
+        只执行规划（可传入 plan 或命中之前 dry_run 缓存的计划时跳过），生成的计划缓存给随后的 ask 复用；
+        检查哪些子问题会复用已有搜索结果，其余按历史数据估算；不发出搜索、综合与生成调用，不改变对话记忆与子问题登记表。
+        与 ask 一样按账本开始新一轮：预算用完时拒绝，不发出规划调用。
+        """
+        if self._begin_turn() >= 2:
+            return {"query": query, "refused": True, "budget_level": self.budget_level,
+                    "message": self._budget_refusal()}
+        fanout = planned = None
+        if settings.planner_mode == "adaptive":
+            followup = self._is_followup()
+            remaining = settings.turn_budget_s or float("inf")
+            fanout = choose_fanout(query, is_followup=followup, queue_depth=self._queue_depth(), remaining_s=remaining)
+            # 缓存给 ask 的计划按空闲时的上限规划，ask 执行时再按当时的负载截取
+            planned = choose_fanout(query, is_followup=followup, queue_depth=0, remaining_s=remaining)
+        plan_spent = None
+        if plan is not None:
+            source = "given"
+        elif fanout is not None and fanout.skip_plan:
+            plan, source = [{"subq": query, "reason": "原始问题（简单查询，跳过规划）"}], "skipped"
+        else:
+            max_subquestions = self._budget_subquestions(fanout.subquestions if fanout else None)
+            covered = self.subq_registry.covered() if settings.delta_planning else None
+            key = self._plan_key(query, covered)
+            plan, source = self._plan_cache.get(key), "cache"
+            if plan is None:
+                before = dict(self.last_turn_usage)
+                t0 = time.perf_counter()
+                plan = self._plan(query, max_subquestions=planned.subquestions if planned else None, covered=covered)
+                source = "llm"
+                plan_spent = {k: self.last_turn_usage.get(k, 0) - before.get(k, 0)
+                              for k in ("input_tokens", "output_tokens", "cost")}
+                plan_spent["seconds"] = time.perf_counter() - t0
+                self._plan_cache[key] = plan
+                while len(self._plan_cache) > settings.dry_run_plan_cache_size:
+                    self._plan_cache.popitem(last=False)
+            if max_subquestions:
+                plan = plan[:max_subquestions]
+
+        reused: Dict[int, Dict[str, Any]] = {}
+        pending = plan
+        if settings.delta_planning:
+            reused, fresh = self.subq_registry.split(plan, touch=False)
+            pending = [plan[i] for i in fresh]
+        max_results = fanout.results_per_subq if fanout else None
+        if self.budget_level:
+            max_results = min(max_results or settings.budget_downgrade_results, settings.budget_downgrade_results)
+        estimate = DryRunEstimator(self).estimate(query, plan, reused, pending, max_results=max_results,
+                                                  report=report, plan_spent=plan_spent, plan_source=source)
+        estimate["budget_level"] = self.budget_level
+        return estimate
+
+    @profiled("critique")
+    @prioritized("critique")
     def critique(self, feedback: str) -> Dict[str, Any]:
+        self.warmup.mark_first_query()
+        if self._begin_turn() >= 2:
+            return {"critique_result": {"need_new_search": False, "new_subquestions": [],
+                                        "improved_answer": self._budget_refusal()}, "new_search_raw": []}
         self.memory.add("user", feedback)
+        if settings.critique_mode == "patch" and self.last_answer:
+            return self._critique_patch(feedback)
         critique_prompt = CRITIQUE_PROMPT.format(feedback=feedback)
-        response = self.llm.invoke([self.system_message, HumanMessage(content=critique_prompt)])
+        response = self._invoke(
+            [self.system_message, *self._recall_messages(feedback), HumanMessage(content=critique_prompt)],
+            stage="critique",
+        )
         txt = response.content.strip()
         try:
             import json
@@ -202,20 +865,101 @@ class ResearchAgent:
         if data.get("need_new_search") and data.get("new_subquestions"):
             subqs = [{"subq": q, "reason": "用户质疑后新增"} for q in data["new_subquestions"]]
             search_data = self._search(subqs)
+            if settings.delta_planning:
+                self.subq_registry.record(search_data)
             improved_full = self._synthesize(data["new_subquestions"][0], search_data)
             data["improved_answer"] += "\n\n## 新增补充搜索综合\n" + improved_full
         else:
             search_data = []
 
         self.memory.add("assistant", data["improved_answer"])
-        self.memory.maybe_compress()
+        self.last_answer = data["improved_answer"]
+        self.last_search_data = self._merge_search_data(self.last_search_data, search_data)
+        self.memory.maybe_compress(background=settings.memory_compress_background)
 
         return {
             "critique_result": data,
             "new_search_raw": search_data
         }
 
+    @staticmethod
+    def _merge_search_data(previous: List[Dict[str, Any]], new: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """合并新搜索与保留的结果：同一子问题以新结果为准，同一引用编号只保留首次出现。"""
+        new_keys = {normalize_query(b.get("subq", "")) for b in new}
+        merged, seen = [], set()
+        for block in [b for b in previous if normalize_query(b.get("subq", "")) not in new_keys] + list(new):
+            results = []
+            for r in block.get("results", []):
+                if r.get("ref") is not None and r["ref"] in seen:
+                    continue
+                seen.add(r.get("ref"))
+                results.append(r)
+            merged.append({**block, "results": results})
+        return merged
+
+    def _critique_patch(self, feedback: str) -> Dict[str, Any]:
+        """
+        增量质疑：模型只点名需要修改的章节并给出替换内容，回答在本地修补。
+        需要新搜索时，所有新子问题并发搜索并与上一轮保留的结果合并，再只为点名的章节补写内容。
+        """
+        prompt = CRITIQUE_PATCH_PROMPT.format(
+            feedback=feedback, outline=markdown_outline(self.last_answer), answer=self.last_answer
+        )
+        response = self._invoke(
+            [self.system_message, *self._recall_messages(feedback), HumanMessage(content=prompt)],
+            stage="critique",
+        )
+        data = parse_json_object(response.content)
+        if data is None:
+            data = {
+                "need_new_search": False,
+                "new_subquestions": [],
+                "edits": [],
+                "improved_answer": f"解析反馈 JSON 失败，原始内容：\n{response.content.strip()}",
+            }
+            self.memory.add("assistant", data["improved_answer"])
+            return {"critique_result": data, "new_search_raw": []}
+
+        edits = [e for e in data.get("edits") or [] if isinstance(e, dict)]
+        search_data: List[Dict[str, Any]] = []
+        if data.get("need_new_search") and data.get("new_subquestions"):
+            # 之前已搜索过的子问题直接复用保留的结果
+            retained = {normalize_query(b.get("subq", "")) for b in self.last_search_data}
+            subqs = [{"subq": q, "reason": "用户质疑后新增"} for q in data["new_subquestions"]
+                     if normalize_query(q) not in retained]
+            search_data = self._search(subqs) if subqs else []
+            if settings.delta_planning:
+                self.subq_registry.record(search_data)
+            merged = self._merge_search_data(self.last_search_data, search_data)
+
+            targets = [e for e in edits if e.get("action") != "remove"] or [{"action": "add", "section": "补充说明"}]
+            sections = "\n\n".join(
+                section_text(self.last_answer, str(e.get("section", ""))) or f"（新增章节）{e.get('section', '')}"
+                for e in targets
+            )
+            sections_prompt = CRITIQUE_SECTIONS_PROMPT.format(
+                feedback=feedback, sections=sections,
+                snippets="\n".join(self._snippet_lines(merged)) or "(无搜索数据)",
+            )
+            written = parse_json_object(
+                self._invoke([self.system_message, HumanMessage(content=sections_prompt)], stage="critique").content
+            ) or {}
+            edits = [e for e in edits if e.get("action") == "remove"] + \
+                [e for e in written.get("edits") or [] if isinstance(e, dict)]
+            self.last_search_data = merged
+
+        improved, applied, errors = apply_section_edits(self.last_answer, edits)
+        data.update(edits=edits, applied_sections=applied, rejected_edits=errors, improved_answer=improved)
+        if settings.debug:
+            print(f"🩹 增量修补: 修改 {len(applied)} 个章节" + (f"，{len(errors)} 处无法应用" if errors else ""))
+
+        self.last_answer = improved
+        self.memory.add("assistant", improved)
+        self.memory.maybe_compress(background=settings.memory_compress_background)
+        return {"critique_result": data, "new_search_raw": search_data}
+
     def export_state(self) -> Dict[str, Any]:
+        self.memory.flush()
         return {
             "compressed_context": self.memory.compressed_context,
             "messages": [
@@ -224,13 +968,21 @@ class ResearchAgent:
             ]
         }
 
+    @profiled("continue_dialog")
+    @prioritized("interactive")
     def continue_dialog(self, user_message: str) -> str:
+        self.warmup.mark_first_query()
+        if self._begin_turn() >= 2:
+            return self._budget_refusal()
         self.memory.add("user", user_message)
-        context_msgs = [self.system_message] + [
-            HumanMessage(content=m.content) if m.role == "user" else AIMessage(content=m.content)
-            for m in self.memory.messages
-        ]
-        response = self.llm.invoke(context_msgs)
+        context_msgs, stats = self.context_builder.build(
+            self.system_message, self.memory, user_message, recalled=self._recall(user_message)
+        )
+        self.last_context_stats = stats
+        if settings.debug:
+            print(f"🧮 上下文组装: {stats['tokens']}/{stats['budget']} tokens "
+                  f"(最近 {stats['recent']} 条, 召回 {stats['recalled']} 条, 省略 {stats['dropped']} 条)")
+        response = self._invoke(context_msgs, stage="continue")
         self.memory.add("assistant", response.content)
-        self.memory.maybe_compress()
+        self.memory.maybe_compress(background=settings.memory_compress_background)
         return response.content
\ No newline at end of file
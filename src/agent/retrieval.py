@@ -0,0 +1,56 @@
+from typing import Dict, List, Sequence
+from collections import Counter
+import math
+import re
+
+# 拉丁词/数字作为整体，CJK 连续片段切成字二元组（单字片段保留单字）
+_LATIN_RE = re.compile(r"[A-Za-z][A-Za-z0-9_.+#-]*|\d+(?:\.\d+)*")
+_CJK_RE = re.compile(r"[㐀-鿿豈-﫿]+")
+
+
+def lexical_terms(text: str) -> List[str]:
+    """本地检索用的轻量分词：不依赖外部分词器，对中英文混合文本都能给出可比较的词项。"""
+    text = text or ""
+    terms = [t.lower() for t in _LATIN_RE.findall(text)]
+    for run in _CJK_RE.findall(text):
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def bm25_scores(query: str, docs: Sequence[str], k1: float = 1.5, b: float = 0.75) -> List[float]:
+    """对一组文档计算相对于 query 的 BM25 分数（文档集即为 IDF 统计范围）。"""
+    if not docs:
+        return []
+    doc_terms = [Counter(lexical_terms(d)) for d in docs]
+    return bm25_from_counters(lexical_terms(query), doc_terms, k1=k1, b=b)
+
+
+def bm25_from_counters(query_terms: List[str], doc_terms: Sequence[Counter],
+                       k1: float = 1.5, b: float = 0.75,
+                       df: Dict[str, int] | None = None, avgdl: float | None = None) -> List[float]:
+    """在已分词的文档上计算 BM25；df/avgdl 可由持久化索引直接提供。"""
+    n = len(doc_terms)
+    if n == 0 or not query_terms:
+        return [0.0] * n
+    if df is None:
+        df = Counter()
+        for c in doc_terms:
+            df.update(c.keys())
+    if avgdl is None:
+        avgdl = sum(sum(c.values()) for c in doc_terms) / n or 1.0
+    q = Counter(query_terms)
+    scores = []
+    for c in doc_terms:
+        dl = sum(c.values())
+        score = 0.0
+        for term, qtf in q.items():
+            tf = c.get(term, 0)
+            if not tf:
+                continue
+            idf = math.log(1 + (n - df.get(term, 0) + 0.5) / (df.get(term, 0) + 0.5))
+            score += qtf * idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl))
+        scores.append(score)
+    return scores
@@ -0,0 +1,127 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+import threading
+import time
+
+from ..config.settings import settings
+
+# agents.yaml 中 stages 可配置的阶段
+STAGES: Tuple[str, ...] = ("plan", "synthesize", "critique", "summarize", "continue")
+
+
+@dataclass
+class StageConfig:
+    stage: str
+    model: str
+    max_tokens: Optional[int] = None
+    timeout: Optional[float] = None
+    latency_threshold_s: Optional[float] = None
+    fallback: List[str] = field(default_factory=list)
+
+
+@dataclass
+class _Health:
+    latency_ewma: float = 0.0
+    error_ewma: float = 0.0
+    samples: int = 0
+    last_used: float = 0.0
+
+    def update(self, latency_s: float, ok: bool, alpha: float):
+        if self.samples == 0:
+            self.latency_ewma, self.error_ewma = latency_s, 0.0 if ok else 1.0
+        else:
+            self.latency_ewma += alpha * (latency_s - self.latency_ewma)
+            self.error_ewma += alpha * ((0.0 if ok else 1.0) - self.error_ewma)
+        self.samples += 1
+
+
+class ModelRouter:
+    """
+    按阶段选择模型。agents.yaml 中 agent 配置的 stages.<阶段> 可指定 model / max_tokens / timeout /
+    latency_threshold_s / fallback；未配置的字段沿用 agent 的默认模型与参数。
+    每个（阶段, 模型）维护延迟与错误率的指数滑动平均：主模型延迟超过阈值或错误率超过
+    settings.router_error_threshold 时依次改用 fallback 中的模型；每隔 router_probe_interval_s 放行一次主模型以刷新统计。
+    """
+
+    def __init__(self, agent_cfg: Dict[str, Any] | None = None):
+        agent_cfg = agent_cfg or {}
+        self.default_model = str(agent_cfg.get("model") or "")
+        # 接近 token 预算时所有阶段改用的较小模型（未配置时不切换模型）
+        self.budget_model = agent_cfg.get("budget_model")
+        self.stages: Dict[str, StageConfig] = {}
+        for name, raw in (agent_cfg.get("stages") or {}).items():
+            if name not in STAGES:
+                raise ValueError(f"未知的阶段: {name}. 可用阶段: {', '.join(STAGES)}")
+            raw = raw or {}
+            fallback = raw.get("fallback") or []
+            self.stages[name] = StageConfig(
+                stage=name,
+                model=str(raw.get("model") or self.default_model),
+                max_tokens=raw.get("max_tokens"),
+                timeout=raw.get("timeout"),
+                latency_threshold_s=raw.get("latency_threshold_s"),
+                fallback=[fallback] if isinstance(fallback, str) else list(fallback),
+            )
+        self._lock = threading.Lock()
+        self._health: Dict[Tuple[str, str], _Health] = {}
+        self.switches = 0
+
+    def stage(self, name: str | None) -> Optional[StageConfig]:
+        return self.stages.get(name) if name else None
+
+    def _healthy(self, cfg: StageConfig, h: _Health | None) -> bool:
+        if h is None or h.samples < settings.router_min_samples:
+            return True
+        threshold = cfg.latency_threshold_s or settings.router_latency_threshold_s
+        return h.latency_ewma <= threshold and h.error_ewma <= settings.router_error_threshold
+
+    def choose(self, stage: str | None, downgrade: bool = False) -> str:
+        """返回本次调用应使用的模型名；阶段未配置时返回默认模型，downgrade 时返回 budget_model。"""
+        if downgrade and self.budget_model:
+            return self.budget_model
+        cfg = self.stage(stage)
+        if cfg is None:
+            return self.default_model
+        candidates = [cfg.model, *[m for m in cfg.fallback if m != cfg.model]]
+        now = time.monotonic()
+        with self._lock:
+            for model in candidates:
+                h = self._health.get((cfg.stage, model))
+                if self._healthy(cfg, h):
+                    chosen = model
+                    break
+                if h is not None and now - h.last_used >= settings.router_probe_interval_s:
+                    # 降级后定期放行一次，否则恢复正常的模型永远没有机会更新统计
+                    chosen = model
+                    break
+            else:
+                # 全部超标：选综合表现最好的
+                chosen = min(candidates, key=lambda m: self._score(cfg.stage, m))
+            h = self._health.setdefault((cfg.stage, chosen), _Health())
+            h.last_used = now
+            if chosen != cfg.model:
+                self.switches += 1
+        return chosen
+
+    def _score(self, stage: str, model: str) -> float:
+        h = self._health.get((stage, model))
+        return h.latency_ewma * (1 + 4 * h.error_ewma) if h else 0.0
+
+    def record(self, stage: str | None, model: str, latency_s: float, ok: bool):
+        with self._lock:
+            h = self._health.setdefault((stage or "default", model), _Health())
+            h.update(latency_s, ok, settings.router_ewma_alpha)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "switches": self.switches,
+                "models": {
+                    f"{stage}:{model}": {
+                        "latency_ewma_s": round(h.latency_ewma, 3),
+                        "error_ewma": round(h.error_ewma, 3),
+                        "samples": h.samples,
+                    }
+                    for (stage, model), h in self._health.items() if h.samples
+                },
+            }
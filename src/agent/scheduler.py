@@ -0,0 +1,288 @@
+from concurrent.futures import Future
+from contextlib import contextmanager
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, Iterator, List, Tuple
+import functools
+import heapq
+import itertools
+import queue
+import threading
+import time
+
+from ..config.settings import settings
+
+# 优先级类别，按优先级从高到低排列：交互式提问 > 质疑改进 > 后台任务 > 批处理
+PRIORITY_CLASSES: Tuple[str, ...] = ("interactive", "critique", "background", "batch")
+
+# 当前调用所属的（类别, 会话）；由 ResearchAgent 的入口方法设置，经 deadline/report 的线程池随任务传递
+_current: ContextVar[Tuple[str, str]] = ContextVar("priority_context", default=("interactive", "-"))
+# 任务在线程池中排队的时间：计入任务内第一次在调度器排队的等待时间，使等待从提交时算起
+_pool_wait: ContextVar[float] = ContextVar("pool_wait", default=0.0)
+
+
+def _rank(cls: str) -> int:
+    try:
+        return PRIORITY_CLASSES.index(cls)
+    except ValueError:
+        raise ValueError(f"未知的优先级类别: {cls}. 可用类别: {', '.join(PRIORITY_CLASSES)}")
+
+
+def current() -> Tuple[str, str]:
+    return _current.get()
+
+
+@contextmanager
+def scheduling(cls: str | None = None, session: str | None = None) -> Iterator[Tuple[str, str]]:
+    """
+    在此上下文内发起的 LLM / MCP 调用按 (cls, session) 排队。嵌套时类别只会降级不会升级：
+    批处理会话里的 scheduling("background") 仍是 batch，交互会话里的则降为 background。
+    """
+    outer_cls, outer_session = _current.get()
+    cls = cls or outer_cls
+    if _rank(outer_cls) > _rank(cls):
+        cls = outer_cls
+    token = _current.set((cls, session or outer_session))
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+
+def prioritized(cls: str):
+    """ResearchAgent 方法装饰器：以 self.session_id 为会话、按 cls 与 self.priority 中较低者排队。"""
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            agent_cls = getattr(self, "priority", cls) or cls
+            effective = agent_cls if _rank(agent_cls) > _rank(cls) else cls
+            with scheduling(effective, getattr(self, "session_id", None)):
+                return fn(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class QueueTimeout(TimeoutError):
+    pass
+
+
+def note_pool_wait(seconds: float):
+    """记录当前任务在线程池中排队的时间（由 deadline.submit 在任务开始执行时调用）。"""
+    _pool_wait.set(max(seconds, 0.0))
+
+
+class _Ticket:
+    __slots__ = ("cls", "session", "start", "finish", "event", "granted", "cancelled", "enqueued", "on_grant")
+
+    def __init__(self, cls: str, session: str, start: float, finish: float, enqueued: float,
+                 on_grant: Callable[["_Ticket"], None] | None = None):
+        self.cls = cls
+        self.session = session
+        self.start = start
+        self.finish = finish
+        self.event = threading.Event()
+        self.granted = False
+        self.cancelled = False
+        self.enqueued = enqueued
+        self.on_grant = on_grant
+
+
+class PriorityScheduler:
+    """
+    进程级调用调度器：限制同时在途的外部调用数（capacity），空闲槽位按类别优先级分配，
+    同一类别内按会话做公平排队（每个请求代价相同，各会话轮流获得槽位），避免单个会话的大量并发请求挤占其他会话。
+    class_caps 限制各类别的在途上限，保证后台任务与批处理不会占满全部槽位。
+    """
+
+    def __init__(self, name: str, capacity: int, class_caps: Dict[str, int] | None = None):
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.class_caps = dict(class_caps or {})
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._queues: Dict[str, List[Tuple[float, int, _Ticket]]] = {c: [] for c in PRIORITY_CLASSES}
+        self._vtime: Dict[str, float] = {c: 0.0 for c in PRIORITY_CLASSES}
+        self._last_finish: Dict[str, Dict[str, float]] = {c: {} for c in PRIORITY_CLASSES}
+        self._inflight: Dict[str, int] = {c: 0 for c in PRIORITY_CLASSES}
+        self._queued: Dict[str, int] = {c: 0 for c in PRIORITY_CLASSES}
+        self._waits: Dict[str, Deque[float]] = {c: deque(maxlen=1024) for c in PRIORITY_CLASSES}
+        self._admitted: Dict[str, int] = {c: 0 for c in PRIORITY_CLASSES}
+        self._timeouts: Dict[str, int] = {c: 0 for c in PRIORITY_CLASSES}
+
+    def _dispatch_locked(self):
+        while sum(self._inflight.values()) < self.capacity:
+            for cls in PRIORITY_CLASSES:
+                queue = self._queues[cls]
+                while queue and queue[0][2].cancelled:
+                    heapq.heappop(queue)
+                cap = self.class_caps.get(cls)
+                if queue and (cap is None or self._inflight[cls] < cap):
+                    break
+            else:
+                return
+            _, _, ticket = heapq.heappop(queue)
+            self._vtime[cls] = max(self._vtime[cls], ticket.start)
+            self._queued[cls] -= 1
+            self._inflight[cls] += 1
+            self._waits[cls].append(time.perf_counter() - ticket.enqueued)
+            self._admitted[cls] += 1
+            ticket.granted = True
+            ticket.event.set()
+            if ticket.on_grant is not None:
+                ticket.on_grant(ticket)
+
+    def _enqueue(self, cls: str | None, session: str | None, enqueued: float,
+                 on_grant: Callable[[_Ticket], None] | None = None) -> _Ticket:
+        ctx_cls, ctx_session = _current.get()
+        cls, session = cls or ctx_cls, session or ctx_session
+        _rank(cls)
+        with self._lock:
+            last = self._last_finish[cls]
+            start = max(self._vtime[cls], last.get(session, 0.0))
+            finish = start + 1.0
+            last[session] = finish
+            if len(last) > 4096:
+                # 清理早已落后于虚拟时间的会话记录
+                vt = self._vtime[cls]
+                for s in [s for s, f in last.items() if f <= vt]:
+                    del last[s]
+            ticket = _Ticket(cls, session, start, finish, enqueued, on_grant)
+            heapq.heappush(self._queues[cls], (finish, next(self._seq), ticket))
+            self._queued[cls] += 1
+            self._dispatch_locked()
+        return ticket
+
+    def acquire(self, cls: str | None = None, session: str | None = None, timeout: float | None = None) -> _Ticket:
+        """
+        阻塞直到获得槽位。在线程池任务中第一次排队时，等待时间从任务提交时算起（含在线程池中排队的时间）。
+        """
+        carried = _pool_wait.get()
+        if carried:
+            _pool_wait.set(0.0)
+        ticket = self._enqueue(cls, session, time.perf_counter() - carried)
+        if not ticket.event.wait(timeout):
+            with self._lock:
+                if not ticket.granted:
+                    ticket.cancelled = True
+                    self._queued[ticket.cls] -= 1
+                    self._timeouts[ticket.cls] += 1
+                    raise QueueTimeout(f"{self.name} 调度队列等待超过 {timeout}s（类别 {ticket.cls}）")
+        return ticket
+
+    def enqueue(self, on_grant: Callable[[_Ticket], None], cls: str | None = None,
+                session: str | None = None) -> _Ticket:
+        """非阻塞排队：获得槽位时在调度锁内调用 on_grant(ticket)，执行完后需 release(ticket)。"""
+        return self._enqueue(cls, session, time.perf_counter(), on_grant)
+
+    def withdraw(self, ticket: _Ticket) -> bool:
+        """撤回尚未获得槽位的排队请求；已获得槽位时返回 False（由持有方负责 release）。"""
+        with self._lock:
+            if ticket.granted or ticket.cancelled:
+                return False
+            ticket.cancelled = True
+            self._queued[ticket.cls] -= 1
+            return True
+
+    def release(self, ticket: _Ticket):
+        with self._lock:
+            self._inflight[ticket.cls] -= 1
+            self._dispatch_locked()
+
+    @contextmanager
+    def slot(self, cls: str | None = None, session: str | None = None,
+             timeout: float | None = None) -> Iterator[_Ticket]:
+        ticket = self.acquire(cls, session, timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def run(self, fn: Callable[[], Any], cls: str | None = None, session: str | None = None,
+            timeout: float | None = None) -> Any:
+        with self.slot(cls, session, timeout):
+            return fn()
+
+    def reset_stats(self):
+        """清空等待时间与计数（不影响排队中与在途的调用）。"""
+        with self._lock:
+            for cls in PRIORITY_CLASSES:
+                self._waits[cls].clear()
+                self._admitted[cls] = 0
+                self._timeouts[cls] = 0
+
+    def depth(self) -> int:
+        """排队中 + 在途的调用数。"""
+        return sum(self._queued.values()) + sum(self._inflight.values())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            per_class = {}
+            for cls in PRIORITY_CLASSES:
+                waits = sorted(self._waits[cls])
+                per_class[cls] = {
+                    "admitted": self._admitted[cls],
+                    "queued": self._queued[cls],
+                    "inflight": self._inflight[cls],
+                    "timeouts": self._timeouts[cls],
+                    "wait_mean_s": round(sum(waits) / len(waits), 4) if waits else 0.0,
+                    "wait_p95_s": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 4) if waits else 0.0,
+                    "wait_max_s": round(waits[-1], 4) if waits else 0.0,
+                }
+        return {"capacity": self.capacity, "class_caps": dict(self.class_caps), "classes": per_class}
+
+
+class PriorityExecutor:
+    """
+    按调度类别排序的线程池：submit 的任务先在 PriorityScheduler 中排队（类别优先，同类别内按会话公平），
+    获得槽位后才交给工作线程执行。与先进先出的 ThreadPoolExecutor 不同，交互会话的任务不会排在
+    先提交的批处理任务之后；class_caps 限制各类别占用的线程数，低优先级任务不能占满全部线程。
+    线程池的排队时间也计入 stats()。
+    """
+
+    def __init__(self, name: str, max_workers: int, class_caps: Dict[str, int] | None = None):
+        self.scheduler = PriorityScheduler(name, max_workers, class_caps)
+        self._ready: "queue.SimpleQueue[Tuple[_Ticket, Future, Callable[[], Any]]]" = queue.SimpleQueue()
+        for i in range(self.scheduler.capacity):
+            threading.Thread(target=self._worker, name=f"{name}_{i}", daemon=True).start()
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        fut: Future = Future()
+        work = functools.partial(fn, *args, **kwargs)
+        # 槽位数等于工作线程数，获得槽位的任务总有空闲线程立即执行
+        ticket = self.scheduler.enqueue(lambda t: self._ready.put((t, fut, work)))
+        fut.add_done_callback(lambda f: f.cancelled() and self.scheduler.withdraw(ticket))
+        return fut
+
+    def _worker(self):
+        while True:
+            ticket, fut, work = self._ready.get()
+            try:
+                if fut.set_running_or_notify_cancel():
+                    try:
+                        fut.set_result(work())
+                    except BaseException as e:
+                        fut.set_exception(e)
+            finally:
+                self.scheduler.release(ticket)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.scheduler.stats()
+
+
+# 进程级共享实例：同一进程内的所有会话与批处理任务共用配额
+llm_scheduler = PriorityScheduler("llm", settings.scheduler_llm_concurrency, settings.scheduler_class_caps)
+mcp_scheduler = PriorityScheduler("mcp", settings.scheduler_mcp_concurrency, settings.scheduler_class_caps)
+
+
+def metrics() -> Dict[str, Dict[str, Any]]:
+    return {s.name: s.stats() for s in (llm_scheduler, mcp_scheduler)}
+
+
+def reset_metrics():
+    """清空共享调度器的等待统计（压测逐级测量时每级开始前调用）。"""
+    for s in (llm_scheduler, mcp_scheduler):
+        s.reset_stats()
+
+
+def queue_depth() -> int:
+    return llm_scheduler.depth() + mcp_scheduler.depth()
@@ -0,0 +1,121 @@
+from typing import Any, Callable, Dict, Hashable
+import hashlib
+import re
+import threading
+
+
+class FlightTimeout(TimeoutError):
+    """等待合并中的调用超过了本调用方自己的超时。"""
+
+
+class _Call:
+    __slots__ = ("event", "result", "error", "aborted", "waiters")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Exception | None = None
+        self.aborted = False  # 发起方因 KeyboardInterrupt 等非 Exception 中止，结果不可共享
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    请求合并（single-flight）：同一时刻 key 相同的并发请求只发出一次外部调用，
+    其余调用方等待并共享同一份结果（或同一个 Exception）。结果在调用结束后不缓存。
+    跟随方按各自的 timeout 等待，超时抛出 FlightTimeout；发起方被 KeyboardInterrupt 等中止时，
+    跟随方不会在自己的线程里收到该中断，而是各自重新执行 fn。
+    注意：共享的结果对象应视为只读。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.calls = 0        # 实际发出的外部调用数
+        self.coalesced = 0    # 被合并、未单独发出的请求数
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: float | None = None,
+           on_shared: Callable[[Any], None] | None = None) -> Any:
+        """
+        timeout 为跟随方最长等待秒数（None 表示一直等待）；on_shared 在跟随方拿到共享结果时以结果调用，
+        供调用方把这次请求记到自己名下（如用量记账）。
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.calls += 1
+                leader = True
+
+        if not leader:
+            if not call.event.wait(timeout):
+                raise FlightTimeout(f"{self.name} 合并请求等待超过 {timeout}s")
+            if call.aborted:
+                return fn()
+            if call.error is not None:
+                raise call.error
+            if on_shared is not None:
+                on_shared(call.result)
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        except BaseException:
+            call.aborted = True
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+        return call.result
+
+    def inflight(self) -> int:
+        return len(self._calls)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.calls + self.coalesced
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "inflight": self.inflight(),
+            "coalesced_ratio": round(self.coalesced / total, 4) if total else 0.0,
+        }
+
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """搜索请求合并用的查询规范化：忽略大小写与多余空白。"""
+    return _WS_RE.sub(" ", (query or "").strip().lower())
+
+
+def prompt_key(model: str, messages: Any, **params: Any) -> str:
+    """LLM 请求合并用的键：模型名 + 消息序列（类型与内容）+ 影响输出的参数。"""
+    h = hashlib.sha1(model.encode("utf-8"))
+    for m in messages if isinstance(messages, list) else [messages]:
+        h.update(b"\x00")
+        h.update(type(m).__name__.encode("utf-8"))
+        h.update(b"\x01")
+        h.update(str(getattr(m, "content", m)).encode("utf-8"))
+    for k in sorted(params):
+        h.update(f"\x02{k}={params[k]}".encode("utf-8"))
+    return h.hexdigest()
+
+
+# 进程级共享实例：多会话共用同一进程时才能互相合并
+mcp_flight = SingleFlight("mcp")
+llm_flight = SingleFlight("llm")
+
+
+def metrics() -> Dict[str, Dict[str, Any]]:
+    return {f.name: f.stats() for f in (mcp_flight, llm_flight)}
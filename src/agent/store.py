@@ -0,0 +1,142 @@
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import hashlib
+import threading
+import zlib
+
+# 小于该字节数的文本不压缩（zlib 头部开销会让短文本反而变大）
+_COMPRESS_MIN_BYTES = 128
+
+# 规范化 URL 时丢弃的跟踪参数：按完整参数名匹配，另外丢弃所有 utm_ 前缀的参数。
+# from 之类的通用名不在其中（?from=2020&to=2021 是有意义的查询条件）
+_TRACKING_PARAMS = frozenset({"spm", "share_token", "fbclid", "gclid"})
+_TRACKING_PREFIX = "utm_"
+
+
+def content_handle(text: str) -> str:
+    """返回文本的内容寻址句柄（sha1 前 16 位）。"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+class ContentStore:
+    """
+    会话级内容寻址存储：hash -> 文本。
+    相同文本只保存一份，较长文本以 zlib 压缩形式驻留内存；
+    调用方在结果、提示词和返回值之间只传递句柄，需要时再 get() 取回原文。
+    """
+
+    def __init__(self):
+        self._blobs: Dict[str, Tuple[bool, bytes]] = {}
+        self._lock = threading.Lock()
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.dedup_hits = 0
+
+    def put(self, text: str) -> str:
+        text = text or ""
+        handle = content_handle(text)
+        with self._lock:
+            if handle in self._blobs:
+                self.dedup_hits += 1
+                return handle
+            raw = text.encode("utf-8")
+            packed = zlib.compress(raw, 6) if len(raw) >= _COMPRESS_MIN_BYTES else raw
+            if len(packed) < len(raw):
+                self._blobs[handle] = (True, packed)
+            else:
+                packed = raw
+                self._blobs[handle] = (False, raw)
+            self.raw_bytes += len(raw)
+            self.stored_bytes += len(packed)
+        return handle
+
+    def get(self, handle: Optional[str], default: str = "") -> str:
+        entry = self._blobs.get(handle) if handle else None
+        if entry is None:
+            return default
+        compressed, data = entry
+        return (zlib.decompress(data) if compressed else data).decode("utf-8")
+
+    def __contains__(self, handle: str) -> bool:
+        return handle in self._blobs
+
+    def __len__(self) -> int:
+        return len(self._blobs)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "items": len(self._blobs),
+            "raw_bytes": self.raw_bytes,
+            "stored_bytes": self.stored_bytes,
+            "dedup_hits": self.dedup_hits,
+        }
+
+
+def canonical_url(url: str) -> str:
+    """
+    将 URL 规范化，用于引用去重：小写 scheme/host、去掉默认端口、fragment、跟踪参数和末尾斜杠。
+    非 http(s) 的键（例如无 URL 结果的占位键）原样返回。
+    """
+    url = (url or "").strip()
+    if not url.lower().startswith(("http://", "https://")):
+        return url
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and not ((scheme == "http" and parts.port == 80) or (scheme == "https" and parts.port == 443)):
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip("/") or "/"
+    query = urlencode(sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in _TRACKING_PARAMS and not k.lower().startswith(_TRACKING_PREFIX)
+    ))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+class ReferenceRegistry:
+    """
+    增量维护的参考文献登记表：为每个规范化 URL 分配会话内稳定的引用编号（从 1 开始）。
+    同一 URL 在后续轮次中再次出现时复用原编号，不会重新嵌入或重新编号。
+    """
+
+    def __init__(self):
+        self._by_key: Dict[str, int] = {}
+        self._entries: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def register(self, url: str, title: str = "") -> int:
+        key = canonical_url(url)
+        with self._lock:
+            n = self._by_key.get(key)
+            if n is not None:
+                if title and not self._entries[n - 1]["title"]:
+                    self._entries[n - 1]["title"] = title
+                return n
+            n = len(self._entries) + 1
+            self._by_key[key] = n
+            self._entries.append({"n": n, "url": url, "key": key, "title": title})
+            return n
+
+    def number(self, url: str) -> Optional[int]:
+        return self._by_key.get(canonical_url(url))
+
+    def get(self, n: int) -> Optional[Dict[str, Any]]:
+        if 1 <= n <= len(self._entries):
+            return self._entries[n - 1]
+        return None
+
+    def entries(self, numbers: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+        if numbers is None:
+            return list(self._entries)
+        return [self._entries[n - 1] for n in sorted(set(numbers)) if 1 <= n <= len(self._entries)]
+
+    def render(self, numbers: Optional[List[int]] = None) -> str:
+        """渲染带编号的 URL 列表（RESEARCH_PROMPT 要求调研数据开头给出该列表）。"""
+        lines = []
+        for e in self.entries(numbers):
+            if e["url"].lower().startswith(("http://", "https://")):
+                lines.append(f"[{e['n']}] {e['title'] or '(无标题)'} - {e['url']}")
+        return "\n".join(lines)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,281 @@
+# token 计数：精确计数（tiktoken cl100k_base）与基于字符类别的快速估算，估算权重可对照参考分词器校准
+# 用法：python -m src.main --calibrate-tokens [--tokenizer tokenizer.json] [--corpus 文件 ...] [--no-save] [--json]
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import argparse
+import json
+import math
+import random
+import re
+import string
+import threading
+import tiktoken
+
+from ..config.settings import settings
+
+# 特征顺序：CJK 汉字、其他非 ASCII 字符（全角标点、emoji 等）、拉丁单词数、拉丁字母数、数字、ASCII 标点、换行
+FEATURES: Tuple[str, ...] = ("cjk", "other", "words", "letters", "digits", "punct", "newlines")
+
+# 未校准时的先验权重（参照 cl100k_base 的经验值：常用汉字约 1～2 个 token，常见英文单词 1 个 token，
+# 长单词按字母数追加，数字每 3 位一组，标点大多单独成 token）
+DEFAULT_WEIGHTS: Tuple[float, ...] = (1.3, 1.2, 1.0, 0.04, 0.36, 0.8, 0.5)
+
+_CJK = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+_WORD = re.compile(rb"[A-Za-z]+")
+_LETTERS = string.ascii_letters.encode()
+_DIGITS = string.digits.encode()
+_PUNCT = string.punctuation.encode()
+
+
+@lru_cache(maxsize=1)
+def _encoder():
+    # tiktoken 的编码器加载开销较大，进程内只加载一次
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def features(text: str) -> Tuple[int, ...]:
+    """
+    按 FEATURES 的顺序统计各字符类别的数量。ASCII 部分先编码为 bytes，再用 bytes.translate 删除字符计数，
+    汉字按连续片段匹配，不在 Python 层逐字符循环。
+    """
+    if not text:
+        return (0,) * len(FEATURES)
+    ascii_ = text.encode("ascii", "ignore")
+    n = len(ascii_)
+    non_ascii = len(text) - n
+    cjk = sum(map(len, _CJK.findall(text))) if non_ascii else 0
+    return (
+        cjk,
+        non_ascii - cjk,
+        len(_WORD.findall(ascii_)),
+        n - len(ascii_.translate(None, _LETTERS)),
+        n - len(ascii_.translate(None, _DIGITS)),
+        n - len(ascii_.translate(None, _PUNCT)),
+        ascii_.count(b"\n"),
+    )
+
+
+@dataclass
+class TokenEstimator:
+    """
+    线性估算器：token ≈ Σ 权重 × 字符类别计数。error 为校准时 k 折交叉验证得到的留出集相对误差统计
+    （mean / p95 / max，以及整体语料的合计误差），未校准时为空。
+    """
+    weights: Tuple[float, ...] = DEFAULT_WEIGHTS
+    reference: str = "prior"
+    error: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def error_bound(self) -> Optional[float]:
+        """单段文本在留出集上相对误差的 p95；未校准时为 None。"""
+        return self.error.get("p95_rel")
+
+    def _apply(self, counts: Sequence[int]) -> int:
+        if not any(counts):
+            return 0
+        return max(1, round(sum(w * c for w, c in zip(self.weights, counts))))
+
+    def estimate(self, text: str) -> int:
+        return self._apply(features(text))
+
+    def save(self, path: str | Path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = asdict(self)
+        data["features"] = list(FEATURES)
+        path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    @classmethod
+    def load(cls, path: str | Path) -> "TokenEstimator":
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        if tuple(data.get("features") or FEATURES) != FEATURES:
+            raise ValueError(f"估算器特征与当前版本不一致: {path}")
+        return cls(tuple(float(w) for w in data["weights"]), data.get("reference", "?"), data.get("error") or {})
+
+
+_estimator: TokenEstimator | None = None
+_estimator_lock = threading.Lock()
+
+
+def estimator() -> TokenEstimator:
+    """进程级估算器：优先加载 settings.token_estimator_path 中的校准结果，不存在或无效时使用先验权重。"""
+    global _estimator
+    if _estimator is None:
+        with _estimator_lock:
+            if _estimator is None:
+                path = settings.resolve_token_estimator_path()
+                est = TokenEstimator()
+                if path.exists():
+                    try:
+                        est = TokenEstimator.load(path)
+                    except (OSError, ValueError, KeyError) as e:
+                        print(f"⚠️  token 估算器校准文件无效，使用先验权重: {e}")
+                _estimator = est
+    return _estimator
+
+
+def token_mode(site: str | None = None) -> str:
+    """调用点 site 的计数方式："exact" 或 "approx"（settings.token_count_modes 中未配置的调用点使用 token_count_mode）。"""
+    mode = settings.token_count_modes.get(site, settings.token_count_mode) if site else settings.token_count_mode
+    if mode not in ("exact", "approx"):
+        raise ValueError(f"未知的 token 计数方式: {mode}（可选 exact / approx）")
+    return mode
+
+
+def count_tokens(text: str, mode: str | None = None) -> int:
+    """mode 为 None 时按 settings.token_count_mode；最终的预算检查应显式传 "exact"。"""
+    if (mode or settings.token_count_mode) == "approx":
+        return estimator().estimate(text or "")
+    return len(_encoder().encode(text or ""))
+
+
+# ---------------------------------------------------------------- 校准
+
+def _reference(tokenizer: str | None) -> Tuple[str, Callable[[str], int]]:
+    """参考分词器：默认 tiktoken；给出 tokenizer.json（如本地 Qwen 分词器）时用 tokenizers 库加载。"""
+    if not tokenizer:
+        enc = _encoder()
+        return "tiktoken:cl100k_base", lambda t: len(enc.encode(t))
+    try:
+        from tokenizers import Tokenizer
+    except ImportError:
+        raise RuntimeError("使用本地分词器文件校准需要安装 tokenizers：pip install tokenizers")
+    tok = Tokenizer.from_file(str(tokenizer))
+    return f"tokenizers:{Path(tokenizer).name}", lambda t: len(tok.encode(t, add_special_tokens=False).ids)
+
+
+def default_corpus() -> List[str]:
+    """内置校准语料：项目中的提示词模板（中英混排、含 JSON 与 Markdown，接近实际调用的输入）。"""
+    from . import prompt
+    root = Path(__file__).resolve().parents[2]
+    texts = [v for v in vars(prompt).values() if isinstance(v, str) and len(v) > 40]
+    extra = root / "prompt.py"
+    if extra.exists():
+        texts.append(extra.read_text(encoding="utf-8"))
+    return texts
+
+
+def _chunks(texts: Iterable[str], min_chars: int = 40) -> List[str]:
+    out = []
+    for text in texts:
+        out.extend(p.strip() for p in re.split(r"\n\s*\n", text) if len(p.strip()) >= min_chars)
+    return out
+
+
+def _solve(a: List[List[float]], b: List[float]) -> List[float]:
+    """高斯消元解小规模线性方程组（奇异时对应分量为 0）。"""
+    n = len(b)
+    m = [row[:] + [b[i]] for i, row in enumerate(a)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(m[r][col]))
+        if abs(m[pivot][col]) < 1e-12:
+            continue
+        m[col], m[pivot] = m[pivot], m[col]
+        for r in range(n):
+            if r != col and m[r][col]:
+                f = m[r][col] / m[col][col]
+                m[r] = [x - f * y for x, y in zip(m[r], m[col])]
+    return [m[i][n] / m[i][i] if abs(m[i][i]) >= 1e-12 else 0.0 for i in range(n)]
+
+
+def _fit(rows: List[Tuple[int, ...]], targets: List[int]) -> Tuple[float, ...]:
+    """以相对误差为目标的非负最小二乘（每个样本权重 1/目标²，负权重的特征剔除后重解）。"""
+    active = [i for i in range(len(FEATURES)) if any(r[i] for r in rows)]
+    while True:
+        k = len(active)
+        ata = [[0.0] * k for _ in range(k)]
+        atb = [0.0] * k
+        for r, y in zip(rows, targets):
+            s = 1.0 / (y * y)
+            x = [r[i] for i in active]
+            for i in range(k):
+                atb[i] += s * x[i] * y
+                for j in range(k):
+                    ata[i][j] += s * x[i] * x[j]
+        sol = _solve(ata, atb)
+        negative = [active[i] for i, w in enumerate(sol) if w < 0]
+        if not negative:
+            weights = [0.0] * len(FEATURES)
+            for i, w in zip(active, sol):
+                weights[i] = round(w, 4)
+            return tuple(weights)
+        active = [i for i in active if i not in negative]
+
+
+def _errors(predicted: List[int], exact: List[int]) -> Dict[str, float]:
+    rel = sorted(abs(p - y) / y for p, y in zip(predicted, exact))
+    return {
+        "samples": len(rel),
+        "mean_rel": round(sum(rel) / len(rel), 4),
+        "p95_rel": round(rel[min(len(rel) - 1, int(len(rel) * 0.95))], 4),
+        "max_rel": round(rel[-1], 4),
+        "total_rel": round(abs(sum(predicted) - sum(exact)) / sum(exact), 4),
+    }
+
+
+def _cross_validate(rows: List[Tuple[int, ...]], exact: List[int], folds: int, seed: int = 0) -> List[int]:
+    """k 折交叉验证：每段文本的预测值都来自不含该段的训练集拟合出的权重。"""
+    order = list(range(len(rows)))
+    random.Random(seed).shuffle(order)
+    predicted = [0] * len(rows)
+    for k in range(folds):
+        held = set(order[k::folds])
+        train = [i for i in order if i not in held]
+        est = TokenEstimator(_fit([rows[i] for i in train], [exact[i] for i in train]))
+        for i in held:
+            predicted[i] = est._apply(rows[i])
+    return predicted
+
+
+def calibrate(texts: Iterable[str] | None = None, tokenizer: str | None = None, folds: int = 5) -> TokenEstimator:
+    """
+    按段落切分语料，用参考分词器的精确计数拟合权重。报告的误差来自 k 折交叉验证（每段只由未见过它的权重估算），
+    in_sample_p95_rel 为全量拟合后在同一语料上的 p95，两者差距反映过拟合程度；最终权重用全部语料拟合。
+    """
+    name, exact_count = _reference(tokenizer)
+    samples = _chunks(default_corpus() if texts is None else texts)
+    pairs = [(t, exact_count(t)) for t in samples]
+    pairs = [(t, y) for t, y in pairs if y > 0]
+    folds = max(2, min(folds, len(pairs)))
+    # 每折的训练集（约 (k-1)/k 的样本）至少要有与特征数相同的段数
+    if len(pairs) - math.ceil(len(pairs) / folds) < len(FEATURES):
+        raise ValueError(f"校准语料太少（{len(pairs)} 段），{folds} 折交叉验证至少需要 "
+                         f"{math.ceil(len(FEATURES) * folds / (folds - 1)) + 1} 段")
+    texts_, exact = [t for t, _ in pairs], [y for _, y in pairs]
+    rows = [features(t) for t in texts_]
+    est = TokenEstimator(_fit(rows, exact), name)
+    est.error = _errors(_cross_validate(rows, exact, folds), exact)
+    est.error["folds"] = folds
+    est.error["in_sample_p95_rel"] = _errors([est._apply(r) for r in rows], exact)["p95_rel"]
+    est.error["prior_p95_rel"] = _errors([TokenEstimator()._apply(r) for r in rows], exact)["p95_rel"]
+    return est
+
+
+def main(argv: List[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m src.main --calibrate-tokens", description="校准快速 token 估算器")
+    parser.add_argument("--tokenizer", help="参考分词器文件（tokenizer.json，如本地 Qwen 分词器）；默认 tiktoken")
+    parser.add_argument("--corpus", nargs="*", help="校准语料文件；默认使用项目提示词模板")
+    parser.add_argument("--folds", type=int, default=5, help="交叉验证折数，误差在留出集上计算")
+    parser.add_argument("--no-save", action="store_true", help="只报告误差，不写入 settings.token_estimator_path")
+    parser.add_argument("--json", action="store_true", help="输出机器可读 JSON")
+    args = parser.parse_args(argv)
+
+    texts = [Path(p).read_text(encoding="utf-8") for p in args.corpus] if args.corpus else None
+    est = calibrate(texts, args.tokenizer, args.folds)
+    path = settings.resolve_token_estimator_path()
+    if not args.no_save:
+        est.save(path)
+    if args.json:
+        print(json.dumps({**asdict(est), "features": list(FEATURES), "saved": None if args.no_save else str(path)},
+                         ensure_ascii=False, indent=2))
+        return
+    e = est.error
+    print(f"📐 参考分词器: {est.reference}，校准样本 {e['samples']} 段")
+    print("   权重: " + ", ".join(f"{n}={w}" for n, w in zip(FEATURES, est.weights)))
+    print(f"   留出集相对误差（{e['folds']} 折交叉验证）: 平均 {e['mean_rel']:.1%}，p95 {e['p95_rel']:.1%}，"
+          f"最大 {e['max_rel']:.1%}，合计 {e['total_rel']:.1%}")
+    print(f"   对照: 训练集内 p95 {e['in_sample_p95_rel']:.1%}，先验权重 p95 {e['prior_p95_rel']:.1%}")
+    if not args.no_save:
+        print(f"💾 已写入 {path}")
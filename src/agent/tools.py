@@ -1,9 +1,16 @@
 from typing import Any, Dict, List, Optional
 import yaml
 import json
+import time
 import requests
+from requests.adapters import HTTPAdapter
 from pathlib import Path
 from langchain.tools import BaseTool
+from .deadline import call_timeout, cancelled, check_cancelled
+from .mcp_response import read_results
+from .singleflight import mcp_flight, normalize_query
+from .scheduler import current, mcp_scheduler
+from . import cassette
 from ..config.settings import settings
 
 class MCPToolClient:
@@ -55,15 +62,37 @@ class MCPToolClient:
         else:
             raise ValueError(f"不支持的 MCP 配置文件类型: {path.suffix}")
 
+        # 复用连接池：同一 MCP 主机的 DNS/TCP/TLS 只在首次请求（或预热）时支付
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=max(settings.search_concurrency * 2, 4))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
     def list_tools(self) -> List[str]:
         return list(self.tools.keys())
 
-    def call(self, name: str, query: str) -> List[Dict[str, Any]]:
+    def call(self, name: str, query: str, timeout: float | None = None) -> List[Dict[str, Any]]:
         """
         调用某个工具/服务器，返回解析后的 JSON（约定返回 list[ {title,snippet,url} ]）
         若工具不存在，会抛出并列出可用工具以便调试。
+        同一工具 + 规范化查询 + 优先级类别的并发请求会合并为一次 HTTP 调用（见 singleflight.mcp_flight），返回值应视为只读。
+        实际发出的调用经 scheduler.mcp_scheduler 按当前会话与优先级类别排队，排队最长等待 timeout 秒；
+        合并到他人调用上的请求最多等待排队与调用各 timeout 秒。
+        在 map_with_deadline 等有截止时刻的任务中，timeout 收窄到任务的剩余时间；任务被放弃后，排队中的调用不再发出，
+        读取中的响应停止读取并关闭连接。
         注意：不同 MCP 的请求/返回格式不同，必要时在此处适配 headers / payload / response parsing。
         """
+        timeout = call_timeout(timeout)
+
+        def granted():
+            check_cancelled()
+            return self._call(name, query, timeout)
+
+        return mcp_flight.do((name, normalize_query(query), current()[0]),
+                             lambda: mcp_scheduler.run(granted, timeout=timeout),
+                             timeout=2 * timeout if timeout else None)
+
+    def _resolve(self, name: str):
         tool = self.tools.get(name)
         if not tool:
             raise ValueError(f"未在 MCP 配置中找到工具: {name}. 可用工具: {', '.join(sorted(self.list_tools()))}")
@@ -71,57 +100,107 @@ class MCPToolClient:
         endpoint = tool.get("endpoint") or tool.get("url") or tool.get("raw", {}).get("url")
         if not endpoint:
             raise ValueError(f"工具 {name} 未配置 endpoint/url")
+        return tool, endpoint
 
-        method = (tool.get("method") or "POST").upper()
+    def _headers(self, tool: Dict[str, Any]) -> Dict[str, str]:
         headers: Dict[str, str] = {}
         # 将 api_key 放到 x-api-key，若 MCP 要求 Authorization: Bearer ... 请修改这里
         if tool.get("api_key"):
             headers["x-api-key"] = tool.get("api_key")
         if tool.get("raw") and isinstance(tool["raw"], dict) and tool["raw"].get("api_key"):
             headers.setdefault("x-api-key", tool["raw"].get("api_key"))
+        return headers
 
-        params_template = tool.get("params")
+    def warm_up(self, name: str, initialize: bool = True, timeout: float = 10) -> Dict[str, Any]:
+        """
+        预先建立到工具主机的连接（进入连接池）。对 streamable_http 类型的服务器可额外走一遍完整的 MCP 握手
+        （initialize → notifications/initialized），让服务端冷启动提前发生；握手得到的会话随即用 DELETE 结束。
+        _call 发出的是普通 HTTP 请求而不是 JSON-RPC，不沿用该会话。不修改 self.tools，可在后台线程调用。返回各步骤耗时。
+        """
+        tool, endpoint = self._resolve(name)
+        headers = self._headers(tool)
+        timings: Dict[str, Any] = {}
+        t0 = time.perf_counter()
         try:
-            if params_template and isinstance(params_template, dict):
-                params = {k: (v.replace("{{query}}", query) if isinstance(v, str) else v) for k, v in params_template.items()}
-                if method == "GET":
-                    resp = requests.get(endpoint, params=params, headers=headers, timeout=30)
-                else:
-                    resp = requests.post(endpoint, json=params, headers=headers, timeout=30)
+            # 只为建立 TCP/TLS 连接，状态码无关紧要
+            self.session.head(endpoint, headers=headers, timeout=timeout, allow_redirects=False)
+        except requests.RequestException as e:
+            timings["error"] = str(e)[:200]
+        timings["connect_s"] = round(time.perf_counter() - t0, 4)
+
+        raw = tool.get("raw") or {}
+        if initialize and raw.get("type") == "streamable_http" and "error" not in timings:
+            t0 = time.perf_counter()
+            rpc_headers = {**headers, "Accept": "application/json, text/event-stream"}
+            try:
+                resp = self.session.post(endpoint, json={
+                    "jsonrpc": "2.0", "id": 0, "method": "initialize",
+                    "params": {
+                        "protocolVersion": "2025-03-26",
+                        "capabilities": {},
+                        "clientInfo": {"name": "ai-coder", "version": "0.1"},
+                    },
+                }, headers=rpc_headers, timeout=timeout)
+                timings["initialize_status"] = resp.status_code
+                sid = resp.headers.get("Mcp-Session-Id")
+                resp.close()
+                if resp.ok:
+                    if sid:
+                        rpc_headers["Mcp-Session-Id"] = sid
+                    self.session.post(endpoint, json={"jsonrpc": "2.0", "method": "notifications/initialized"},
+                                      headers=rpc_headers, timeout=timeout).close()
+                    if sid:
+                        # 不再使用的会话按规范用 DELETE 结束（服务端不支持时返回 405，忽略）
+                        self.session.delete(endpoint, headers=rpc_headers, timeout=timeout).close()
+            except requests.RequestException as e:
+                timings["initialize_error"] = str(e)[:200]
+            timings["initialize_s"] = round(time.perf_counter() - t0, 4)
+        return timings
+
+    def _call(self, name: str, query: str, timeout: float | None = None) -> List[Dict[str, Any]]:
+        tool, endpoint = self._resolve(name)
+        method = (tool.get("method") or "POST").upper()
+        headers = self._headers(tool)
+
+        # timeout 由调用方按本轮剩余时间传入；未传时使用工具配置或 30 秒
+        timeout = timeout or tool.get("raw", {}).get("timeout") or 30
+        params_template = tool.get("params")
+        if params_template and isinstance(params_template, dict):
+            params = {k: (v.replace("{{query}}", query) if isinstance(v, str) else v) for k, v in params_template.items()}
+            if method == "GET":
+                send = lambda: self.session.get(endpoint, params=params, headers=headers, timeout=timeout, stream=True)
             else:
-                payload = {"query": query}
-                if tool.get("server_key"):
-                    payload["server"] = tool.get("server_key")
-                resp = requests.request(method, endpoint, json=payload, headers=headers, timeout=30)
+                send = lambda: self.session.post(endpoint, json=params, headers=headers, timeout=timeout, stream=True)
+        else:
+            payload = {"query": query}
+            if tool.get("server_key"):
+                payload["server"] = tool.get("server_key")
+            send = lambda: self.session.request(method, endpoint, json=payload, headers=headers, timeout=timeout,
+                                                stream=True)
+        max_bytes = settings.mcp_response_max_bytes
+        try:
+            # 开启录制/回放时，HTTP 交互经 cassette 录制或直接回放（见 cassette.active）
+            tape = cassette.active()
+            resp = tape.http((name, normalize_query(query)), send, max_bytes) if tape is not None else send()
+            if not resp.ok:
+                resp.close()
             resp.raise_for_status()
         except requests.RequestException as e:
             raise RuntimeError(f"MCP 调用失败: {e}")
 
+        # 正文按块读取并增量解析（上限 mcp_response_max_bytes 字节），取满 mcp_max_results 条结果即停止读取，
+        # 异常的超大响应不会整体进入内存
         try:
-            data = resp.json()
-            # 检查返回数据格式
-            if isinstance(data, list):
-                return data
-            elif isinstance(data, dict):
-                # 如果返回的是字典，尝试提取结果
-                # 常见的 MCP 返回格式：{"results": [...]} 或 {"data": [...]}
-                if "results" in data and isinstance(data["results"], list):
-                    return data["results"]
-                elif "data" in data and isinstance(data["data"], list):
-                    return data["data"]
-                elif "items" in data and isinstance(data["items"], list):
-                    return data["items"]
-                else:
-                    # 如果字典中没有列表，返回包装后的结果
-                    return [{"title": str(data.get("title", "MCP 响应")), 
-                            "snippet": str(data.get("content", data.get("message", str(data)))), 
-                            "url": endpoint}]
-            else:
-                # 其他类型，包装成列表
-                return [{"title": "MCP 响应", "snippet": str(data), "url": endpoint}]
-        except ValueError as e:
-            # JSON 解析失败
-            return [{"title": "(非 JSON 响应)", "snippet": resp.text[:500], "url": endpoint}]
+            results, stats = read_results(resp, endpoint, max_bytes, settings.mcp_max_results,
+                                          settings.mcp_snippet_max_chars, cancel=cancelled)
+        except requests.RequestException as e:
+            raise RuntimeError(f"MCP 调用失败: {e}")
+        if stats["cancelled"]:
+            # 读到一半被放弃：不完整的结果不能交给合并到这次调用上的其他调用方
+            check_cancelled()
+        if stats["capped"] and settings.debug:
+            print(f"⚠️  MCP 响应超过 {max_bytes} 字节，已截断（保留 {len(results)} 条结果）")
+        return results
 
 # 为兼容 pydantic v2（LangChain BaseTool 使用 pydantic），把字段声明为注解字段
 class WebSearchTool(BaseTool):
@@ -148,9 +227,12 @@ class WebSearchTool(BaseTool):
             raise RuntimeError("MCP 客户端没有注册任何工具/服务器")
         return available[0]
 
-    def _run(self, query: str) -> Any:
+    def search(self, query: str, timeout: float | None = None) -> Any:
         tool_name = self._choose_tool_name()
-        return self.client.call(tool_name, query)
+        return self.client.call(tool_name, query, timeout=timeout)
+
+    def _run(self, query: str) -> Any:
+        return self.search(query)
 
     async def _arun(self, query: str) -> Any:
         return self._run(query)
\ No newline at end of file
@@ -0,0 +1,77 @@
+from typing import Any, Callable, Dict, List, Tuple
+import threading
+import time
+
+
+class WarmUp:
+    """
+    后台预热：在用户输入第一个问题期间，依次执行加载编码器、建立连接池、MCP initialize 等步骤。
+    每个步骤独立计时、互不影响；失败只记录不抛出。
+    ready_seconds() 统计在第一个问题到达前已完成的步骤耗时。这是预热本身花掉的时间，不等于首轮查询省下的时间：
+    例如 MCP 步骤的 HEAD 与 initialize 往返都计在内，而首次调用本来只需承担建立连接的开销。
+    """
+
+    def __init__(self, steps: List[Tuple[str, Callable[[], Any]]]):
+        self.steps = steps
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self._thread: threading.Thread | None = None
+        self._done = threading.Event()
+        self._first_query_at: float | None = None
+
+    def start(self) -> "WarmUp":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="agent-warmup", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            for name, fn in self.steps:
+                t0 = time.perf_counter()
+                entry: Dict[str, Any] = {"ok": True, "error": ""}
+                try:
+                    fn()
+                except Exception as e:
+                    entry = {"ok": False, "error": str(e)[:200]}
+                entry["seconds"] = round(time.perf_counter() - t0, 4)
+                entry["finished_at"] = time.monotonic()
+                self.results[name] = entry
+        finally:
+            self._done.set()
+
+    @property
+    def started(self) -> bool:
+        return self._thread is not None
+
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._done.wait(timeout) if self.started else True
+
+    def mark_first_query(self):
+        """记录第一个问题到达的时刻（只记录一次）。"""
+        if self._first_query_at is None:
+            self._first_query_at = time.monotonic()
+
+    def ready_seconds(self) -> float:
+        cutoff = self._first_query_at if self._first_query_at is not None else time.monotonic()
+        return round(sum(
+            r["seconds"] for r in list(self.results.values())
+            if r["ok"] and r["finished_at"] <= cutoff
+        ), 3)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "started": self.started,
+            "done": self.done(),
+            "steps": {k: {kk: v for kk, v in r.items() if kk != "finished_at"} for k, r in self.results.items()},
+            "ready_before_first_query_s": self.ready_seconds(),
+        }
+
+    def summary_line(self) -> str:
+        if not self.started:
+            return "🔥 预热未启用"
+        parts = [f"{k} {'✅' if r['ok'] else '❌'}{r['seconds']:.2f}s" for k, r in list(self.results.items())]
+        status = "完成" if self.done() else "进行中"
+        return f"🔥 预热{status}: {', '.join(parts) or '(无)'}；首个问题前已完成 {self.ready_seconds():.2f}s"
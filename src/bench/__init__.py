@@ -0,0 +1 @@
+# 离线基准测试脚本（python -m src.bench.<name> 运行）
@@ -0,0 +1,334 @@
+# 基准测试：ConversationMemory 各压缩提示词的成本与事实保留率
+# 用法：python -m src.bench.compression [--keep 2,4,6] [--json] [--live] [--recording FILE [--record]]
+#   默认使用确定性的抽取式替身摘要器；--live 调用 agents.yaml 中配置的压缩模型，
+#   --recording 读取/（配合 --record）写入按提示词哈希保存的摘要结果，便于离线复现真实模型的输出。
+import argparse
+import hashlib
+import importlib.util
+import json
+import re
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from langchain_core.messages import AIMessage
+
+from src.agent.memory import ConversationMemory, count_tokens
+from src.agent.prompt import MEMORY_SUMMARIZE_PROMPT
+from src.config.settings import settings
+
+_ROOT = Path(__file__).resolve().parents[2]
+
+# 无事实的填充句：模拟回答中的解释性内容，使压缩有意义
+_FILLER = ("具体来说，这一部分需要结合团队现有的技术储备和后续的维护成本综合考虑。"
+           "一般而言，先保证功能可用，再逐步优化性能和可观测性，是比较稳妥的做法。")
+
+# 植入事实：(编号, 类别, 用于判定是否保留的关键字符串)
+_FACTS_A: List[Tuple[str, str, str]] = [
+    ("spring", "version", "Spring Boot 3.2.1"),
+    ("jdk", "version", "JDK 17"),
+    ("vue", "version", "Vue 3.4"),
+    ("howler", "version", "Howler.js 2.2.4"),
+    ("pg", "decision", "PostgreSQL 15"),
+    ("minio", "decision", "MinIO"),
+    ("e413", "error", "413 Request Entity Too Large"),
+    ("multipart", "config", "max-file-size"),
+    ("nginx", "config", "client_max_body_size"),
+    ("oom", "error", "java.lang.OutOfMemoryError"),
+    ("xmx", "config", "-Xmx512m"),
+    ("redis", "decision", "SRANDMEMBER"),
+    ("played", "config", "played:{roomId}"),
+    ("server", "constraint", "2 核 4G"),
+    ("pgdata", "config", "pgdata"),
+    ("safari", "open_issue", "Safari"),
+]
+
+_SCRIPT_A: List[Tuple[str, str]] = [
+    ("user", "我要做一个猜歌网站，后端打算用 Spring Boot 3.2.1，JDK 17。"),
+    ("assistant", "建议前后端分离，前端 Vue 3.4 + Vite 5，音频播放用 Howler.js 2.2.4。" + _FILLER),
+    ("user", "数据库决定用 PostgreSQL 15，不用 MySQL，因为需要全文检索。"),
+    ("assistant", "好的，歌曲表 songs 含 title、artist、file_key 字段，file_key 指向 MinIO 对象存储。" + _FILLER),
+    ("user", "上传 20MB 的 mp3 时报错 413 Request Entity Too Large。"),
+    ("assistant", "需要把 spring.servlet.multipart.max-file-size 调到 50MB，"
+                  "同时 Nginx 的 client_max_body_size 设为 50m。" + _FILLER),
+    ("user", "调整后又出现 java.lang.OutOfMemoryError: Java heap space。"),
+    ("assistant", "改为流式写入 MinIO，避免整个文件读入内存；JVM 参数 -Xmx512m 即可。" + _FILLER),
+    ("user", "随机播放要避免重复，我们决定用 Redis 7 的 SRANDMEMBER 做抽样。"),
+    ("assistant", "可以，每个房间维护一个已播放集合 played:{roomId}，过期时间 2 小时。" + _FILLER),
+    ("user", "部署打算用 Docker Compose，服务器是 2 核 4G。"),
+    ("assistant", "建议 Compose 中为 PostgreSQL 挂载卷 pgdata，并开启 healthcheck。" + _FILLER),
+    ("user", "还有个问题没解决：Safari 上 Howler 的自动播放被拦截。"),
+    ("assistant", "需要在用户首次点击后再调用 play()，这是浏览器的自动播放策略。" + _FILLER),
+    ("user", "好的，先这样，下一步做排行榜。"),
+    ("assistant", "排行榜可以用有序集合实现，按答对次数排序。" + _FILLER),
+]
+
+_FACTS_B: List[Tuple[str, str, str]] = [
+    ("py", "version", "Python 3.11"),
+    ("fastapi", "version", "FastAPI 0.110"),
+    ("ch", "decision", "ClickHouse"),
+    ("kafka", "decision", "Kafka 3.6"),
+    ("lag", "error", "ConsumerLagExceeded"),
+    ("batch", "config", "max_poll_records=500"),
+    ("ttl", "config", "TTL 30 天"),
+    ("budget", "constraint", "每月 3000 元"),
+    ("tz", "open_issue", "时区"),
+]
+
+_SCRIPT_B: List[Tuple[str, str]] = [
+    ("user", "我们要做日志分析平台，服务端用 Python 3.11 和 FastAPI 0.110。"),
+    ("assistant", "存储建议用列式数据库。" + _FILLER),
+    ("user", "已经决定存储用 ClickHouse，采集走 Kafka 3.6。"),
+    ("assistant", "可以，Kafka 分区数按峰值吞吐估算。" + _FILLER),
+    ("user", "压测时消费者报 ConsumerLagExceeded。"),
+    ("assistant", "把 max_poll_records=500 调大并增加消费者实例数。" + _FILLER),
+    ("user", "日志保留 TTL 30 天，预算每月 3000 元以内。"),
+    ("assistant", "ClickHouse 表按天分区并设置 TTL，冷数据可以转存对象存储。" + _FILLER),
+    ("user", "还有一个未解决的问题：不同机房的时区不一致导致聚合错位。"),
+    ("assistant", "入库时统一转换为 UTC，并在查询层按用户时区展示。" + _FILLER),
+    ("user", "明白了，下一步做告警规则。"),
+    ("assistant", "告警规则可以基于物化视图定期计算。" + _FILLER),
+]
+
+SCENARIOS: Dict[str, Tuple[List[Tuple[str, str]], List[Tuple[str, str, str]]]] = {
+    "guess_song": (_SCRIPT_A, _FACTS_A),
+    "log_platform": (_SCRIPT_B, _FACTS_B),
+}
+
+
+def load_strategies() -> Dict[str, str]:
+    """三种压缩提示词：包内的 MEMORY_SUMMARIZE_PROMPT，以及根目录 prompt.py 中的两种结构化提示词。"""
+    strategies = {"default": MEMORY_SUMMARIZE_PROMPT}
+    spec = importlib.util.spec_from_file_location("_root_prompt", _ROOT / "prompt.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    strategies["structured"] = module.STRUCTURED_COMPRESSION_PROMPT
+    strategies["aggressive"] = module.AGGRESSIVE_COMPRESSION_PROMPT
+    return strategies
+
+
+_HISTORY_RE = re.compile(r"对话历史：\n(.*?)\n\n请", re.S)
+_LINE_PREFIX_RE = re.compile(r"^\d+\. \[\w+\] ")
+_SENT_RE = re.compile(r"[^。；！？\n]+[。；！？]?")
+_FACTLIKE_RE = re.compile(r"\d+\.\d+|\d+\s*(?:MB|GB|核|天|元)|[A-Za-z]+Error|[A-Z][a-z]+[A-Z]\w+|\d{3} [A-Z]|"
+                          r"决定|采用|改为|设为|调到|参数|问题|报错|用 [A-Za-z]")
+
+
+class ExtractiveSummarizer:
+    """
+    确定性的抽取式替身摘要器：按提示词给出的长度上限从历史中抽取句子。
+      - 自由文本提示词（MEMORY_SUMMARIZE_PROMPT）按原文顺序截取，直到“控制在 N 字以内”的上限；
+      - 结构化提示词（含 decisions 字段）优先抽取含版本号、错误、决策、配置的句子并输出 JSON，
+        若提示词规定了“决策保留 x-y 条”等上限则按上限截断。
+    这只是模型行为的粗略代理：它衡量的是各提示词的长度约束和结构约束带来的差别，
+    真实的保留率请用 --live 或 --recording 复测。
+    """
+
+    def __init__(self, prefill_tps: float = 2000.0, decode_tps: float = 40.0):
+        self.prefill_tps = prefill_tps
+        self.decode_tps = decode_tps
+        self.modeled_seconds = 0.0
+
+    @staticmethod
+    def _sentences(prompt: str) -> List[str]:
+        m = _HISTORY_RE.search(prompt)
+        history = m.group(1) if m else prompt
+        out = []
+        for line in history.split("\n"):
+            line = _LINE_PREFIX_RE.sub("", line.strip())
+            out.extend(s.strip() for s in _SENT_RE.findall(line) if s.strip())
+        return out
+
+    def _summarize(self, prompt: str) -> str:
+        sentences = self._sentences(prompt)
+        if '"decisions"' not in prompt:
+            limit = int(m.group(1)) if (m := re.search(r"控制在(\d+)字以内", prompt)) else 1000
+            picked, used = [], 0
+            for s in sentences:
+                if used + len(s) > limit:
+                    break
+                picked.append(s)
+                used += len(s)
+            return "".join(picked)
+
+        facts = [s for s in sentences if _FACTLIKE_RE.search(s)]
+        cap = int(m.group(2)) if (m := re.search(r"决策保留(\d+)-(\d+)条", prompt)) else len(facts)
+        summary_limit = int(m.group(2)) if (m := re.search(r"控制在(\d+)-(\d+)字", prompt)) else 200
+        # 按上限截断时优先保留较新的事实
+        kept = facts[-cap:] if cap < len(facts) else facts
+        questions = [s for s in kept if "问题" in s or "报错" in s]
+        decisions = [s for s in kept if s not in questions]
+        return json.dumps({
+            "summary": "".join(sentences[:2])[:summary_limit],
+            "decisions": decisions,
+            "open_questions": questions,
+            "experiments": [],
+            "timeline": [],
+            "notes": None,
+        }, ensure_ascii=False)
+
+    def invoke(self, value: Any, **kwargs: Any) -> AIMessage:
+        prompt = value.to_string() if hasattr(value, "to_string") else str(getattr(value, "content", value))
+        text = self._summarize(prompt)
+        tokens_in, tokens_out = count_tokens(prompt), count_tokens(text)
+        self.modeled_seconds += tokens_in / self.prefill_tps + tokens_out / self.decode_tps
+        return AIMessage(content=text, usage_metadata={
+            "input_tokens": tokens_in, "output_tokens": tokens_out, "total_tokens": tokens_in + tokens_out,
+        })
+
+    def __call__(self, value: Any) -> AIMessage:
+        return self.invoke(value)
+
+
+class RecordingSummarizer:
+    """按提示词 sha1 读取已录制的摘要；record=True 时未命中的提示词交给 inner 生成并写回文件。"""
+
+    def __init__(self, path: str, inner: Any = None, record: bool = False):
+        self.path = Path(path)
+        self.inner = inner
+        self.record = record
+        self.entries: Dict[str, str] = json.loads(self.path.read_text(encoding="utf-8")) if self.path.exists() else {}
+
+    def invoke(self, value: Any, **kwargs: Any) -> AIMessage:
+        prompt = value.to_string() if hasattr(value, "to_string") else str(getattr(value, "content", value))
+        key = hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+        if key not in self.entries:
+            if not self.record or self.inner is None:
+                raise KeyError(f"录制文件中没有该提示词的摘要: {key}")
+            out = self.inner.invoke(prompt)
+            self.entries[key] = getattr(out, "content", str(out))
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(json.dumps(self.entries, ensure_ascii=False, indent=1), encoding="utf-8")
+        return AIMessage(content=self.entries[key])
+
+    def __call__(self, value: Any) -> AIMessage:
+        return self.invoke(value)
+
+
+def _live_summarizer():
+    from langchain_openai import ChatOpenAI
+
+    settings.load_agents()
+    cfg = settings.get_agent_config("research")
+    return ChatOpenAI(
+        model=cfg.get("memory_summary_model", cfg.get("model")),
+        api_key=cfg.get("api_key"),
+        base_url=cfg.get("base_url"),
+        temperature=0.2,
+        max_tokens=1024,
+    )
+
+
+def run_one(scenario: str, prompt: str, keep_last_n: int, summarizer: Any) -> Dict[str, Any]:
+    script, facts = SCENARIOS[scenario]
+    memory = ConversationMemory(summarize_prompt=prompt, keep_last_n=keep_last_n,
+                                compress_after=max(settings.memory_compress_after, keep_last_n + 2))
+    memory.summarizer_llm = summarizer
+    compressions = []
+    compressed_facts: set = set()
+    for role, text in script:
+        memory.add(role, text)
+        before = memory.token_length()
+        pending = [m.content for m in memory.messages]
+        memory.last_compression = None
+        memory.maybe_compress()
+        if memory.last_compression is None:
+            continue
+        # 被压缩掉的消息中出现过的事实
+        gone = "\n".join(pending[:memory.last_compression["messages"]])
+        compressed_facts.update(fid for fid, _, probe in facts if probe in gone)
+        compressions.append({**memory.last_compression, "tokens_before": before, "tokens_after": memory.token_length()})
+
+    summary = memory.compressed_context or ""
+    visible = summary + "\n" + "\n".join(m.content for m in memory.messages)
+    lost = [fid for fid, _, probe in facts if probe not in visible]
+    by_kind: Dict[str, List[int]] = {}
+    for fid, kind, _ in facts:
+        by_kind.setdefault(kind, []).append(fid not in lost)
+    in_summary = [fid for fid in compressed_facts if any(p in summary for f, _, p in facts if f == fid)]
+
+    n = len(compressions)
+    return {
+        "scenario": scenario,
+        "keep_last_n": keep_last_n,
+        "compressions": n,
+        "tokens_before_avg": round(sum(c["tokens_before"] for c in compressions) / n, 1) if n else None,
+        "tokens_after_avg": round(sum(c["tokens_after"] for c in compressions) / n, 1) if n else None,
+        "summarizer_input_tokens": sum(c["prompt_tokens"] for c in compressions),
+        "summarizer_output_tokens": sum(c["summary_tokens"] for c in compressions),
+        "compression_seconds": round(sum(c["seconds"] for c in compressions), 4),
+        "final_tokens": memory.token_length(),
+        "retention": round(1 - len(lost) / len(facts), 3),
+        # 只统计被压缩过的事实在最终摘要中的保留率（不含仍在最近消息里的事实）
+        "summary_retention": round(len(in_summary) / len(compressed_facts), 3) if compressed_facts else None,
+        "retention_by_kind": {k: round(sum(v) / len(v), 3) for k, v in by_kind.items()},
+        "lost": lost,
+    }
+
+
+def run(keep_values: List[int], summarizer_factory) -> Dict[str, Any]:
+    strategies = load_strategies()
+    results = []
+    for name, prompt in strategies.items():
+        for k in keep_values:
+            for scenario in SCENARIOS:
+                summarizer = summarizer_factory()
+                t0 = time.perf_counter()
+                row = run_one(scenario, prompt, k, summarizer)
+                row["strategy"] = name
+                row["wall_seconds"] = round(time.perf_counter() - t0, 4)
+                if isinstance(summarizer, ExtractiveSummarizer):
+                    row["modeled_llm_seconds"] = round(summarizer.modeled_seconds, 3)
+                results.append(row)
+
+    summary = []
+    for name in strategies:
+        for k in keep_values:
+            rows = [r for r in results if r["strategy"] == name and r["keep_last_n"] == k]
+            summary.append({
+                "strategy": name,
+                "keep_last_n": k,
+                "retention": round(sum(r["retention"] for r in rows) / len(rows), 3),
+                "final_tokens": sum(r["final_tokens"] for r in rows),
+                "summarizer_input_tokens": sum(r["summarizer_input_tokens"] for r in rows),
+                "summarizer_output_tokens": sum(r["summarizer_output_tokens"] for r in rows),
+                "compression_seconds": round(sum(r["compression_seconds"] for r in rows), 4),
+                # 替身摘要器按预填充/解码速度估算的模型耗时
+                "modeled_llm_seconds": round(sum(r.get("modeled_llm_seconds", 0.0) for r in rows), 3),
+            })
+    return {"keep_last_n": keep_values, "scenarios": list(SCENARIOS), "results": results, "summary": summary}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ConversationMemory 压缩提示词的成本与事实保留率")
+    parser.add_argument("--keep", default="2,4,6", help="逗号分隔的 keep_last_n 取值")
+    parser.add_argument("--live", action="store_true", help="使用 agents.yaml 中配置的真实压缩模型")
+    parser.add_argument("--recording", help="录制文件（JSON）：按提示词哈希保存的摘要结果")
+    parser.add_argument("--record", action="store_true", help="录制文件未命中时调用真实模型并写回")
+    parser.add_argument("--json", action="store_true", help="输出机器可读 JSON")
+    args = parser.parse_args()
+
+    keep_values = [int(x) for x in args.keep.split(",") if x.strip()]
+    if args.recording:
+        inner = _live_summarizer() if args.record else None
+        factory = lambda: RecordingSummarizer(args.recording, inner, record=args.record)
+    elif args.live:
+        live = _live_summarizer()
+        factory = lambda: live
+    else:
+        factory = ExtractiveSummarizer
+
+    report = run(keep_values, factory)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    print(f"{'策略':<12}{'keep':>6}{'保留率':>8}{'最终tokens':>12}{'压缩输入':>10}{'压缩输出':>10}"
+          f"{'耗时s':>9}{'估算模型s':>10}")
+    for row in report["summary"]:
+        print(f"{row['strategy']:<12}{row['keep_last_n']:>6}{row['retention']:>8.2f}{row['final_tokens']:>12}"
+              f"{row['summarizer_input_tokens']:>10}{row['summarizer_output_tokens']:>10}"
+              f"{row['compression_seconds']:>9.3f}{row['modeled_llm_seconds']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+# 基准测试用的离线替身：确定性的 LLM 与 MCP 客户端，带可配置的延迟与失败率
+import json
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+from langchain_core.messages import AIMessage
+
+_REF_RE = re.compile(r"^\[(\d+)\]", re.M)
+
+
+class FakeChatModel:
+    """
+    模拟 ChatOpenAI 的 invoke/bind 接口。根据提示词内容返回结构合法的输出：
+    规划提示返回 JSON 子问题数组，质疑提示返回 critique JSON，其他提示返回引用了片段编号的 Markdown。
+    返回 AIMessage，并附带按字符粗估的 usage_metadata。
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, fail_rate: float = 0.0,
+                 seed: int = 0, model_name: str = "fake-llm", answer_chars: int = 800, **bound: Any):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.model_name = model_name
+        self.answer_chars = answer_chars
+        self.bound = bound
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def bind(self, **kwargs: Any) -> "FakeChatModel":
+        # model_name 可被覆盖，用于模拟分阶段路由到其他模型
+        model_name = kwargs.pop("model_name", self.model_name)
+        clone = type(self)(self.latency, self.jitter, self.fail_rate, 0, model_name,
+                              self.answer_chars, **{**self.bound, **kwargs})
+        clone._rng, clone._lock = self._rng, self._lock
+        return clone
+
+    def _sleep_or_fail(self):
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+            fail = self._rng.random() < self.fail_rate
+        time.sleep(delay)
+        if fail:
+            raise RuntimeError("fake llm: injected failure")
+
+    def _reply(self, prompt: str) -> str:
+        if "JSON 数组" in prompt and "subq" in prompt:
+            topic = prompt.split("\n", 2)[1][:40] if "\n" in prompt else prompt[:40]
+            n = int(m.group(1)) if (m := re.search(r"最多 (\d+) 个", prompt)) else 3
+            return json.dumps([{"subq": f"{topic} 方面{i + 1}", "reason": "fake"} for i in range(n)], ensure_ascii=False)
+        if '"edits"' in prompt:
+            # 增量质疑：第一步点名章节并要求新搜索，第二步给出章节内容
+            if "需要修改或新增的章节" in prompt:
+                refs = _REF_RE.findall(prompt)[:2] or ["1"]
+                return json.dumps({"edits": [{"action": "replace", "section": "回答",
+                                              "content": "".join(f"补充结论 [{r}]。" for r in refs)}]},
+                                  ensure_ascii=False)
+            return json.dumps({"need_new_search": True, "new_subquestions": ["补充问题1", "补充问题2"],
+                               "edits": [{"action": "replace", "section": "回答"}]}, ensure_ascii=False)
+        if "improved_answer" in prompt:
+            return json.dumps({"need_new_search": False, "new_subquestions": [],
+                               "improved_answer": "## 改进\n" + "补充说明。" * 20}, ensure_ascii=False)
+        refs = _REF_RE.findall(prompt)[:6] or ["1"]
+        body = "".join(f"结论{i} [{r}]。" for i, r in enumerate(refs, 1))
+        max_tokens = self.bound.get("max_tokens")
+        limit = min(self.answer_chars, max_tokens * 2) if max_tokens else self.answer_chars
+        return ("## 回答\n" + body + "细节。" * (limit // 3))[:limit]
+
+    def invoke(self, messages: Any, **kwargs: Any) -> AIMessage:
+        self._sleep_or_fail()
+        if isinstance(messages, list):
+            prompt = str(getattr(messages[-1], "content", messages[-1]))
+            prompt_chars = sum(len(str(getattr(m, "content", m))) for m in messages)
+        elif isinstance(messages, dict):
+            prompt = str(next(iter(messages.values()), ""))
+            prompt_chars = len(prompt)
+        else:
+            # 兼容 PromptValue（ConversationMemory 的 PromptTemplate | llm 链会传入它）
+            prompt = messages.to_string() if hasattr(messages, "to_string") else str(getattr(messages, "content", messages))
+            prompt_chars = len(prompt)
+        text = self._reply(prompt)
+        return AIMessage(content=text, usage_metadata={
+            "input_tokens": prompt_chars // 2,
+            "output_tokens": len(text) // 2,
+            "total_tokens": prompt_chars // 2 + len(text) // 2,
+        })
+
+    def __call__(self, value: Any) -> AIMessage:
+        # 可调用，便于被 LangChain 的 pipe() 包装为 Runnable
+        return self.invoke(value)
+
+
+class FakeMCPClient:
+    """模拟 MCPToolClient.call：每次返回 results_per_call 条带唯一 URL 的结果。"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, fail_rate: float = 0.0,
+                 results_per_call: int = 5, snippet_chars: int = 300, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.results_per_call = results_per_call
+        self.snippet_chars = snippet_chars
+        self.tools: Dict[str, Any] = {"web_search": {"name": "web_search", "endpoint": "fake://search"}}
+        self.agent_tools: Dict[str, Any] = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def list_tools(self) -> List[str]:
+        return list(self.tools)
+
+    def call(self, name: str, query: str, timeout: float | None = None, **kwargs: Any) -> List[Dict[str, Any]]:
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+            fail = self._rng.random() < self.fail_rate
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise RuntimeError("MCP 调用失败: fake timeout")
+        time.sleep(delay)
+        if fail:
+            raise RuntimeError("MCP 调用失败: injected failure")
+        slug = re.sub(r"\W+", "-", query).strip("-") or "q"
+        text = (f"{query} 的相关资料。" * (self.snippet_chars // 8 + 1))[: self.snippet_chars]
+        return [
+            {"title": f"{query} #{i}", "snippet": text, "url": f"https://example.com/{slug}/{i}"}
+            for i in range(self.results_per_call)
+        ]
+
+
+@contextmanager
+def overridden(**values: Any) -> Iterator[None]:
+    """临时修改全局 settings 的若干字段，退出时恢复原值：基准脚本被其他代码导入调用时不改变进程的配置。"""
+    from src.config.settings import settings
+
+    saved = {name: getattr(settings, name) for name in values}
+    try:
+        for name, value in values.items():
+            setattr(settings, name, value)
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(settings, name, value)
+
+
+def make_agent(llm: FakeChatModel | None = None, client: FakeMCPClient | None = None, **kwargs: Any):
+    """构造一个使用离线替身的 ResearchAgent（仍读取正常的 agents.yaml / mcp.json 完成初始化）。"""
+    from src.agent.research_agent import ResearchAgent
+
+    kwargs.setdefault("warm_up", False)
+    agent = ResearchAgent(**kwargs)
+    agent.llm = llm or FakeChatModel()
+    agent.llm_factory = lambda model: agent.llm.bind(model_name=model)
+    agent._stage_llms.clear()
+    search = agent.tools.get("web_search")
+    if search is not None:
+        search.client = client or FakeMCPClient()
+    return agent
+
+
+class StandInMCPServer:
+    """
+    本地 HTTP 替身 MCP 服务器（ThreadingHTTPServer，后台线程运行），供 debug_mcp 等离线探测使用。
+    POST/GET 均返回 {"results": [...]}；latency/jitter 模拟服务端处理耗时，
+    rate_limit > 0 时按令牌桶（容量 burst）限流，超出部分返回 429，用于验证限流前可持续吞吐的测量；
+    fail_rate 为随机返回 503 的比例。
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, rate_limit: float = 0.0, burst: float | None = None,
+                 results_per_call: int = 5, snippet_chars: int = 300, seed: int = 0, fail_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.rate_limit = rate_limit
+        # 默认允许约 1/4 秒的突发，避免同一时刻到达的并发请求被误判为超限
+        self.burst = max(burst if burst is not None else rate_limit / 4, 1.0)
+        self.results_per_call = results_per_call
+        self.snippet_chars = snippet_chars
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._refilled = time.monotonic()
+        self.requests = 0
+        self.throttled = 0
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/mcp"
+
+    def _admit(self) -> tuple:
+        with self._lock:
+            self.requests += 1
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+            if self.fail_rate and self._rng.random() < self.fail_rate:
+                return 503, delay
+            if self.rate_limit <= 0:
+                return True, delay
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate_limit)
+            self._refilled = now
+            if self._tokens < 1.0:
+                self.throttled += 1
+                return False, 0.0
+            self._tokens -= 1.0
+            return True, delay
+
+    def _payload(self, query: str) -> bytes:
+        slug = re.sub(r"\W+", "-", query).strip("-") or "q"
+        text = (f"{query} 的相关资料。" * (self.snippet_chars // 8 + 1))[: self.snippet_chars]
+        results = [{"title": f"{query} #{i}", "snippet": text, "url": f"https://example.com/{slug}/{i}"}
+                   for i in range(self.results_per_call)]
+        return json.dumps({"results": results}, ensure_ascii=False).encode("utf-8")
+
+    def start(self) -> "StandInMCPServer":
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import parse_qs, urlparse
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _reply(self, query: str):
+                ok, delay = server._admit()
+                if ok == 503:
+                    time.sleep(delay)
+                    body = b'{"error": "injected failure"}'
+                    self.send_response(503)
+                elif not ok:
+                    body = b'{"error": "rate limited"}'
+                    self.send_response(429)
+                    self.send_header("Retry-After", "1")
+                else:
+                    time.sleep(delay)
+                    body = server._payload(query)
+                    self.send_response(200)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                try:
+                    query = str((json.loads(raw or b"{}") or {}).get("query", ""))
+                except ValueError:
+                    query = ""
+                self._reply(query)
+
+            def do_GET(self):
+                self._reply((parse_qs(urlparse(self.path).query).get("query") or [""])[0])
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            # 默认 backlog 只有 5，高并发探测时会出现 SYN 重传导致的秒级建连延迟
+            request_queue_size = 128
+
+        self._httpd = Server(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="standin-mcp", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self) -> "StandInMCPServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
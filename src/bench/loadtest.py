@@ -0,0 +1,197 @@
+# 并发会话压测：N 个模拟用户各自持有一个 ResearchAgent，按 ask/continue/critique 脚本并发运行，
+# LLM 使用带延迟/失败率配置的离线替身，MCP 走真实的 MCPToolClient → 本地替身 HTTP 服务器。
+# 逐级提高并发，报告吞吐、尾延迟、错误率、每会话 RSS 增量与调度排队，并给出饱和点。
+# 用法：python -m src.bench.loadtest [--levels 1,2,4,8,16] [--turns 3] [--profile fast|realistic|flaky] [--json]
+import argparse
+import contextlib
+import io
+import json
+import resource
+import threading
+import time
+from typing import Any, Dict, List
+
+from src.agent.scheduler import metrics as scheduler_metrics, reset_metrics as reset_scheduler_metrics
+from src.agent.tools import MCPToolClient
+from src.bench.fakes import FakeChatModel, FakeMCPClient, StandInMCPServer, make_agent, overridden
+from src.config.settings import settings
+
+# 延迟配置（秒）：llm / mcp 的基础延迟、抖动与失败率
+PROFILES: Dict[str, Dict[str, Any]] = {
+    "fast": {"llm": (0.05, 0.02, 0.0), "mcp": (0.02, 0.01, 0.0)},
+    "realistic": {"llm": (0.8, 0.4, 0.01), "mcp": (0.3, 0.15, 0.01)},
+    "flaky": {"llm": (0.3, 0.2, 0.1), "mcp": (0.2, 0.1, 0.1)},
+}
+
+_SCRIPT = [
+    ("ask", "如何设计一个支持上传和随机播放的猜歌网站"),
+    ("continue", "后端用 Spring Boot 3.2 可以吗"),
+    ("critique", "请补充数据库表结构设计的细节"),
+    ("ask", "前端音频播放有哪些坑"),
+    ("continue", "部署用 Docker Compose 需要注意什么"),
+]
+
+
+def _rss_bytes() -> int:
+    """当前进程 RSS；/proc 不可用时退回到峰值 RSS。"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))], 3)
+
+
+def _user(uid: int, level: int, turns: int, llm: FakeChatModel, mcp_factory, out: List[Dict[str, Any]],
+          agents: List[Any], lock: threading.Lock):
+    agent = make_agent(llm, mcp_factory(), session_id=f"load-{level}-{uid}")
+    with lock:
+        agents.append(agent)
+    for t in range(turns):
+        kind, text = _SCRIPT[(uid + t) % len(_SCRIPT)] if t else _SCRIPT[0]
+        text = f"{text}（用户{uid} 第{t + 1}轮）"
+        t0 = time.perf_counter()
+        rec: Dict[str, Any] = {"kind": kind, "ok": True, "degraded": False}
+        try:
+            if kind == "ask":
+                r = agent.ask(text)
+                rec["degraded"] = bool(r.get("cut"))
+            elif kind == "critique":
+                agent.critique(text)
+            else:
+                agent.continue_dialog(text)
+        except Exception as e:
+            rec["ok"] = False
+            rec["error"] = type(e).__name__
+        rec["seconds"] = time.perf_counter() - t0
+        with lock:
+            out.append(rec)
+
+
+def run_level(level: int, turns: int, llm: FakeChatModel, mcp_factory) -> Dict[str, Any]:
+    records: List[Dict[str, Any]] = []
+    agents: List[Any] = []
+    lock = threading.Lock()
+    # 排队等待只统计本级别：调度器是进程级共享的，不清空会把前面各级的等待累计进来
+    reset_scheduler_metrics()
+    rss0 = _rss_bytes()
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=_user, args=(i, level, turns, llm, mcp_factory, records, agents, lock))
+               for i in range(level)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    wall = time.perf_counter() - t0
+    # 会话对象在测量 RSS 时仍然存活
+    rss1 = _rss_bytes()
+    latencies = [r["seconds"] for r in records if r["ok"]]
+    errors: Dict[str, int] = {}
+    for r in records:
+        if not r["ok"]:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+    waits = {name: s["classes"]["interactive"]["wait_p95_s"] for name, s in scheduler_metrics().items()}
+    del agents
+    return {
+        "users": level,
+        "turns": len(records),
+        "wall_seconds": round(wall, 3),
+        "throughput_tps": round(len(latencies) / wall, 3) if wall > 0 else 0.0,
+        "p50_s": _percentile(latencies, 0.5),
+        "p95_s": _percentile(latencies, 0.95),
+        "p99_s": _percentile(latencies, 0.99),
+        "error_rate": round(1 - len(latencies) / len(records), 4) if records else 0.0,
+        "degraded": sum(1 for r in records if r["degraded"]),
+        "errors": errors,
+        "rss_mb": round(rss1 / 2**20, 1),
+        "rss_per_session_kb": round((rss1 - rss0) / 1024 / level, 1),
+        "queue_wait_p95_s": waits,
+    }
+
+
+def saturation(levels: List[Dict[str, Any]], min_gain: float = 0.1, max_error_rate: float = 0.05) -> Dict[str, Any]:
+    """吞吐增长低于 min_gain、或错误率超过阈值的第一个并发级别视为饱和，饱和点取其前一级。"""
+    for prev, cur in zip(levels, levels[1:]):
+        if cur["error_rate"] > max_error_rate:
+            return {"users": prev["users"], "reason": f"{cur['users']} 个用户时错误率 {cur['error_rate']:.0%}"}
+        gain = (cur["throughput_tps"] - prev["throughput_tps"]) / prev["throughput_tps"] if prev["throughput_tps"] else 0
+        if gain < min_gain:
+            return {"users": prev["users"],
+                    "reason": f"{cur['users']} 个用户时吞吐仅增长 {gain:.0%}，p95 {prev['p95_s']}s → {cur['p95_s']}s"}
+    return {"users": None, "reason": "在测试的并发范围内未饱和"}
+
+
+def run(levels: List[int], turns: int = 3, profile: str = "fast", mcp: str = "http", seed: int = 0) -> Dict[str, Any]:
+    cfg = PROFILES[profile]
+    # 压测期间关闭调试输出、预热、归档与账本，结束后恢复
+    with overridden(debug=False, warmup_enabled=False, memory_archive_enabled=False, ledger_enabled=False):
+        return _run(levels, turns, profile, mcp, seed, cfg)
+
+
+def _run(levels: List[int], turns: int, profile: str, mcp: str, seed: int, cfg: Dict[str, Any]) -> Dict[str, Any]:
+    llm = FakeChatModel(*cfg["llm"], seed=seed)
+
+    server = None
+    if mcp == "http":
+        latency, jitter, fail = cfg["mcp"]
+        server = StandInMCPServer(latency=latency, jitter=jitter, seed=seed, fail_rate=fail).start()
+
+        def mcp_factory():
+            client = MCPToolClient(settings.mcp_config_path)
+            for tool in client.tools.values():
+                tool.update(endpoint=server.url, params=None)
+            return client
+    else:
+        mcp_factory = lambda: FakeMCPClient(*cfg["mcp"], seed=seed)
+
+    results = []
+    try:
+        # agent 内部的进度输出在压测中没有意义
+        with contextlib.redirect_stdout(io.StringIO()):
+            # 预热一轮：编码器、导入与连接池的一次性开销不计入首个级别的 RSS 与延迟
+            run_level(1, 1, llm, mcp_factory)
+            for level in levels:
+                results.append(run_level(level, turns, llm, mcp_factory))
+    finally:
+        if server is not None:
+            server.stop()
+    return {"profile": profile, "mcp": mcp, "turns_per_user": turns,
+            "scheduler_capacity": {"llm": settings.scheduler_llm_concurrency, "mcp": settings.scheduler_mcp_concurrency},
+            "levels": results, "saturation": saturation(results)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ResearchAgent 并发会话压测")
+    parser.add_argument("--levels", default="1,2,4,8,16", help="逐级并发用户数")
+    parser.add_argument("--turns", type=int, default=3, help="每个用户的轮数")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="fast")
+    parser.add_argument("--mcp", choices=["http", "inproc"], default="http",
+                        help="http: MCPToolClient + 本地替身服务器；inproc: 进程内 FakeMCPClient")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="输出机器可读 JSON")
+    args = parser.parse_args()
+
+    report = run([int(x) for x in args.levels.split(",") if x.strip()], args.turns, args.profile, args.mcp, args.seed)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    print(f"🏋️  压测: 配置 {report['profile']}，MCP {report['mcp']}，每用户 {report['turns_per_user']} 轮，"
+          f"调度上限 LLM {report['scheduler_capacity']['llm']} / MCP {report['scheduler_capacity']['mcp']}")
+    print(f"{'用户':>4} {'吞吐(轮/s)':>10} {'p50':>7} {'p95':>7} {'p99':>7} {'错误率':>6} {'降级':>4} "
+          f"{'RSS(MB)':>8} {'每会话(KB)':>10} {'排队p95(LLM)':>12}")
+    for r in report["levels"]:
+        print(f"{r['users']:>4} {r['throughput_tps']:>10} {r['p50_s']:>7} {r['p95_s']:>7} {r['p99_s']:>7} "
+              f"{r['error_rate']:>6.0%} {r['degraded']:>4} {r['rss_mb']:>8} {r['rss_per_session_kb']:>10} "
+              f"{r['queue_wait_p95_s']['llm']:>12}")
+    sat = report["saturation"]
+    print(f"\n📍 饱和点: {sat['users']} 个并发用户（{sat['reason']}）" if sat["users"] else f"\n📍 {sat['reason']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# 基准测试：每 1k 个会话的 ConversationMemory 内存占用
+# 用法：python -m src.bench.memory_footprint [--sessions 1000] [--turns 40] [--json]
+from collections import deque
+import argparse
+import json
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+from src.agent.memory import ConversationMemory
+from src.config.settings import settings
+
+
+@dataclass
+class _LegacyMessage:
+    role: str
+    content: str
+
+
+@dataclass
+class _LegacyMemory:
+    """重构前的布局：普通 dataclass 消息 + 无界 list，as_list() 每次重建 dict 列表。"""
+    messages: List[_LegacyMessage] = field(default_factory=list)
+    compressed_context: str | None = None
+
+    def add(self, role: str, content: str):
+        self.messages.append(_LegacyMessage(role=role, content=content))
+
+    def as_list(self) -> List[Dict[str, str]]:
+        result = []
+        if self.compressed_context:
+            result.append({"role": "system", "content": f"[COMPRESSED_CONTEXT]\n{self.compressed_context}"})
+        for m in self.messages:
+            result.append({"role": m.role, "content": m.content})
+        return result
+
+
+def _content(session: int, turn: int, size: int) -> str:
+    base = f"会话{session} 第{turn}轮 "
+    return (base * (size // len(base) + 1))[:size]
+
+
+def _fill(factory, sessions: int, turns: int, size: int) -> List[Any]:
+    out = []
+    for s in range(sessions):
+        mem = factory()
+        for t in range(turns):
+            # 角色字符串动态拼出，模拟从网络/JSON 反序列化得到的非驻留字符串
+            mem.add("".join(["us", "er"]) if t % 2 == 0 else "".join(["assis", "tant"]), _content(s, t, size))
+        out.append(mem)
+    return out
+
+
+def _measure(name: str, factory, sessions: int, turns: int, size: int) -> Dict[str, Any]:
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    t0 = time.perf_counter()
+    mems = _fill(factory, sessions, turns, size)
+    fill_s = time.perf_counter() - t0
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    t0 = time.perf_counter()
+    for m in mems:
+        for item in m.as_list():
+            item["content"]
+    as_list_s = time.perf_counter() - t0
+
+    retained = sum(len(m.messages) for m in mems)
+    return {
+        "layout": name,
+        "sessions": sessions,
+        "messages_retained": retained,
+        "bytes_total": current - base,
+        "bytes_peak": peak - base,
+        "bytes_per_1k_sessions": (current - base) * 1000 // max(sessions, 1),
+        "bytes_per_message": (current - base) // max(retained, 1),
+        "fill_seconds": round(fill_s, 4),
+        "as_list_seconds": round(as_list_s, 4),
+    }
+
+
+def run(sessions: int = 1000, turns: int = 40, size: int = 200) -> List[Dict[str, Any]]:
+    """
+    前两行在相同的保留条数下对比消息布局（compact 的缓冲不设上限）；
+    第三行是默认的环形缓冲上限（memory_max_turns），单独体现截断保留条数带来的节省。
+    """
+    return [
+        _measure("legacy(dataclass+list)", _LegacyMemory, sessions, turns, size),
+        _measure("compact(slots)", lambda: ConversationMemory(messages=deque()), sessions, turns, size),
+        _measure(f"compact(ring={settings.memory_max_turns})", ConversationMemory, sessions, turns, size),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ConversationMemory 每 1k 会话内存占用基准")
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--turns", type=int, default=40, help="每个会话写入的消息条数（不触发 LLM 压缩）")
+    parser.add_argument("--size", type=int, default=200, help="每条消息的字符数")
+    parser.add_argument("--json", action="store_true", help="输出机器可读 JSON")
+    args = parser.parse_args()
+
+    rows = run(args.sessions, args.turns, args.size)
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return
+
+    print(f"memory_max_turns={settings.memory_max_turns}  sessions={args.sessions}  turns={args.turns}  size={args.size}")
+    print("（前两行保留条数相同，对比消息布局；ring 行为环形缓冲截断后的占用）")
+    for r in rows:
+        print(f"{r['layout']:<24} retained={r['messages_retained']:>7}  "
+              f"per_1k_sessions={r['bytes_per_1k_sessions'] / 1024 / 1024:8.2f} MiB  "
+              f"per_msg={r['bytes_per_message']:>6} B  as_list={r['as_list_seconds']:.4f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# 长会话浸泡测试：离线替身驱动 ask/critique/continue_dialog 多轮循环，逐轮 tracemalloc 剖析并检测持续增长
+# 用法：python -m src.bench.soak [--turns 60] [--window 8] [--json]
+import argparse
+import json
+from typing import Any, Dict
+
+from src.agent.profiling import TurnProfiler
+from src.bench.fakes import FakeChatModel, FakeMCPClient, make_agent, overridden
+
+_SCRIPT = [
+    ("ask", "如何设计一个支持上传和随机播放的猜歌网站"),
+    ("continue", "后端用 Spring Boot 3.2 可以吗"),
+    ("critique", "请补充 MySQL 表结构设计的细节"),
+    ("ask", "前端音频播放有哪些坑"),
+    ("continue", "部署用 Docker Compose 需要注意什么"),
+]
+
+
+def run(turns: int = 60, window: int = 8) -> Dict[str, Any]:
+    with overridden(debug=True, profile_memory=True):
+        agent = make_agent(FakeChatModel(), FakeMCPClient(), session_id="soak")
+        # 浸泡测试关注增长曲线，逐轮摘要不打印
+        agent.profiler = TurnProfiler(window=window, quiet=True)
+
+        for i in range(turns):
+            kind, text = _SCRIPT[i % len(_SCRIPT)]
+            text = f"{text}（第{i + 1}轮）"
+            if kind == "ask":
+                agent.ask(text)
+            elif kind == "critique":
+                agent.critique(text)
+            else:
+                agent.continue_dialog(text)
+
+    report = agent.profiler.report()
+    report["per_turn"] = [
+        {k: t[k] for k in ("turn", "kind", "traced_bytes", "delta_bytes", "monotonic_growth")}
+        for t in agent.profiler.turns
+    ]
+    report["store"] = agent.store.stats()
+    report["messages_retained"] = len(agent.memory.messages)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ResearchAgent 长会话内存浸泡测试")
+    parser.add_argument("--turns", type=int, default=60)
+    parser.add_argument("--window", type=int, default=8, help="判定持续增长所看的轮数")
+    parser.add_argument("--json", action="store_true", help="输出机器可读 JSON")
+    args = parser.parse_args()
+
+    report = run(args.turns, args.window)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    print(f"轮数: {report['turns']}  增长: {report['growth_bytes'] / 1024:.1f}KiB  "
+          f"每轮: {report['growth_per_turn'] / 1024:.2f}KiB  持续增长: {report['monotonic_growth']}")
+    print("按模块累计增长（前 10）：")
+    for mod, size in list(report["growth_by_module"].items())[:10]:
+        print(f"  {mod:<40} {size / 1024:+10.1f}KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,17 +8,49 @@ import os
 class Settings:
     # 通用开关
     debug: bool = True
+    # 逐轮 tracemalloc 内存剖析（仅在 debug 为 True 时生效），以及判定持续增长所看的轮数
+    profile_memory: bool = False
+    profile_growth_window: int = 5
 
     # 记忆 & 压缩
-    memory_max_turns: int = 12
+    memory_max_turns: int = 12  # 单会话消息环形缓冲的上限（条），超出时丢弃最旧的消息
     memory_compress_after: int = 8
     memory_keep_last_n: int = 4
+    # 记忆压缩在每轮结束后以 background 类别在后台执行，结果在下一次写入记忆时生效；False 时在本轮内同步压缩
+    memory_compress_background: bool = True
+
+    # 长期记忆归档：被压缩淘汰的消息写入本地 BM25 索引（按会话或用户分文件）
+    memory_archive_enabled: bool = True
+    memory_archive_dir: str = ".cache/memory_archive"
+    memory_archive_chunk_chars: int = 600
+    memory_archive_top_k: int = 3
+    # 归档上限：单个文件在内存与磁盘上最多保留的块数（超出时淘汰最旧的块）；
+    # 目录保留策略：超过 max_age_days 未写入的文件、以及按最近写入排在 max_files 之后的文件在启动时删除（0 表示不限）
+    memory_archive_max_chunks: int = 2000
+    memory_archive_max_age_days: float = 30.0
+    memory_archive_max_files: int = 200
+
+    # 上下文组装：agents.yaml 未配置 context_budget_tokens 时的默认预算，以及必定保留的最近消息条数
+    context_budget_tokens: int = 8000
+    context_recent_messages: int = 4
+
+    # token 计数："exact" 为 tiktoken 精确计数，"approx" 为按字符类别的快速估算（python -m src.main --calibrate-tokens
+    # 对照参考分词器校准，结果写入 token_estimator_path）。token_count_modes 按调用点覆盖：
+    # memory（记忆长度与压缩统计）、context（上下文候选打包，最终预算检查仍为精确计数）、synthesis（分治阈值）、
+    # usage（响应缺少 usage_metadata 时的用量估算，本身即为估计值）、dry_run（预估模式的提示词大小）
+    token_count_mode: str = "exact"
+    token_count_modes: Dict[str, str] = field(default_factory=lambda: {"usage": "approx", "dry_run": "approx"})
+    token_estimator_path: str = ".cache/token_estimator.json"
 
     # MCP / 搜索：默认改为读取 mcp.json（你已有此文件）
     # 可以通过环境变量 MCP_CONFIG_PATH 覆盖（推荐在 CI/部署中使用）
     mcp_config_path: str = "src/mcp/mcp.json"
     enable_search_tool: bool = True
     search_tool_name: str = "web_search"
+    # MCP 响应流式解析：正文最多读取的字节数、每次调用最多保留的结果条数、单条结果正文的最大字符数（0 表示不限）
+    mcp_response_max_bytes: int = 2 * 1024 * 1024
+    mcp_max_results: int = 20
+    mcp_snippet_max_chars: int = 4000
 
     # agents 配置文件（可用环境变量 AGENTS_CONFIG_PATH 覆盖）
     agents_config_path: Optional[str] = None
@@ -29,6 +61,85 @@ class Settings:
     # 其他默认
     max_subquestions: int = 5
 
+    # 分治综合：搜索片段打包后超过该 token 数时，按子问题并发综合再合并（0 表示关闭）
+    synthesis_map_reduce_tokens: int = 6000
+    synthesis_map_max_tokens: int = 1024
+
+    # 增量规划：追问时告诉规划器已覆盖的子问题，并复用等价子问题的旧搜索结果
+    delta_planning: bool = True
+    subq_registry_size: int = 64        # 每个会话登记的子问题数上限（按最近使用淘汰）
+    subq_reuse_threshold: float = 0.75  # 词项 Jaccard 相似度不低于该值视为同一子问题
+
+    # 质疑模式："full" 每次生成完整的改进回答；"patch" 只生成需要修改的章节并在本地修补上一轮回答
+    critique_mode: str = "full"
+
+    # 规划模式："fixed" 固定请求 max_subquestions 个子问题；"adaptive" 按复杂度/负载/预算决定扇出
+    planner_mode: str = "fixed"
+    adaptive_simple_threshold: float = 0.2  # 复杂度低于该值视为简单查询，跳过规划直接搜索
+    adaptive_queue_high: int = 8            # 进程内未完成调用数超过该值时收窄扇出
+    adaptive_min_budget_s: float = 60.0     # 剩余预算低于该值时子问题数减半
+
+    # 启动预热：后台加载编码器、预连接 MCP 与推理端点；probe 会真正调用一次模型（消耗配额）
+    warmup_enabled: bool = True
+    warmup_mcp_initialize: bool = True
+    warmup_probe: bool = False
+
+    # 技术方案分段并行生成：并发章节数、失败章节的重试轮数、骨架与单章节的 max_tokens
+    report_workers: int = 4
+    report_section_retries: int = 2
+    report_skeleton_max_tokens: int = 2048
+    report_section_max_tokens: int = 4096
+    # 增量修订技术方案：最多发送的章节数与补丁输出的 max_tokens
+    report_revision_max_sections: int = 4
+    report_revision_max_tokens: int = 4096
+    # 引用校对：删除 URL 不在调研数据中的引用（默认只标记不删除）
+    citation_drop_unverified: bool = False
+
+    # 单轮时间预算（秒，None 或 0 表示不限时）与各阶段的超时/降级参数
+    turn_budget_s: Optional[float] = 180.0
+    search_concurrency: int = 4
+    search_timeout_s: float = 30.0
+    synthesis_grace_s: float = 20.0  # 预算耗尽时仍给综合阶段的最短时间
+    degraded_max_tokens: int = 2048  # 压力等级 2 时综合的 max_tokens，等级 3 时减半
+
+    # 调用调度：进程内同时在途的 LLM / MCP 调用上限，以及各优先级类别的在途上限（未列出的类别不单独限制）
+    # 类别从高到低：interactive（提问）、critique（质疑）、background（不在用户等待路径上的后台任务，如后台记忆压缩）、batch（批处理）
+    scheduler_llm_concurrency: int = 8
+    scheduler_mcp_concurrency: int = 8
+    scheduler_class_caps: Dict[str, int] = field(default_factory=lambda: {"background": 2, "batch": 4})
+
+    # 分阶段模型路由（agents.yaml 的 stages）：延迟/错误率按指数滑动平均统计，样本数达到 router_min_samples 后才判定超标
+    router_latency_threshold_s: float = 60.0  # 阶段未配置 latency_threshold_s 时的默认延迟阈值
+    router_error_threshold: float = 0.3
+    router_ewma_alpha: float = 0.3
+    router_min_samples: int = 3
+    router_probe_interval_s: float = 60.0     # 主模型被降级后，每隔该秒数放行一次以刷新统计
+
+    # token 用量账本（本地 SQLite，可用环境变量 USAGE_LEDGER_PATH 覆盖路径）与预算
+    # 预算为 None 表示不限；用量达到 budget_downgrade_ratio 后降级（agents.yaml 的 budget_model、子问题减半、
+    # 每个子问题最多 budget_downgrade_results 条结果），达到 100% 后拒绝新的模型调用
+    ledger_enabled: bool = True
+    ledger_path: str = ".cache/usage_ledger.sqlite3"
+    budget_session_tokens: Optional[int] = None
+    budget_user_daily_tokens: Optional[int] = None
+    budget_downgrade_ratio: float = 0.8
+    budget_downgrade_results: int = 3
+
+    # 预估（dry run）：账本中没有对应阶段的历史调用、会话中也没有已有搜索结果时使用的假设
+    dry_run_results_per_subq: int = 5       # 每个新子问题的结果条数
+    dry_run_result_tokens: int = 150        # 每条结果（标题 + 片段 + URL）的 token 数
+    dry_run_mcp_latency_s: float = 3.0      # 单次 MCP 搜索耗时
+    dry_run_output_tokens: int = 1024       # 单次生成的输出 token 数（不超过该调用的 max_tokens）
+    dry_run_decode_tokens_per_s: float = 30.0
+    dry_run_plan_cache_size: int = 16       # 预估时生成的计划缓存条数，随后的 ask 直接复用
+
+    # 录制/回放（环境变量 CASSETTE_MODE / CASSETTE_PATH / CASSETTE_LATENCY_SCALE 可覆盖）：
+    # "record" 把每次 LLM 与 MCP 交互写入 cassette_path，"replay" 从中回放，耗时按 cassette_latency_scale 缩放
+    cassette_mode: Optional[str] = None
+    cassette_path: str = ".cache/cassettes/session.jsonl.gz"
+    cassette_latency_scale: float = 1.0
+    cassette_strict: bool = False  # 为 False 时键不匹配的请求按录制顺序回放同类的下一条记录
+
     def __post_init__(self):
         try:
             from dotenv import load_dotenv
@@ -81,6 +192,30 @@ class Settings:
             raise KeyError(f"在 agents.yaml 中未找到 agent: {agent_key}")
         return cfg
 
+    def resolve_archive_dir(self) -> Path:
+        """
+        返回长期记忆归档目录（支持环境变量 MEMORY_ARCHIVE_DIR）
+        """
+        return self._resolve_path(os.getenv("MEMORY_ARCHIVE_DIR") or self.memory_archive_dir)
+
+    def resolve_cassette_path(self) -> Path:
+        """
+        返回录制/回放文件路径（支持环境变量 CASSETTE_PATH）
+        """
+        return self._resolve_path(os.getenv("CASSETTE_PATH") or self.cassette_path)
+
+    def resolve_ledger_path(self) -> Path:
+        """
+        返回 token 用量账本路径（支持环境变量 USAGE_LEDGER_PATH）
+        """
+        return self._resolve_path(os.getenv("USAGE_LEDGER_PATH") or self.ledger_path)
+
+    def resolve_token_estimator_path(self) -> Path:
+        """
+        返回 token 估算器校准文件路径（支持环境变量 TOKEN_ESTIMATOR_PATH）
+        """
+        return self._resolve_path(os.getenv("TOKEN_ESTIMATOR_PATH") or self.token_estimator_path)
+
     def resolve_mcp_config_path(self) -> Path:
         """
         返回解析后的 MCP 配置路径（支持环境变量 MCP_CONFIG_PATH）
@@ -1,4 +1,6 @@
 from src.agent import ResearchAgent
+from src.agent.singleflight import metrics as singleflight_metrics
+from src.agent.scheduler import metrics as scheduler_metrics
 from src.config.settings import settings
 
 def print_mcp_usage(search_data):
@@ -72,8 +74,8 @@ def print_mcp_usage(search_data):
     else:
         print("🎯 未使用任何 MCP 服务（可能调用失败或返回空结果）")
 
-def print_search_results(search_data):
-    """打印搜索结果"""
+def print_search_results(search_data, agent=None):
+    """打印搜索结果（结果正文以句柄形式保存时，通过 agent.snippet 取回）"""
     print("\n🔍 搜索结果详情:")
     print("-" * 30)
 
@@ -81,13 +83,15 @@ def print_search_results(search_data):
     for i, block in enumerate(search_data, 1):
         results = block.get("results", [])
         if results:
-            print(f"\n📋 子问题 {i}: {block.get('subq', 'N/A')}")
+            reused = "（复用之前的结果）" if block.get("reused") else ""
+            print(f"\n📋 子问题 {i}: {block.get('subq', 'N/A')}{reused}")
             for j, result in enumerate(results, 1):
                 title = result.get('title', '(无标题)')
-                snippet = result.get('snippet', '(无摘要)')
+                snippet = (agent.snippet(result) if agent else result.get('snippet', '')) or '(无摘要)'
                 url = result.get('url', '(无URL)')
+                ref = f"[{result['ref']}] " if 'ref' in result else ""
 
-                print(f"  🌐 网站 {j}: {title}")
+                print(f"  🌐 网站 {j}: {ref}{title}")
                 print(f"     URL: {url}")
                 print(f"     摘要: {snippet[:200]}{'...' if len(snippet) > 200 else ''}")
                 total_sites += 1
@@ -97,6 +101,30 @@ def print_search_results(search_data):
     else:
         print(f"\n📊 共找到 {total_sites} 个相关网站")
 
+def print_cut_notice(cut, elapsed_s=None):
+    """本轮因时间预算或用户中断被截断时，说明哪些部分不完整"""
+    if not cut:
+        return
+    parts = []
+    if cut.get("interrupted"):
+        parts.append("用户中断")
+    if cut.get("plan"):
+        parts.append("规划未完成，使用原始问题")
+    if cut.get("subquestions"):
+        parts.append(f"省略 {len(cut['subquestions'])} 个子问题")
+    if cut.get("search"):
+        parts.append(f"{len(cut['search'])} 个搜索被取消")
+    if cut.get("max_tokens"):
+        parts.append(f"生成长度降为 {cut['max_tokens']}")
+    if cut.get("synthesis"):
+        parts.append("综合未完成，展示原始资料")
+    if cut.get("budget") == "downgraded":
+        parts.append("接近 token 预算，已改用小模型并减少子问题")
+    if cut.get("budget") == "refused":
+        parts.append("token 预算已用完")
+    suffix = f"（耗时 {elapsed_s}s）" if elapsed_s is not None else ""
+    print(f"\n⏱️  本轮结果不完整{suffix}: {'; '.join(parts)}")
+
 def interactive_dialog():
     """多轮对话交互界面"""
     print("🤖 AI 研究助手 (输入 'quit' 或 'q' 退出)")
@@ -110,7 +138,7 @@ def interactive_dialog():
 
     # 初始化智能体
     agent = ResearchAgent(agent_key="research")
-    print("✅ 研究助手已初始化")
+    print("✅ 研究助手已初始化（后台预热中）" if agent.warmup.started else "✅ 研究助手已初始化")
 
     conversation_count = 0
 
@@ -142,7 +170,7 @@ def interactive_dialog():
                 # 打印 MCP 使用情况
                 if "new_search_raw" in critique_result and critique_result["new_search_raw"]:
                     print_mcp_usage(critique_result["new_search_raw"])
-                    print_search_results(critique_result["new_search_raw"])
+                    print_search_results(critique_result["new_search_raw"], agent)
 
                 print("\n✅ 改进回答：")
                 print(critique_result["critique_result"]["improved_answer"])
@@ -153,10 +181,15 @@ def interactive_dialog():
                 # 打印 MCP 使用情况
                 if "search_raw" in r:
                     print_mcp_usage(r["search_raw"])
-                    print_search_results(r["search_raw"])
+                    print_search_results(r["search_raw"], agent)
 
                 print("\n✅ 回答：")
                 print(r["answer_markdown"])
+                print_cut_notice(r.get("cut") or {}, r.get("elapsed_s"))
+
+            print(agent.usage_line())
+            if conversation_count == 1:
+                print(agent.warmup.summary_line())
 
             # 显示对话状态
             state = agent.export_state()
@@ -164,6 +197,13 @@ def interactive_dialog():
             print("\n📊 对话状态:")
             print(f"   上下文长度: {len(compressed_ctx)} 字符")
             print(f"   消息历史: {len(state['messages'])} 条消息")
+            if settings.debug:
+                m = singleflight_metrics()
+                print(f"   请求合并: MCP {m['mcp']['coalesced']}/{m['mcp']['calls'] + m['mcp']['coalesced']}, "
+                      f"LLM {m['llm']['coalesced']}/{m['llm']['calls'] + m['llm']['coalesced']}")
+                waits = {name: s["classes"]["interactive"] for name, s in scheduler_metrics().items()}
+                print(f"   排队等待(交互, 均值/p95): LLM {waits['llm']['wait_mean_s']}/{waits['llm']['wait_p95_s']}s, "
+                      f"MCP {waits['mcp']['wait_mean_s']}/{waits['mcp']['wait_p95_s']}s")
 
         except KeyboardInterrupt:
             print("\n👋 用户中断，再见！")
@@ -192,6 +232,97 @@ def demo():
     print(f"压缩上下文: {len(state['compressed_context'])} 字符")
     print(f"消息历史: {len(state['messages'])} 条消息")
 
+def report_mode(requirement_path):
+    """技术方案模式：先调研需求，再分段并行生成技术方案 JSON"""
+    from pathlib import Path
+    import json
+
+    requirement = Path(requirement_path).read_text(encoding="utf-8").strip()
+    agent = ResearchAgent(agent_key="research")
+    print("🔍 正在调研需求...")
+    r = agent.ask(requirement)
+    print("🏗️  正在分段生成技术方案...")
+    report = agent.generate_report(requirement, r["search_raw"])
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    stats = agent.last_report_stats
+    print(f"\n📊 生成耗时 {stats['wall_seconds']}s（串行约 {stats['skeleton_seconds'] + stats['sections_serial_seconds']:.1f}s，"
+          f"加速 {stats['speedup']}x）")
+    if stats["failed_sections"]:
+        print(f"⚠️  以下章节生成失败: {', '.join(stats['failed_sections'])}")
+    cites = stats["citations"]
+    print(f"🔗 引用校对: {cites['cited']} 条参考文献，重编号 {len(cites['renumbered'])} 处，"
+          f"删除无效标注 {len(cites['dropped_markers'])} 个")
+    if cites["unverified"]:
+        print(f"⚠️  以下引用不在调研数据中: {', '.join(u['url'] for u in cites['unverified'])}")
+
+def revise_mode(requirement_path, plan_path, feedback):
+    """增量修订模式：按反馈修订已有的技术方案 JSON，只发送大纲和涉及的章节"""
+    from pathlib import Path
+    import json
+
+    requirement = Path(requirement_path).read_text(encoding="utf-8").strip()
+    previous_plan = Path(plan_path).read_text(encoding="utf-8")
+    agent = ResearchAgent(agent_key="research")
+    print("✏️  正在增量修订技术方案...")
+    report = agent.revise_report(requirement, previous_plan, feedback)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    stats = agent.last_report_stats
+    if stats.get("mode") == "patch":
+        print(f"\n📊 修订章节: {', '.join(stats['sections'])}；应用 {len(stats['applied'])} 处，"
+              f"拒绝 {len(stats['rejected'])} 处；提示词 {stats['prompt_tokens']} tokens"
+              f"（原方案 {stats['previous_plan_tokens']} tokens），耗时 {stats['wall_seconds']}s")
+
+def print_dry_run(est):
+    """打印 dry_run 预估结果"""
+    if est.get("refused"):
+        print(est["message"])
+        return
+    source = {"llm": "已规划", "cache": "复用缓存的计划", "given": "使用给定计划", "skipped": "简单查询，跳过规划"}
+    print(f"🧮 预估: {est['query']}")
+    print(f"   子问题 {est['subquestions']} 个（{source.get(est['plan_source'], est['plan_source'])}），"
+          f"命中已有搜索 {len(est['cache_hits'])} 个，需新搜索 {len(est['to_search'])} 个")
+    for sq in est["to_search"]:
+        print(f"     🔎 {sq}")
+    for sq in est["cache_hits"]:
+        print(f"     ♻️  {sq}")
+    mode = "分治综合" if est["synthesis_mode"] == "map_reduce" else "一次综合"
+    print(f"   MCP 调用 {est['mcp_calls']} 次，预计 {est['expected_results']} 条结果，片段约 {est['packed_snippet_tokens']} tokens（{mode}）")
+    if est["research_data_tokens"] is not None:
+        print(f"   技术方案调研资料约 {est['research_data_tokens']} tokens")
+    print(f"   模型调用 {est['llm_calls']} 次，输入约 {est['input_tokens']} / 输出约 {est['output_tokens']} tokens"
+          + (f"，费用约 {est['cost']:.4f}" if est["cost"] else ""))
+    s = est["seconds"]
+    print(f"   预计耗时 {s['total']}s（规划 {s['plan']}s + 搜索 {s['search']}s + 综合 {s['synthesis']}s"
+          + (f" + 技术方案 {s['report']}s" if s["report"] else "") + "）")
+    defaults = sorted(stage for stage, basis in est["history_basis"].items() if basis == "default")
+    if defaults:
+        print(f"   ℹ️  以下阶段没有历史调用记录，按默认生成速度估算: {', '.join(defaults)}")
+    if est["over_turn_budget"]:
+        print(f"   ⚠️  预计超过本轮时间预算 {settings.turn_budget_s}s，实际执行时会被截断")
+    if est["budget_level"]:
+        print("   ⚠️  接近 token 预算，实际执行时会降级" if est["budget_level"] == 1 else "   ⛔ token 预算已用完")
+
+def dry_run_mode(argv):
+    """预估模式：只做规划，预估一轮研究（及技术方案生成）的 token、MCP 调用、费用与耗时"""
+    import argparse
+    import json
+    from pathlib import Path
+
+    parser = argparse.ArgumentParser(prog="python -m src.main --dry-run", description="预估一轮研究的成本与耗时")
+    parser.add_argument("query", help="研究问题，或以 @ 开头的需求文件路径")
+    parser.add_argument("--report", action="store_true", help="同时预估技术方案生成")
+    parser.add_argument("--json", action="store_true", help="输出机器可读 JSON")
+    args = parser.parse_args(argv)
+
+    query = Path(args.query[1:]).read_text(encoding="utf-8").strip() if args.query.startswith("@") else args.query
+    # 预估模式不做启动预热：不预连接 MCP / 推理端点，也不发 initialize
+    agent = ResearchAgent(agent_key="research", warm_up=False)
+    est = agent.dry_run(query, report=args.report)
+    if args.json:
+        print(json.dumps(est, ensure_ascii=False, indent=2))
+    else:
+        print_dry_run(est)
+
 if __name__ == "__main__":
     # 确保配置加载
     settings.load_agents()
@@ -199,5 +330,17 @@ if __name__ == "__main__":
     import sys
     if len(sys.argv) > 1 and sys.argv[1] == "--demo":
         demo()
+    elif len(sys.argv) > 2 and sys.argv[1] == "--report":
+        report_mode(sys.argv[2])
+    elif len(sys.argv) > 4 and sys.argv[1] == "--revise":
+        revise_mode(sys.argv[2], sys.argv[3], sys.argv[4])
+    elif len(sys.argv) > 1 and sys.argv[1] == "--usage":
+        from src.agent.ledger import main as usage_report
+        usage_report(sys.argv[2:])
+    elif len(sys.argv) > 2 and sys.argv[1] == "--dry-run":
+        dry_run_mode(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == "--calibrate-tokens":
+        from src.agent.tokens import main as calibrate_tokens
+        calibrate_tokens(sys.argv[2:])
     else:
         interactive_dialog()
\ No newline at end of file
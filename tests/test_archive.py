@@ -0,0 +1,42 @@
+import os
+import time
+
+from src.agent.archive import MemoryArchive, open_archive, prune_archives
+
+
+def _msgs(*texts):
+    return [{"role": "user", "content": t} for t in texts]
+
+
+def test_oldest_chunks_are_evicted_from_index_and_file(tmp_path):
+    archive = MemoryArchive("s", base_dir=tmp_path, max_chunks=3)
+    archive.add_messages(_msgs("postgres replication lag", "redis cluster failover"))
+    archive.add_messages(_msgs("kafka consumer rebalance", "nginx upstream timeout", "grpc deadline propagation"))
+    assert len(archive) == 3
+    assert archive.search("postgres") == []
+    assert archive.search("grpc")[0]["text"] == "grpc deadline propagation"
+    assert archive._df["postgres"] == 0
+
+    reloaded = MemoryArchive("s", base_dir=tmp_path, max_chunks=3)
+    assert [c["text"] for c in reloaded._chunks] == [c["text"] for c in archive._chunks]
+    assert len(archive.path.read_text(encoding="utf-8").splitlines()) == 3
+
+
+def test_prune_archives_by_age_and_count(tmp_path):
+    now = time.time()
+    for i, age_days in enumerate([0, 1, 2, 40]):
+        path = tmp_path / f"session-{i}.jsonl"
+        path.write_text("{}\n", encoding="utf-8")
+        os.utime(path, (now - age_days * 86400, now - age_days * 86400))
+    keep = tmp_path / "session-2.jsonl"
+    removed = prune_archives(tmp_path, max_age_days=30, max_files=2, keep=keep)
+    assert sorted(p.name for p in removed) == ["session-3.jsonl"]
+    assert sorted(p.name for p in tmp_path.glob("*.jsonl")) == ["session-0.jsonl", "session-1.jsonl", "session-2.jsonl"]
+    prune_archives(tmp_path, max_age_days=30, max_files=2)
+    assert sorted(p.name for p in tmp_path.glob("*.jsonl")) == ["session-0.jsonl", "session-1.jsonl"]
+
+
+def test_sessions_of_one_user_share_an_archive(tmp_path):
+    first = open_archive("user-1", base_dir=tmp_path)
+    assert open_archive("user-1", base_dir=tmp_path) is first
+    assert open_archive("user-2", base_dir=tmp_path) is not first
@@ -0,0 +1,37 @@
+import time
+
+from src.agent.cassette import Cassette
+
+
+def _record(path, n):
+    tape = Cassette(path, "record")
+    for i in range(n):
+        tape.llm(("k", i), lambda i=i: f"answer {i}")
+    return tape
+
+
+def test_gzip_recording_survives_missing_close(tmp_path):
+    path = tmp_path / "session.jsonl.gz"
+    _record(path, 2)  # 不调用 close，模拟进程被杀死
+    intact = path.stat().st_size
+    _record(path, 1)
+    # 最后一条记录只写了一半
+    path.write_bytes(path.read_bytes()[:intact + (path.stat().st_size - intact) // 2])
+    tape = Cassette(path, "replay", latency_scale=0)
+    assert len(tape._order["llm"]) == 2
+    assert tape.llm(("k", 1), None).content == "answer 1"
+
+
+def test_mcp_replay_waits_ttfb_before_body(tmp_path):
+    path = tmp_path / "session.jsonl"
+    path.write_text('{"kind":"mcp","key":"q","status":200,"url":"u","headers":{},"body":"[1,2,3]",'
+                    '"ttfb_s":0.2,"total_s":0.3}\n', encoding="utf-8")
+    tape = Cassette(path, "replay")
+    t0 = time.perf_counter()
+    resp = tape.http("q", None)
+    first = time.perf_counter() - t0
+    body = b"".join(resp.iter_content(chunk_size=2))
+    total = time.perf_counter() - t0
+    assert body == b"[1,2,3]"
+    assert 0.2 <= first < 0.28
+    assert total >= 0.29
@@ -0,0 +1,30 @@
+from src.agent.citations import reconcile_citations
+
+
+def _urls(n):
+    return {i: {"url": f"https://example.com/doc{i}", "title": f"doc{i}"} for i in range(1, n + 1)}
+
+
+def test_url_list_is_authoritative_over_model_references():
+    url_list = _urls(10)
+    report = {
+        "design_philosophy": "A [2] B [5] C [9]",
+        "references": [url_list[2], url_list[5], url_list[9]],
+    }
+    out, issues = reconcile_citations(report, url_list)
+    assert out["design_philosophy"] == "A [1] B [2] C [3]"
+    assert [r["url"] for r in out["references"]] == [url_list[n]["url"] for n in (2, 5, 9)]
+    assert issues["dropped_markers"] == []
+    assert issues["unverified"] == []
+
+
+def test_model_references_fill_numbers_missing_from_url_list():
+    url_list = _urls(2)
+    report = {
+        "design_philosophy": "A [1] B [3]",
+        "references": [url_list[1], url_list[2], {"url": "https://spring.io/docs", "title": "Spring"}],
+    }
+    out, issues = reconcile_citations(report, url_list, drop_unverified=False)
+    assert out["design_philosophy"] == "A [1] B [2]"
+    assert out["references"][1]["url"] == "https://spring.io/docs"
+    assert issues["unverified"] == [{"n": 2, "url": "https://spring.io/docs"}]
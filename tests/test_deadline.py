@@ -0,0 +1,55 @@
+import threading
+import time
+
+import pytest
+
+from src.agent.deadline import Deadline, call_timeout, cancelled, map_with_deadline, run_with_deadline
+
+
+def test_abandoned_tasks_receive_cancel_signal():
+    seen = threading.Event()
+
+    def slow(i):
+        if i == 0:
+            return "fast"
+        for _ in range(100):
+            if cancelled():
+                seen.set()
+                return None
+            time.sleep(0.01)
+        return "slow"
+
+    results, unfinished, interrupted = map_with_deadline(slow, [0, 1], Deadline(0.1))
+    assert results == {0: "fast"}
+    assert unfinished == [1] and not interrupted
+    assert seen.wait(2)
+
+
+def test_call_timeout_shrinks_to_task_deadline():
+    assert call_timeout(30) == 30
+    results, _, _ = map_with_deadline(lambda cap: call_timeout(cap, floor=0.0), [30, None], Deadline(2))
+    assert 0 < results[0] <= 2
+    assert 0 < results[1] <= 2
+
+
+def test_interrupted_stage_receives_cancel_signal(monkeypatch):
+    import src.agent.deadline as deadline_mod
+
+    started, seen = threading.Event(), threading.Event()
+
+    def stage():
+        started.set()
+        for _ in range(200):
+            if cancelled():
+                seen.set()
+                return
+            time.sleep(0.01)
+
+    def interrupted_wait(futures, timeout=None):
+        started.wait(2)
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(deadline_mod, "wait", interrupted_wait)
+    with pytest.raises(KeyboardInterrupt):
+        run_with_deadline(stage, Deadline(5))
+    assert seen.wait(2)
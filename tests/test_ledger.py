@@ -0,0 +1,58 @@
+import sqlite3
+
+import pytest
+
+from src.agent.ledger import UsageLedger, budget_level
+from src.config.settings import settings
+
+
+@pytest.fixture
+def book(tmp_path):
+    return UsageLedger(tmp_path / "ledger.sqlite3")
+
+
+def _spend(book, tokens, session="s1", user="u1"):
+    book.record(session, user, "synthesize", "m", tokens, 0, 1.0)
+
+
+def test_session_budget_downgrades_then_refuses(book, monkeypatch):
+    monkeypatch.setattr(settings, "budget_session_tokens", 1000)
+    monkeypatch.setattr(settings, "budget_user_daily_tokens", None)
+    monkeypatch.setattr(settings, "budget_downgrade_ratio", 0.8)
+    _spend(book, 700)
+    assert budget_level(book, "s1", "u1") == 0
+    _spend(book, 100)
+    assert budget_level(book, "s1", "u1") == 1
+    _spend(book, 200)
+    assert budget_level(book, "s1", "u1") == 2
+    assert budget_level(book, "s2", "u1") == 0
+
+
+def test_user_daily_budget_counts_only_that_day(book, monkeypatch):
+    monkeypatch.setattr(settings, "budget_session_tokens", None)
+    monkeypatch.setattr(settings, "budget_user_daily_tokens", 1000)
+    _spend(book, 900, session="s1")
+    _spend(book, 200, session="s2")
+    book._db.execute("UPDATE calls SET day = '2000-01-01' WHERE session = 's2'")
+    assert book.totals(user="u1", day="2000-01-01")["total_tokens"] == 200
+    assert budget_level(book, "s3", "u1") == 1
+    assert budget_level(book, "s3", "u1", day="2000-01-01") == 0
+    assert budget_level(book, "s3", None) == 0
+
+
+def test_old_ledger_gets_shared_column(tmp_path):
+    path = tmp_path / "old.sqlite3"
+    db = sqlite3.connect(str(path))
+    db.execute("CREATE TABLE calls (ts REAL NOT NULL, day TEXT NOT NULL, session TEXT NOT NULL, user TEXT, "
+               "stage TEXT, model TEXT, input_tokens INTEGER NOT NULL, output_tokens INTEGER NOT NULL, "
+               "latency_s REAL NOT NULL, ok INTEGER NOT NULL, estimated INTEGER NOT NULL DEFAULT 0, "
+               "cost REAL NOT NULL DEFAULT 0)")
+    db.execute("INSERT INTO calls VALUES (0, '2024-01-01', 's', 'u', 'plan', 'm', 10, 5, 2.0, 1, 0, 0)")
+    db.commit()
+    db.close()
+
+    book = UsageLedger(path)
+    book.record("s", "u", "plan", "m", 10, 5, 9.0, shared=True)
+    assert book.totals(session="s")["total_tokens"] == 30
+    stats = book.latency_stats("plan")
+    assert stats["calls"] == 1 and stats["avg_latency_s"] == 2.0
@@ -0,0 +1,53 @@
+import io
+import json
+
+from src.agent.mcp_response import read_results
+
+
+class _Response:
+    """最小的 requests.Response 替身：按块返回正文。"""
+
+    def __init__(self, body: bytes, chunk: int = 7):
+        self._body = io.BytesIO(body)
+        self._chunk = chunk
+        self.encoding = "utf-8"
+        self.closed = False
+
+    def iter_content(self, chunk_size: int = 1):
+        while True:
+            data = self._body.read(self._chunk)
+            if not data:
+                return
+            yield data
+
+    def close(self):
+        self.closed = True
+
+
+def _read(payload, **kwargs):
+    return read_results(_Response(json.dumps(payload).encode("utf-8")), "http://mcp", **kwargs)
+
+
+def test_results_key_preferred_over_earlier_data():
+    results, _ = _read({"data": [1, 2], "results": [{"title": "t", "url": "u"}]})
+    assert results == [{"title": "t", "url": "u"}]
+
+
+def test_data_used_when_results_absent():
+    results, stats = _read({"data": [1, 2, 3], "total": 3}, max_results=2)
+    assert results == [1, 2]
+    assert not stats["partial"]
+
+
+def test_results_array_stops_early():
+    results, stats = _read({"results": [{"snippet": "x" * 50}] * 10}, max_results=3, snippet_chars=5)
+    assert results == [{"snippet": "xxxxx…"}] * 3
+    assert stats["early_stop"]
+
+
+def test_cancel_stops_reading_and_closes_response():
+    resp = _Response(json.dumps({"results": [{"title": str(i)} for i in range(50)]}).encode("utf-8"))
+    calls = []
+    results, stats = read_results(resp, "http://mcp", cancel=lambda: calls.append(1) or len(calls) > 3)
+    assert stats["cancelled"] and resp.closed
+    assert stats["bytes"] == 3 * 7
@@ -0,0 +1,41 @@
+import threading
+
+from src.agent.memory import ConversationMemory
+from src.agent.scheduler import current
+
+
+def _memory(summarizer):
+    memory = ConversationMemory(compress_after=4, keep_last_n=2, token_mode="approx")
+    memory.summarizer_llm = summarizer
+    for i in range(4):
+        memory.add("user" if i % 2 == 0 else "assistant", f"消息 {i}")
+    return memory
+
+
+def test_background_compression_runs_as_background_and_applies_on_next_add():
+    seen, gate = [], threading.Event()
+
+    def summarizer(prompt):
+        seen.append(current()[0])
+        gate.wait(5)
+        return "摘要"
+
+    memory = _memory(summarizer)
+    memory.maybe_compress(background=True)
+    assert memory.compressed_context is None and len(memory.messages) == 4
+    memory.add("user", "消息 4")  # 压缩尚未完成：不阻塞，也不应用
+    assert len(memory.messages) == 5
+    gate.set()
+    memory.flush()
+    assert seen == ["background"]
+    assert memory.compressed_context == "摘要"
+    assert [m.content for m in memory.messages] == ["消息 2", "消息 3", "消息 4"]
+    assert memory.last_compression["messages"] == 2
+
+
+def test_foreground_compression_keeps_caller_class():
+    seen = []
+    memory = _memory(lambda prompt: seen.append(current()[0]) or "摘要")
+    memory.maybe_compress()
+    assert seen == ["interactive"]
+    assert [m.content for m in memory.messages] == ["消息 2", "消息 3"]
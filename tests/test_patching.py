@@ -0,0 +1,59 @@
+from src.agent.patching import apply_patch, apply_section_edits, markdown_outline, split_sections
+
+_ANSWER = "# 猜歌网站设计\n简介\n\n## 后端\nSpring Boot\n\n## 数据库\n旧的表结构\n\n## 部署\nDocker"
+
+
+def test_lone_title_is_not_the_section_level():
+    sections = split_sections(_ANSWER)
+    assert [s["title"] for s in sections] == ["", "后端", "数据库", "部署"]
+    assert sections[0]["text"].startswith("# 猜歌网站设计")
+    assert len(markdown_outline(_ANSWER).splitlines()) == 4
+
+
+def test_replace_edits_section_in_place():
+    out, applied, errors = apply_section_edits(
+        _ANSWER, [{"action": "replace", "section": "数据库", "content": "新的表结构"}])
+    assert applied == ["数据库"] and errors == []
+    assert "旧的表结构" not in out
+    assert out.index("## 数据库\n新的表结构") < out.index("## 部署")
+    assert out.count("数据库") == 1
+
+
+def test_replace_of_missing_section_is_an_error():
+    out, applied, errors = apply_section_edits(
+        _ANSWER, [{"action": "replace", "section": "缓存", "content": "Redis"}])
+    assert out == _ANSWER
+    assert applied == [] and errors == ["缓存: 章节不存在"]
+
+
+def test_add_after_and_remove():
+    out, applied, errors = apply_section_edits(_ANSWER, [
+        {"action": "add", "section": "缓存", "after": "数据库", "content": "Redis"},
+        {"action": "remove", "section": "部署"},
+    ])
+    assert applied == ["缓存", "部署"] and errors == []
+    assert [s["title"] for s in split_sections(out)] == ["", "后端", "数据库", "缓存"]
+    assert "## 缓存\nRedis" in out
+
+
+def test_apply_patch_applies_valid_ops_and_rejects_the_rest():
+    new_text = "首先采用前后端分离，其次使用 Spring Boot 提高开发效率，最后用 MySQL 存储。"
+    plan = {"project_name": "猜歌", "keywords": ["音乐"], "design_philosophy": "旧", "references": []}
+    ops = [
+        {"op": "replace", "path": "/design_philosophy", "value": new_text},
+        {"op": "replace", "path": "/design_philosophy", "value": "太短"},
+        {"op": "add", "path": "/keywords/-", "value": "游戏"},
+        {"op": "replace", "path": "/references", "value": []},
+        {"op": "replace", "path": "/keywords", "value": "不是数组"},
+        {"op": "remove", "path": "/project_name"},
+    ]
+    doc, applied, errors = apply_patch(plan, ops)
+    assert applied == ["/design_philosophy", "/keywords/-"]
+    assert doc["design_philosophy"] == new_text and doc["keywords"] == ["音乐", "游戏"]
+    assert len(errors) == 4
+    assert plan["keywords"] == ["音乐"]
+
+
+def test_apply_patch_remove_section_sets_null():
+    doc, applied, errors = apply_patch({"database_design": "建表"}, [{"op": "remove", "path": "/database_design"}])
+    assert doc == {"database_design": None} and applied == ["/database_design"] and errors == []
@@ -0,0 +1,53 @@
+import pytest
+
+from src.agent.router import ModelRouter
+from src.config.settings import settings
+
+
+@pytest.fixture
+def router(monkeypatch):
+    monkeypatch.setattr(settings, "router_min_samples", 2)
+    monkeypatch.setattr(settings, "router_ewma_alpha", 0.5)
+    monkeypatch.setattr(settings, "router_error_threshold", 0.3)
+    monkeypatch.setattr(settings, "router_probe_interval_s", 60.0)
+    return ModelRouter({
+        "model": "main", "budget_model": "small",
+        "stages": {"synthesize": {"model": "big", "latency_threshold_s": 5, "fallback": ["backup"]}},
+    })
+
+
+def test_primary_until_enough_samples_then_fallback_on_latency(router):
+    router.record("synthesize", "big", 20.0, ok=True)
+    assert router.choose("synthesize") == "big"
+    router.record("synthesize", "big", 20.0, ok=True)
+    assert router.choose("synthesize") == "backup"
+    assert router.switches == 1
+
+
+def test_fallback_on_errors_and_recovery(router):
+    assert router.choose("synthesize") == "big"
+    for _ in range(2):
+        router.record("synthesize", "big", 1.0, ok=False)
+    assert router.choose("synthesize") == "backup"
+    for _ in range(6):
+        router.record("synthesize", "big", 1.0, ok=True)
+    assert router.choose("synthesize") == "big"
+
+
+def test_degraded_primary_is_probed_after_interval(router, monkeypatch):
+    import src.agent.router as router_mod
+
+    now = [1000.0]
+    monkeypatch.setattr(router_mod.time, "monotonic", lambda: now[0])
+    for _ in range(2):
+        router.record("synthesize", "big", 20.0, ok=True)
+    assert router.choose("synthesize") == "big"  # 首次选择前没有 last_used，按到期放行
+    assert router.choose("synthesize") == "backup"
+    now[0] += 61
+    assert router.choose("synthesize") == "big"
+    assert router.choose("synthesize") == "backup"
+
+
+def test_budget_downgrade_and_unconfigured_stage(router):
+    assert router.choose("synthesize", downgrade=True) == "small"
+    assert router.choose("plan") == "main"
@@ -0,0 +1,31 @@
+import threading
+
+from src.agent.scheduler import PriorityExecutor, scheduling
+
+
+def test_executor_runs_interactive_before_queued_batch():
+    pool = PriorityExecutor("test-pool", 1)
+    gate = threading.Event()
+    order = []
+    with scheduling("batch", "b"):
+        blocker = pool.submit(gate.wait)
+        batch = [pool.submit(order.append, f"batch{i}") for i in range(3)]
+    with scheduling("interactive", "i"):
+        interactive = pool.submit(order.append, "interactive")
+    gate.set()
+    for fut in [blocker, *batch, interactive]:
+        fut.result(timeout=5)
+    assert order[0] == "interactive"
+    assert pool.stats()["classes"]["interactive"]["admitted"] == 1
+
+
+def test_cancelled_task_releases_its_queue_position():
+    pool = PriorityExecutor("test-pool", 1)
+    gate = threading.Event()
+    blocker = pool.submit(gate.wait)
+    queued = pool.submit(lambda: "never")
+    assert queued.cancel()
+    gate.set()
+    blocker.result(timeout=5)
+    assert pool.submit(lambda: "ok").result(timeout=5) == "ok"
+    assert pool.stats()["classes"]["interactive"]["queued"] == 0
@@ -0,0 +1,61 @@
+import threading
+
+import pytest
+
+from src.agent.singleflight import FlightTimeout, SingleFlight
+
+
+def _leader(flight, key, fn):
+    """在后台线程中发起调用，返回 (线程, 结果列表)；等 fn 开始执行后再返回。"""
+    out = []
+
+    def run():
+        try:
+            out.append(flight.do(key, fn))
+        except BaseException as e:
+            out.append(e)
+
+    th = threading.Thread(target=run)
+    th.start()
+    return th, out
+
+
+def test_follower_shares_result_and_is_notified():
+    flight = SingleFlight("test")
+    started, gate = threading.Event(), threading.Event()
+    th, _ = _leader(flight, "k", lambda: (started.set(), gate.wait(), "value")[2])
+    started.wait(5)
+    shared = []
+    threading.Timer(0.05, gate.set).start()
+    assert flight.do("k", lambda: "own", timeout=5, on_shared=shared.append) == "value"
+    th.join(5)
+    assert shared == ["value"]
+    assert flight.stats()["calls"] == 1
+
+
+def test_follower_times_out_on_its_own_deadline():
+    flight = SingleFlight("test")
+    started, gate = threading.Event(), threading.Event()
+    th, _ = _leader(flight, "k", lambda: (started.set(), gate.wait())[1])
+    started.wait(5)
+    with pytest.raises(FlightTimeout):
+        flight.do("k", lambda: "own", timeout=0.05)
+    gate.set()
+    th.join(5)
+
+
+def test_leader_interrupt_is_not_raised_in_followers():
+    flight = SingleFlight("test")
+    started, gate = threading.Event(), threading.Event()
+
+    def interrupted():
+        started.set()
+        gate.wait()
+        raise KeyboardInterrupt
+
+    th, out = _leader(flight, "k", interrupted)
+    started.wait(5)
+    threading.Timer(0.05, gate.set).start()
+    assert flight.do("k", lambda: "own", timeout=5) == "own"
+    th.join(5)
+    assert isinstance(out[0], KeyboardInterrupt)
@@ -0,0 +1,11 @@
+from src.agent.store import canonical_url
+
+
+def test_tracking_parameters_are_dropped():
+    assert canonical_url("https://Example.com/a/?utm_source=x&spm=1.2&id=3#top") == "https://example.com/a?id=3"
+
+
+def test_query_parameters_that_look_like_tracking_are_kept():
+    assert canonical_url("https://example.com/s?from=2020&to=2021") != canonical_url("https://example.com/s?from=2019&to=2021")
+    assert canonical_url("https://example.com/s?from_date=1") != canonical_url("https://example.com/s?from_date=2")
+    assert canonical_url("https://example.com/s?spmx=1") != canonical_url("https://example.com/s?spmx=2")
@@ -0,0 +1,25 @@
+import pytest
+
+from src.agent import tokens
+
+
+def _corpus(n=30):
+    return [f"第{i}段 mixed calibration text sample {'word ' * (i % 7)}{'数据' * (i % 5)} {i * 37}, ok." for i in range(n)]
+
+
+def test_calibration_reports_held_out_error(monkeypatch):
+    # 参考分词器是特征的线性函数（取整）时，留出集误差应很小
+    truth = (1.5, 1.0, 1.0, 0.0, 0.5, 1.0, 0.0)
+    monkeypatch.setattr(tokens, "_reference", lambda _: ("linear", lambda t: round(
+        sum(w * c for w, c in zip(truth, tokens.features(t))))))
+    est = tokens.calibrate(_corpus(), folds=5)
+    assert est.error["folds"] == 5
+    assert est.error["samples"] == 30
+    assert est.error_bound < 0.1
+    assert "in_sample_p95_rel" in est.error
+
+
+def test_calibration_rejects_tiny_corpus(monkeypatch):
+    monkeypatch.setattr(tokens, "_reference", lambda _: ("len", len))
+    with pytest.raises(ValueError):
+        tokens.calibrate(_corpus(6), folds=5)